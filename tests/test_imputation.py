@@ -0,0 +1,127 @@
+"""
+Compare imputation.find_gaps() and impute_gaps() with the per-column
+search of find_nan() and the per-region impute() they replaced.
+
+"""
+
+from datetime import timedelta
+
+import numpy as np
+import pandas as pd
+
+from timeseries_scripts.imputation import find_gaps, impute_gaps
+
+TSOS = ['DE-50Hertz', 'DE-Amprion', 'DE-TenneT', 'DE-TransnetBW']
+
+
+def column_gaps(frame):
+    """The regions of find_nan() before find_gaps(), column by column."""
+    gaps = []
+    for c in range(len(frame.columns)):
+        col = frame.iloc[:, c]
+        if col.first_valid_index() is None:
+            continue
+        # but not before first or after last actual entry
+        tag = ((col.index >= col.first_valid_index()) &
+               (col.index <= col.last_valid_index()) &
+               col.isnull().values)
+        tag = pd.Series(tag, index=col.index)
+        start_idx = col.index[tag & ~tag.shift(1).fillna(False).astype(bool)]
+        till_idx = col.index[tag & ~tag.shift(-1).fillna(False).astype(bool)]
+        one_period = frame.index[1] - frame.index[0]
+        for start, till in zip(start_idx, till_idx):
+            gaps.append((c, start, till, (till - start + one_period) //
+                         one_period))
+
+    return gaps
+
+
+def assert_gaps_equal(frame):
+    gaps = [(int(column), pd.Timestamp(start), pd.Timestamp(till), int(count))
+            for column, start, till, count in find_gaps(frame)]
+    assert gaps == column_gaps(frame)
+
+
+def test_gaps_at_first_and_last_row():
+    index = pd.date_range('2016-01-01', periods=12, freq='15min')
+    nan = np.nan
+    frame = pd.DataFrame({
+        # leading and trailing NaNs are no region
+        'leading': [nan, nan, 1, 2, nan, 4, 5, 6, 7, 8, 9, nan],
+        # regions right after the first and before the last entry
+        'inner': [1, nan, nan, 4, 5, 6, 7, 8, 9, 10, nan, 12],
+        'full': np.arange(12.0),
+        'empty': [nan] * 12,
+        'single': [nan] * 5 + [1] + [nan] * 6},
+        index=index, columns=['leading', 'inner', 'full', 'empty', 'single'])
+
+    assert_gaps_equal(frame)
+    assert len(find_gaps(frame)) == 3
+
+
+def test_random_gaps():
+    index = pd.date_range('2016-03-26', periods=500, freq='60min')
+    values = np.random.RandomState(0).rand(500, 8)
+    values[values < 0.3] = np.nan
+    values[:20, 2] = np.nan
+    values[-20:, 3] = np.nan
+
+    assert_gaps_equal(pd.DataFrame(values, index=index))
+
+
+def impute(frame, gaps):
+    """The guesses of impute() before impute_gaps(), region by region."""
+    one_period = frame.index[1] - frame.index[0]
+    filled = frame.copy()
+    for column, start, till, count in gaps:
+        if count <= timedelta(hours=2) // one_period:
+            continue
+        col_name = frame.columns[column]
+        start, till = pd.Timestamp(start), pd.Timestamp(till)
+        day_before = pd.date_range(start - timedelta(hours=24),
+                                   start - one_period, freq=one_period)
+        to_fill = pd.date_range(start, till, freq=one_period)
+        # impute() failed here, impute_gaps() leaves the region as it is
+        if day_before[0] < frame.index[0]:
+            continue
+
+        other_tsos = [tso for tso in TSOS if tso != col_name[1]]
+        similar = frame.loc[:, (col_name[0], other_tsos, col_name[2])]
+        similar = similar.loc[day_before.append(to_fill)].dropna(
+            axis=1, how='any')
+        similar = frame.loc[:, similar.columns].sum(axis=1)
+        factor = (similar.loc[day_before].sum() /
+                  frame.loc[day_before, col_name].sum())
+
+        filled.loc[to_fill, col_name] = similar.loc[to_fill] / float(factor)
+
+    return filled
+
+
+def test_impute_gaps():
+    index = pd.date_range('2016-01-01', periods=4 * 96, freq='15min')
+    columns = pd.MultiIndex.from_tuples(
+        [(variable, tso, 'generation', 'source', 'url')
+         for variable in ['wind', 'solar'] for tso in TSOS])
+    state = np.random.RandomState(0)
+    values = state.rand(len(index), len(columns)) * 1000
+    frame = pd.DataFrame(values, index=index, columns=columns)
+
+    wind = ('wind', 'DE-TenneT', 'generation', 'source', 'url')
+    other = ('wind', 'DE-Amprion', 'generation', 'source', 'url')
+    solar = ('solar', 'DE-50Hertz', 'generation', 'source', 'url')
+    frame.loc['2016-01-02 10:00':'2016-01-02 15:45', wind] = np.nan
+    # Another TSO with a gap in the window is not summed up
+    frame.loc['2016-01-02 04:00':'2016-01-02 05:00', other] = np.nan
+    frame.loc['2016-01-03 20:00':'2016-01-04 02:00', solar] = np.nan
+    # Too short to guess
+    frame.loc['2016-01-03 01:00':'2016-01-03 02:00', wind] = np.nan
+    # No complete day before
+    frame.loc['2016-01-01 12:00':'2016-01-01 18:00', solar] = np.nan
+
+    gaps = find_gaps(frame)
+    filled, was_filled = impute_gaps(frame, gaps, list(frame.columns))
+
+    pd.testing.assert_frame_equal(filled, impute(frame, gaps))
+    assert (was_filled == (frame.isnull() & filled.notnull()).values).all()
+    assert was_filled.sum() == 24 + 25
@@ -0,0 +1,64 @@
+"""
+Compare merge.merge() with the repeated combine_first() calls it replaced.
+
+"""
+
+from functools import reduce
+
+import numpy as np
+import pandas as pd
+
+from timeseries_scripts.merge import merge
+
+
+def combine_first(frames):
+    """The merge of read() before merge.merge()."""
+    frames = [frame for frame in frames if not frame.empty]
+    return reduce(lambda data_set, df: data_set.combine_first(df), frames)
+
+
+def frame(start, periods, columns, seed):
+    index = pd.date_range(start, periods=periods, freq='15min',
+                          name='timestamp')
+    values = np.random.RandomState(seed).rand(periods, len(columns))
+    values[values < 0.2] = np.nan
+    return pd.DataFrame(values, index=index, columns=columns)
+
+
+def assert_frame_equal(result, expected):
+    # combine_first keeps the freq of the union index, merge does not. The
+    # order of MultiIndex columns from combine_first depends on the pandas
+    # version, merge always sorts them.
+    pd.testing.assert_frame_equal(result, expected.sort_index(axis=1),
+                                  check_freq=False)
+
+
+def test_overlap_first_wins():
+    frames = [frame('2016-01-01 00:00', 96, ['a', 'b'], 0),
+              frame('2016-01-01 12:00', 96, ['b', 'c'], 1),
+              frame('2016-01-01 06:00', 10, ['a'], 2)]
+
+    result = merge(frames)
+
+    assert_frame_equal(result, combine_first(frames))
+    # Where the first frame has a value, it is kept
+    first = frames[0]['b'].dropna()
+    assert (result.loc[first.index, 'b'] == first).all()
+
+
+def test_disjoint_and_empty():
+    frames = [frame('2016-01-02', 8, ['a'], 3),
+              pd.DataFrame(),
+              frame('2016-01-01', 8, ['a'], 4)]
+
+    assert_frame_equal(merge(frames), combine_first(frames))
+
+
+def test_multiindex_columns():
+    columns = pd.MultiIndex.from_tuples(
+        [('wind', 'DE', 'generation'), ('solar', 'DE', 'generation'),
+         ('load', 'DE', 'load')])
+    frames = [frame('2016-01-01', 12, columns[:2], 5),
+              frame('2016-01-01 02:00', 12, columns[1:], 6)]
+
+    assert_frame_equal(merge(frames), combine_first(frames))
@@ -0,0 +1,65 @@
+"""
+Compare timezones.to_utc() with the tz_localize/tz_convert pairs it
+replaced.
+
+"""
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from timeseries_scripts.timezones import to_utc
+
+
+def localize(index, tz_name, ambiguous):
+    """The conversion in the readers before timezones.to_utc()."""
+    utc = index.tz_localize(tz_name, ambiguous=ambiguous).tz_convert(None)
+    return pd.DatetimeIndex(np.asarray(utc.values, dtype='datetime64[ns]'),
+                            name=utc.name)
+
+
+@pytest.mark.parametrize('tz_name', ['Europe/Berlin', 'Europe/Brussels',
+                                     'Europe/Copenhagen'])
+def test_fall_day_infer(tz_name):
+    # The hour from 2:00 to 2:59 is given twice on the last Sunday of
+    # October 2016
+    index = pd.date_range('2016-10-30', '2016-10-30 02:45', freq='15min')
+    index = index.append(pd.date_range('2016-10-30 02:00', '2016-10-31',
+                                       freq='15min'))
+
+    pd.testing.assert_index_equal(to_utc(index, tz_name, ambiguous='infer'),
+                                  localize(index, tz_name, 'infer'))
+
+
+@pytest.mark.parametrize('summer', [True, False])
+def test_fall_day_one_hour(summer):
+    # Files with only one of the two hours
+    index = pd.date_range('2016-10-30', '2016-10-31', freq='60min')
+    policy = 'summer' if summer else 'winter'
+    dst = [summer] * len(index)
+
+    pd.testing.assert_index_equal(
+        to_utc(index, 'Europe/Berlin', ambiguous=policy),
+        localize(index, 'Europe/Berlin', dst))
+    pd.testing.assert_index_equal(
+        to_utc(index, 'Europe/Berlin', ambiguous=dst),
+        localize(index, 'Europe/Berlin', dst))
+
+
+def test_spring_day():
+    # The hour from 2:00 to 2:59 is skipped on the last Sunday of March 2016
+    index = pd.date_range('2016-03-27', '2016-03-28', freq='15min')
+    index = index[(index.hour != 2)]
+
+    pd.testing.assert_index_equal(to_utc(index, 'Europe/Berlin'),
+                                  localize(index, 'Europe/Berlin', 'infer'))
+
+
+def test_spring_day_nonexistent():
+    index = pd.date_range('2016-03-27', '2016-03-28', freq='15min')
+
+    with pytest.raises(Exception):
+        to_utc(index, 'Europe/Berlin')
+    with pytest.raises(Exception):
+        localize(index, 'Europe/Berlin', 'infer')
+    assert to_utc(index, 'Europe/Berlin', nonexistent='drop').isnull().sum() == 4
@@ -9,4 +9,6 @@ __init__.py : required so files in this folder can be imported as by other scrip
 
 from . import download
 from . import read
-from . import imputation
\ No newline at end of file
+from . import imputation
+from . import manifest
+from . import scheduler
\ No newline at end of file
@@ -0,0 +1,132 @@
+"""
+Open Power System Data
+
+Timeseries Datapackage
+
+benchmark.py : measure the throughput of the download against the local
+fake server
+
+"""
+
+import argparse
+import logging
+import os
+import shutil
+import tempfile
+import time
+
+import pandas as pd
+import yaml
+
+from .download import download
+from .fake_server import FakeServer
+from .manifest import FILENAME
+
+logger = logging.getLogger('log')
+
+
+def benchmark(sources, start_from_user, end_from_user, workers=(1, 8),
+              host_limit=2, latency=0.05, size=100000):
+    """
+    Download all files for sources from a FakeServer once for each number
+    of workers and report the throughput.
+
+    Parameters
+    ----------
+    sources : dict
+        Dict of download parameters specific to each source, pointing to the
+        real servers.
+    start_from_user : datetime.date
+        Start of period for which to download the data.
+    end_from_user : datetime.date
+        End of period for which to download the data.
+    workers : list of int, default (1, 8)
+        Numbers of parallel downloads to compare. 1 is the serial download.
+    host_limit : int, default 2
+        Passed on to download().
+    latency : float, default 0.05
+        Seconds the fake server waits before answering a request.
+    size : int, default 100000
+        Size of the files served, in bytes.
+
+    Returns
+    ----------
+    results : pandas.DataFrame
+        One row per number of workers with the number of requests, files and
+        bytes downloaded, the seconds taken, files/s and MB/s.
+
+    """
+
+    results = []
+    with FakeServer(latency=latency, size=size) as server:
+        fake_sources = server.rewrite(sources)
+        for n in workers:
+            out_path = tempfile.mkdtemp(prefix='opsd_benchmark_')
+            requests_before = server.requests
+            try:
+                started = time.time()
+                download(fake_sources, out_path,
+                         start_from_user=start_from_user,
+                         end_from_user=end_from_user,
+                         workers=n, host_limit=host_limit)
+                seconds = time.time() - started
+                files, size_total = count_files(out_path)
+            finally:
+                shutil.rmtree(out_path)
+
+            results.append({'workers': n,
+                            'requests': server.requests - requests_before,
+                            'files': files,
+                            'bytes': size_total,
+                            'seconds': seconds,
+                            'files/s': files / seconds,
+                            'MB/s': size_total / seconds / 1e6})
+            logger.info('%s workers: %s files in %.1f s', n, files, seconds)
+
+    columns = ['workers', 'requests', 'files', 'bytes', 'seconds',
+               'files/s', 'MB/s']
+
+    return pd.DataFrame(results, columns=columns).set_index('workers')
+
+
+def count_files(out_path):
+    """Return the number and total size of the files downloaded to out_path."""
+    files = 0
+    size_total = 0
+    for root, dirs, filenames in os.walk(out_path):
+        for filename in filenames:
+            if filename.startswith(FILENAME):
+                continue
+            files += 1
+            size_total += os.path.getsize(os.path.join(root, filename))
+
+    return files, size_total
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Compare serial and parallel download from a local '
+                    'fake server')
+    parser.add_argument('sources_yaml_path', type=str)
+    parser.add_argument('--start', type=str, default='2016-01-01')
+    parser.add_argument('--end', type=str, default='2016-03-31')
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 8])
+    parser.add_argument('--host-limit', type=int, default=2)
+    parser.add_argument('--latency', type=float, default=0.05)
+    parser.add_argument('--size', type=int, default=100000)
+    parser.add_argument('--csv', type=str, default=None,
+                        help='also write the results to this file')
+    args = parser.parse_args()
+
+    logging.basicConfig(level='INFO')
+    with open(args.sources_yaml_path, 'r') as f:
+        sources = yaml.safe_load(f.read())
+
+    results = benchmark(sources,
+                        pd.Timestamp(args.start).date(),
+                        pd.Timestamp(args.end).date(),
+                        workers=args.workers, host_limit=args.host_limit,
+                        latency=args.latency, size=args.size)
+    print(results.to_string(float_format='{:.2f}'.format))
+    if args.csv:
+        results.to_csv(args.csv)
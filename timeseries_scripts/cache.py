@@ -0,0 +1,155 @@
+"""
+Open Power System Data
+
+Timeseries Datapackage
+
+cache.py : keep the DataFrames parsed from the downloaded files on disk
+
+"""
+
+import hashlib
+import logging
+import os
+
+import pandas as pd
+
+logger = logging.getLogger('log')
+
+SUFFIX = '.pickle'
+
+
+class FrameCache(object):
+    """
+    Directory of DataFrames parsed from downloaded files, so that a file is
+    parsed only once as long as neither it nor its read function changes.
+
+    Each frame is stored in its own pickle file, which holds the column
+    blocks as plain arrays and loads far faster than HDF5 for the many small
+    frames (e.g. one per day for PSE). The file is named after a key derived
+    from the content of the parsed file, the read function and its version,
+    the arguments passed to it and the pandas version (see key()). When the
+    directory grows beyond max_size, the least recently used frames are
+    deleted.
+
+    Instances only hold the path, the size limit and the number of frames
+    taken from the cache so far (hits), so they can be passed to worker
+    processes.
+
+    Parameters
+    ----------
+    path : str
+        Directory to keep the frames in. Created if missing.
+    max_size : int, default 2 * 1024 ** 3
+        Size in bytes the directory may occupy after evict().
+
+    """
+
+    def __init__(self, path, max_size=2 * 1024 ** 3):
+        self.path = path
+        self.max_size = max_size
+        self.hits = 0
+        os.makedirs(path, exist_ok=True)
+
+    @staticmethod
+    def key(checksum, reader, version, *args):
+        """
+        Return the key for the output of a read function.
+
+        Parameters
+        ----------
+        checksum : str
+            SHA-256 hex digest of the parsed file, e.g. from the Manifest
+        reader : str
+            Name of the read function
+        version : int
+            Version of the read function, to be increased whenever its
+            output changes
+        *args
+            Further arguments the output depends on, e.g. variable_name, url
+            and headers
+
+        """
+
+        # Pickles are only safe to load with the pandas version writing them
+        parts = ([checksum, reader, str(version), pd.__version__] +
+                 [repr(arg) for arg in args])
+        return hashlib.sha256('|'.join(parts).encode('utf-8')).hexdigest()
+
+    def _filepath(self, key):
+        return os.path.join(self.path, key + SUFFIX)
+
+    def get(self, key):
+        """Return the frame stored under key, None if there is none."""
+        filepath = self._filepath(key)
+        try:
+            df = pd.read_pickle(filepath)
+        except FileNotFoundError:
+            return None
+        except Exception:
+            # Corrupt, truncated or written by an incompatible pandas
+            logger.warning('Discarding unreadable cached frame %s', filepath,
+                           exc_info=True)
+            try:
+                os.remove(filepath)
+            except OSError:
+                pass
+            return None
+        self.hits += 1
+
+        # The modification time marks the last use, for evict()
+        try:
+            os.utime(filepath, None)
+        except OSError:
+            pass
+
+        return df
+
+    def put(self, key, df):
+        """Store df under key."""
+        filepath = self._filepath(key)
+        # Write to a temporary file first, so that a reader in another
+        # process never sees a half-written frame
+        tmp_path = '{}.{}.tmp'.format(filepath, os.getpid())
+        try:
+            df.to_pickle(tmp_path)
+            os.replace(tmp_path, filepath)
+        except Exception:
+            logger.exception('Could not cache parsed frame in %s', filepath)
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+        return
+
+    def evict(self):
+        """
+        Delete the least recently used frames until the directory is no
+        larger than max_size. Returns the number of frames deleted.
+
+        """
+
+        stored = []
+        for filename in os.listdir(self.path):
+            if not filename.endswith(SUFFIX):
+                continue
+            try:
+                stat = os.stat(os.path.join(self.path, filename))
+            except OSError:
+                continue  # evicted by another process meanwhile
+            stored.append((stat.st_mtime, stat.st_size, filename))
+
+        size = sum(entry[1] for entry in stored)
+        count = 0
+        for mtime, file_size, filename in sorted(stored):
+            if size <= self.max_size:
+                break
+            try:
+                os.remove(os.path.join(self.path, filename))
+            except OSError:
+                pass
+            size -= file_size
+            count += 1
+
+        if count:
+            logger.info('Evicted %s frames from %s', count, self.path)
+
+        return count
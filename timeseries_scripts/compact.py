@@ -0,0 +1,179 @@
+"""
+Open Power System Data
+
+Timeseries Datapackage
+
+compact.py : optional compact representation of the data sets, with float32
+values and integer column ids instead of the column MultiIndex
+
+"""
+
+import logging
+
+import numpy as np
+import pandas as pd
+
+logger = logging.getLogger('log')
+
+COMPACT_DTYPE = 'float32'
+ID_NAME = 'column_id'
+
+
+def marker_key(names):
+    """
+    Return the column key of the marker column appended by find_nan() for
+    a column MultiIndex with the levels names.
+
+    """
+
+    return ('comment',) + ('',) * (len(names) - 1)
+
+
+def register(keys, catalog=None, names=None):
+    """
+    Add column keys to a catalog, each one that is not in it yet with the
+    next free id.
+
+    Parameters
+    ----------
+    keys : iterable of tuple
+        Column keys, e.g. ('wind', 'DE-tennet', 'generation', source, url)
+    catalog : pandas.DataFrame, default None
+        Catalog to add to, as returned by compact(). None starts a new one.
+    names : list of str, default None
+        Level names of the keys, e.g. headers. Required for a new catalog.
+
+    Returns
+    ----------
+    catalog : pandas.DataFrame
+        One row per column id, one column per level of the keys. The key of
+        the marker column is always included, see marker_key().
+
+    """
+
+    if catalog is None:
+        catalog = pd.DataFrame(columns=list(names))
+        catalog.index.name = ID_NAME
+        keys = [marker_key(names)] + list(keys)
+
+    known = set(column_ids(catalog))
+    new = []
+    for key in keys:
+        key = tuple(key)
+        if key not in known and key not in new:
+            new.append(key)
+    if not new:
+        return catalog
+
+    start = int(catalog.index.max()) + 1 if len(catalog) else 0
+    added = pd.DataFrame(new, columns=catalog.columns,
+                         index=pd.Index(np.arange(start, start + len(new)),
+                                        name=ID_NAME))
+
+    return pd.concat([catalog, added])
+
+
+def column_ids(catalog):
+    """Return a dict mapping the column keys in catalog to their ids."""
+    return {tuple(row): column_id
+            for column_id, row in zip(catalog.index, catalog.values)}
+
+
+def column_id(catalog, key):
+    """Return the id of the column key in catalog."""
+    return column_ids(catalog)[tuple(key)]
+
+
+def column_key(catalog, column_id):
+    """Return the column key of the id column_id in catalog."""
+    return tuple(catalog.loc[column_id])
+
+
+def compact(frame, catalog=None, dtype=COMPACT_DTYPE):
+    """
+    Convert a DataFrame with a column MultiIndex to the compact
+    representation: Each column is labeled by its integer id in a catalog
+    of the column keys, so aligning, copying and pickling the frame no
+    longer involves the long source and url labels, and numeric values are
+    stored as float32.
+
+    The values are converted column by column, so that only one column is
+    held twice at a time.
+
+    Parameters
+    ----------
+    frame : pandas.DataFrame
+        DataFrame with a column MultiIndex, e.g. as returned by read()
+    catalog : pandas.DataFrame, default None
+        Catalog of the column ids to use. Columns not in it yet are added.
+        Use the same catalog for all frames to be combined. None starts a
+        new catalog.
+    dtype : str, default 'float32'
+        Data type of the numeric columns
+
+    Returns
+    ----------
+    compacted : pandas.DataFrame
+        The data of frame, with the column ids as columns
+    catalog : pandas.DataFrame
+        The catalog, including the columns of frame
+
+    """
+
+    if len(frame.columns) == 0:
+        return frame, catalog
+
+    catalog = register(frame.columns, catalog, names=frame.columns.names)
+    ids = column_ids(catalog)
+
+    data = {}
+    for i, (key, col) in enumerate(frame.iteritems()):
+        values = col.values
+        if values.dtype.kind in 'biuf':
+            values = values.astype(dtype, copy=False)
+        data[i] = values
+
+    compacted = pd.DataFrame(data, index=frame.index,
+                             columns=range(len(frame.columns)))
+    compacted.columns = pd.Index([ids[tuple(key)] for key in frame.columns],
+                                 name=ID_NAME)
+
+    return compacted, catalog
+
+
+def expand(frame, catalog, dtype=None):
+    """
+    Convert a compact DataFrame back to one with the column MultiIndex.
+
+    Parameters
+    ----------
+    frame : pandas.DataFrame
+        DataFrame with column ids as columns, as returned by compact()
+    catalog : pandas.DataFrame
+        Catalog of the column ids
+    dtype : str, default None
+        Data type to convert the numeric columns to, e.g. 'float64'. None
+        keeps the data types.
+
+    Returns
+    ----------
+    expanded : pandas.DataFrame
+        The data of frame, with the column keys as a MultiIndex
+
+    """
+
+    if len(frame.columns) == 0:
+        return frame
+
+    if dtype is None:
+        expanded = frame.copy(deep=False)
+    else:
+        expanded = frame.apply(
+            lambda col: col.astype(dtype)
+            if col.dtype.kind in 'biuf' else col)
+
+    expanded.columns = pd.MultiIndex.from_tuples(
+        [column_key(catalog, column_id) for column_id in frame.columns],
+        names=list(catalog.columns))
+
+    return expanded
@@ -8,21 +8,75 @@ download.py : download time series files
 """
 
 import argparse
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from datetime import datetime, date, time, timedelta
 import pytz
 import logging
 import os
+import shutil
+import threading
+from urllib.parse import urlparse
 import zipfile
 import pandas as pd
 import requests
 import yaml
 
+from .manifest import archive_files, open_manifest, PARTIAL_SUFFIX
+from .profiling import report
+from .scheduler import Scheduler
+
 logger = logging.getLogger('log')
-logger.setLevel('DEBUG')
+
+# Number of bytes to write to disk at a time
+CHUNK_SIZE = 1024 * 1024
+
+# Archive of the original data on the OPSD server
+ARCHIVE_FILENAME = 'original_data.zip'
+
+# Files are written under these names until they are complete
+PARTIAL_FILENAME = 'download' + PARTIAL_SUFFIX
+VALIDATOR_FILENAME = 'validator' + PARTIAL_SUFFIX
+
+# Start of the response body from PSE if there is no file for the requested
+# URL ('Brak uprawnień' in cp1250)
+PSE_NO_FILE = b'Brak uprawnie'
+
+
+# Sessions are not shared between threads, each worker keeps its own
+_local = threading.local()
+
+
+def thread_session():
+    """Return the requests session of the calling thread."""
+    if not hasattr(_local, 'session'):
+        _local.session = requests.session()
+    return _local.session
+
+
+def load_sources(sources_yaml_path):
+    """
+    Load the download parameters from sources.yml. The paths of the
+    upload_times tables in it are relative to the file and are returned
+    relative to the working directory.
+
+    """
+
+    with open(sources_yaml_path, 'r') as f:
+        sources = yaml.safe_load(f.read())
+
+    directory = os.path.dirname(sources_yaml_path)
+    for source_dict in sources.values():
+        for param_dict in source_dict.values():
+            if param_dict.get('upload_times'):
+                param_dict['upload_times'] = os.path.join(
+                    directory, param_dict['upload_times'])
+
+    return sources
 
 
 def download(sources, out_path, archive_version=None,
-             start_from_user=None, end_from_user=None):
+             start_from_user=None, end_from_user=None,
+             workers=1, host_limit=2, update=False, extract_archive=True):
     """
     Load YAML file with sources from disk, and download all files for each
     source into the given out_path.
@@ -39,6 +93,20 @@ def download(sources, out_path, archive_version=None,
         Start of period for which to download the data.
     end_from_user : datetime.date, default None
         End of period for which to download the data.
+    workers : int, default 1
+        Number of files to download in parallel. With 1, all files are
+        downloaded one after another.
+    host_limit : int, default 2
+        Maximum number of simultaneous requests to the same server, unless
+        sources.yml declares ``max_connections`` for it. See
+        scheduler.Scheduler.from_sources().
+    update : bool, default False
+        If True, files of sources with ``end: recent`` that were downloaded
+        before the end of their period are downloaded again if they have
+        changed on the server.
+    extract_archive : bool, default True
+        If False, the archive downloaded for archive_version is not
+        extracted and the files are read from it directly.
 
     Returns
     ----------
@@ -55,52 +123,138 @@ def download(sources, out_path, archive_version=None,
             return
 
     if archive_version:
-        download_archive(archive_version)
+        download_archive(archive_version, sources, out_path,
+                         extract=extract_archive)
+        return
+
+    scheduler = Scheduler.from_sources(sources, max_connections=host_limit)
+
+    try:
+        _download_sources(sources, out_path, start_from_user, end_from_user,
+                          workers, scheduler, update)
+    finally:
+        flush_upload_times()
+
+    return
+
+
+def _download_sources(sources, out_path, start_from_user, end_from_user,
+                      workers, scheduler, update):
+    """Download the files of all sources. See download() for parameters."""
+    if workers > 1:
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = []
+            for source_name, source_dict in sources.items():
+                if not source_name == "Energinet.dk":
+                    futures.extend(download_source(
+                        source_name, source_dict, out_path,
+                        start_from_user, end_from_user,
+                        executor=executor, scheduler=scheduler,
+                        update=update))
+
+            # A failing file must not stop the downloads from other sources
+            for future in as_completed(futures):
+                try:
+                    future.result()
+                except Exception:
+                    logger.exception('Download failed')
 
     else:
         for source_name, source_dict in sources.items():
             if not source_name == "Energinet.dk":
                 download_source(source_name, source_dict, out_path,
-                                start_from_user, end_from_user)
+                                start_from_user, end_from_user,
+                                scheduler=scheduler, update=update)
 
     return
 
 
-def download_archive(archive_version):
+def download_archive(archive_version, sources=None, out_path='original_data',
+                     extract=True, workers=4):
     """
-    Download archived data from the OPSD server. See download()
-    for info on parameter.
+    Download archived data from the OPSD server and extract the files for
+    the given sources. See download() for info on parameters.
+
+    Parameters
+    ----------
+    sources : dict, default None
+        Only the files for these sources and their variables are extracted.
+        If None, all files are extracted.
+    extract : bool, default True
+        If False, the archive is not extracted. read() can read the files
+        from the archive directly.
+    workers : int, default 4
+        Number of threads extracting files in parallel.
 
     """
 
-    filepath = 'original_data.zip'
+    filepath = ARCHIVE_FILENAME
 
     if not os.path.exists(filepath):
         url = ('http://data.open-power-system-data.org/time_series/'
                '{}/original_data/{}'.format(archive_version, filepath))
-        logger.info('Downloading and extracting archived data from %s', url)
-        resp = requests.get(url)
-        with open(filepath, 'wb') as output_file:
-            for chunk in resp.iter_content(1024):
+        logger.info('Downloading archived data from %s', url)
+        resp = Scheduler().get(requests.session(), url, stream=True)
+        with resp, open(filepath + PARTIAL_SUFFIX, 'wb') as output_file:
+            for chunk in resp.iter_content(CHUNK_SIZE):
                 output_file.write(chunk)
-
-        myzipfile = zipfile.ZipFile(filepath)
-        if myzipfile.namelist()[0] == 'original_data/':
-            myzipfile.extractall()
-            logger.info('Extracted data to /original_data.')
-        else:
-            logger.warning('%s has unexpected content. Please check manually',
-                           filepath)
+        os.replace(filepath + PARTIAL_SUFFIX, filepath)
 
     else:
         logger.info('%s already exists. Delete it if you want to download again',
                     filepath)
 
+    if not extract:
+        return
+
+    with zipfile.ZipFile(filepath) as myzipfile:
+        entries = archive_files(myzipfile, sources)
+    if not entries:
+        logger.warning('%s has unexpected content. Please check manually',
+                       filepath)
+        return
+
+    # Skip files that have been extracted before
+    manifest = open_manifest(out_path)
+    entries = [entry for entry in entries
+               if manifest.lookup(entry['source'], entry['variable'],
+                                  entry['period']) is None]
+
+    # Every thread reads from its own handle on the archive
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(_extract, filepath, entries[i::workers],
+                                   out_path)
+                   for i in range(workers)]
+        for future in futures:
+            future.result()
+
+    logger.info('Extracted %s files to %s.', len(entries), out_path)
+
+    return
+
+
+def _extract(filepath, entries, out_path):
+    """Extract the archive members in entries to their containers."""
+    manifest = open_manifest(out_path)
+    with zipfile.ZipFile(filepath) as myzipfile:
+        for entry in entries:
+            container = os.path.join(out_path, entry['source'],
+                                     entry['variable'], entry['period'])
+            os.makedirs(container, exist_ok=True)
+            target = os.path.join(container, entry['filename'])
+            with myzipfile.open(entry['member']) as source_file:
+                with open(target + PARTIAL_SUFFIX, 'wb') as output_file:
+                    shutil.copyfileobj(source_file, output_file, CHUNK_SIZE)
+            os.replace(target + PARTIAL_SUFFIX, target)
+            manifest.add(entry['source'], entry['variable'], entry['period'],
+                         target)
+
     return
 
 
 def download_source(source_name, source_dict, out_path,
-                    start_from_user=None, end_from_user=None):
+                    start_from_user=None, end_from_user=None,
+                    executor=None, scheduler=None, update=False):
     """
     Download all files for source_name as specified by the given
     source_dict into out_path.
@@ -117,14 +271,23 @@ def download_source(source_name, source_dict, out_path,
         Start of period for which to download the data.
     end_from_user : datetime.date, default None
         End of period for which to download the data
+    executor : concurrent.futures.Executor, default None
+        If given, the files are submitted to the executor instead of being
+        downloaded one after another.
+    scheduler : scheduler.Scheduler, default None
+        Paces, limits and retries the requests to each server.
+    update : bool, default False
+        If True, files of variables with ``end: recent`` are downloaded
+        again if they may have been incomplete. See download_file().
 
     Returns
     ----------
-    None
+    futures : list
+        The futures of the submitted downloads. Empty if no executor is given.
 
     """
 
-    session = None
+    jobs = []  # (function, keyword arguments) for each file to download
 
     for variable_name, param_dict in source_dict.items():
         start_server = param_dict['start']
@@ -135,6 +298,9 @@ def download_source(source_name, source_dict, out_path,
         else:
             filename = None
 
+        # Only files of open-ended variables can change after download
+        update_variable = update and end_server == 'recent'
+
         if end_server == 'recent':
             end_server = datetime.now().date()
 
@@ -154,19 +320,21 @@ def download_source(source_name, source_dict, out_path,
             else:
                 pass  # do nothing
 
+        common = {'source_name': source_name,
+                  'variable_name': variable_name,
+                  'out_path': out_path,
+                  'scheduler': scheduler,
+                  'update': update_variable}
+
         if param_dict['frequency'] in ['complete', 'irregular']:
-            downloaded, session = download_file(
-                source_name,
-                variable_name,
-                out_path,
-                # param_dict,
+            jobs.append((download_file, dict(
+                common,
                 start=start_server,
                 end=end_server,
                 url_template=param_dict['url_template'],
                 url_params_template=param_dict['url_params_template'],
                 filename=filename,
-                session=session,
-            )
+            )))
 
         else:
             # The files on the servers usually contain the data for subperiods
@@ -191,174 +359,341 @@ def download_source(source_name, source_dict, out_path,
 
             if len(ends) == 0:
                 ends = pd.DatetimeIndex([end_server])
+            elif len(ends) < len(starts) and param_dict['end'] == 'recent':
+                # The period still in progress is downloaded up to now and
+                # again later, see download_file()
+                ends = ends.append(pd.DatetimeIndex([end_server]))
 
+            deviant_starts = []
             if 'deviant_urls' in param_dict:
                 for deviating in param_dict['deviant_urls']:
-                    downloaded, session = download_file(
-                        source_name,
-                        variable_name,
-                        out_path,
-                        # param_dict,
+                    deviant_starts.append(deviating['start'])
+                    jobs.append((download_file, dict(
+                        common,
                         start=deviating['start'],
                         end=deviating['end'],
                         url_template=deviating['url'],
-                        session=session,
-                    )
+                    )))
 
             for s, e in zip(starts, ends):
+                # Periods with a deviant URL are taken care of above. Skipping
+                # them here also keeps parallel downloads from writing to the
+                # same container.
+                if s.date() in deviant_starts:
+                    continue
+
+                kwargs = dict(
+                    common,
+                    start=s,
+                    end=e,
+                    url_template=param_dict['url_template'],
+                    url_params_template=param_dict['url_params_template'],
+                    filename=filename,
+                )
 
-                # The Polish TSO PSE has daily files that are usually uploaded
-                # 6 days later somtime between 17:00:10 and 17:01:30. As the exact
-                # second is unknown ex-ante, but needs to be included in the URL,
-                # we need to try out every second in that period until the file is
-                # found.
                 if source_name == 'PSE':
-                    downloaded = False
-                    for second in pd.date_range(
-                            start=datetime.combine(
-                                s + timedelta(days=6), time(17, 0, 10)),
-                            end=datetime.combine(
-                                s + timedelta(days=6), time(17, 2, 0)),
-                            freq='S'):
-                        if not downloaded:
-                            logger.debug('attempt %s', second)
-                            downloaded, session = download_file_pse(
-                                source_name,
-                                variable_name,
-                                out_path,
-                                # param_dict,
-                                start=s,
-                                end=e,
-                                url_template=param_dict['url_template'],
-                                url_params_template=param_dict[
-                                    'url_params_template'],
-                                # session=session,
-                                second=second
-                            )
-
+                    kwargs['upload_times'] = param_dict.get('upload_times')
+                    jobs.append((download_pse, kwargs))
                 else:
-                    downloaded, session = download_file(
-                        source_name,
-                        variable_name,
-                        out_path,
-                        # param_dict,
-                        start=s,
-                        end=e,
-                        url_template=param_dict['url_template'],
-                        url_params_template=param_dict['url_params_template'],
-                        filename=filename,
-                        session=session,
-                    )
+                    jobs.append((download_file, kwargs))
+
+    if executor is not None:
+        # The files from one server are downloaded one after another in as
+        # many lanes as the server accepts simultaneous requests. This way no
+        # worker sits waiting for a busy server while others could be served.
+        lanes = {}
+        for func, kwargs in jobs:
+            host = urlparse(kwargs['url_template']).netloc
+            lanes.setdefault(host, []).append((func, kwargs))
+
+        futures = []
+        for host_jobs in lanes.values():
+            url = host_jobs[0][1]['url_template']
+            count = scheduler.connections(url) if scheduler else 1
+            for i in range(min(count, len(host_jobs))):
+                futures.append(executor.submit(_run_lane, host_jobs[i::count]))
+
+        return futures
+
+    # One failing file or server must not stop the other downloads
+    _run_lane(jobs)
+
+    return []
+
+
+def is_stale(entry, end):
+    """
+    Return True if the file described by the manifest entry was downloaded
+    before the end of its period, i.e. may have been incomplete.
+
+    """
+
+    return entry['fetched'][:10] <= end.strftime('%Y-%m-%d')
+
+
+def _run_lane(jobs):
+    """
+    Run download jobs from download_source() one after another, e.g. in a
+    worker thread. A failing job does not stop the following ones.
+
+    """
+
+    for func, kwargs in jobs:
+        try:
+            func(session=thread_session(), **kwargs)
+        except Exception:
+            logger.exception('Download failed: %s %s %s',
+                             kwargs['source_name'], kwargs['variable_name'],
+                             kwargs['start'])
 
     return
 
 
-def download_file_pse(
+def download_pse(
         source_name,
         variable_name,
         out_path,
-        # param_dict,
         start,
         end,
         url_template,
         url_params_template=None,
         filename=None,
         session=None,
-        second=None):
+        scheduler=None,
+        update=False,
+        upload_times=None):
     """
-    Download a single file specified by ``param_dict``, ``start``, ``end``,
-    and save it to a directory constructed by combining ``source_name``,
-    ``variable_name`` and ``out_path``.
+    Download a single daily file from PSE. See download_file() for info on
+    the other parameters.
+
+    The Polish TSO PSE has daily files that are usually uploaded 6 days later
+    somtime between 17:00:10 and 17:02:00. As the exact second is unknown
+    ex-ante, but needs to be included in the URL, it is looked up in the
+    upload_times table or else found by find_upload_second().
 
     Parameters
     ----------
-    source_name : str
-        Name of source dataset, e.g. ``TenneT``
-    variable_name : str
-        Name of variable, e.g. ``solar``
-    out_path : str
-        Base download directory in which to save all downloaded files
-    param_dict : dict
-        Info required for download, e.g. url, url-parameter, filename. 
-    start : datetime.date
-        start of data in the file
-    end : datetime.date
-        end of data in the file
-    session : requests.session, optional
-        If not given, a new session is created.
+    upload_times : str, optional
+        Path to a YAML file mapping the day of the data to the timestamp of
+        its upload, see load_sources(). Seconds found by probing are added
+        to it. If there is no file at the second in the table, the second
+        is probed again.
 
-    Returns
-    ----------
-    downloaded : bool
-        True if download successful, False otherwise.
+    """
 
+    period = start.strftime('%Y-%m-%d') + '_' + end.strftime('%Y-%m-%d')
+    entry = open_manifest(out_path).lookup(source_name, variable_name, period)
+    if entry is not None and not (update and is_stale(entry, end)):
+        logger.info('Found local file: %s', entry['filename'])
+        return True, session
+
+    first_try = datetime.combine(start + timedelta(days=6), time(17, 0, 10))
+    if datetime.now() < first_try:
+        logger.debug('PSE file for %s not yet uploaded', start)
+        return False, session
+
+    table = load_upload_times(upload_times)
+    known = table.get(start.date() if isinstance(start, datetime) else start)
+
+    if known is not None:
+        downloaded, session = download_file(
+            source_name, variable_name, out_path, start, end, url_template,
+            url_params_template, session=session, second=known,
+            scheduler=scheduler, update=update)
+        if downloaded:
+            return downloaded, session
+        # The file may have been uploaded again at another second
+        logger.info('No PSE file at the known second %s, probing again',
+                    known)
+
+    second = find_upload_second(start, end, url_template,
+                                url_params_template,
+                                scheduler=scheduler)
+    if second is None:
+        logger.info('No PSE file found for %s', start)
+        forget_upload_time(upload_times, start)
+        return False, session
+    if second == known:
+        return False, session
+    save_upload_time(upload_times, start, second)
+
+    return download_file(source_name, variable_name, out_path, start, end,
+                         url_template, url_params_template,
+                         session=session, second=second,
+                         scheduler=scheduler,
+                         update=update)
+
+
+_upload_times = {}  # tables read from disk, by path
+_upload_times_lock = threading.Lock()
+_unsaved_upload_times = set()  # paths of tables with new entries
+
+
+def load_upload_times(path):
     """
+    Return the table of known PSE upload timestamps stored at path. The file
+    is only read on first use.
 
-    if session is None:
-        session = requests.session()
+    """
 
-    # Each file will be saved in a folder of its own, this allows us to preserve
-    # the original filename when saving to disk.
-    container = os.path.join(out_path, source_name, variable_name,
-                             start.strftime('%Y-%m-%d') + '_' +
-                             end.strftime('%Y-%m-%d'))
-    os.makedirs(container, exist_ok=True)
+    if path is None:
+        return {}
 
-    url_params = {}  # A dict for URL-parameters
-    # For most sources, we can use HTTP get method with parameters-dict
-    if url_params_template:
-        for key, value in url_params_template.items():
-            url_params[key] = value.format(
-                u_start=start,
-                u_end=end,
-                u_second=second
-            )
-        url = url_template
+    with _upload_times_lock:
+        if path not in _upload_times:
+            table = {}
+            if os.path.exists(path):
+                with open(path, 'r') as f:
+                    table = yaml.safe_load(f.read()) or {}
+            _upload_times[path] = table
 
-    # Attempt the download if there is no file yet.
-    count_files = len(os.listdir(container))
-    if count_files == 0:
-        resp = session.get(url, params=url_params)
-        if not resp.text == 'Brak uprawnieñ':
-            logger.info(
-                'Downloaded data:\n\t '
-                'Source:      {}\n\t '
-                'Variable:    {}\n\t '
-                'Data starts: {:%Y-%m-%d}\n\t '
-                'Data ends:   {:%Y-%m-%d}'
-                .format(source_name, variable_name, start, end)
-            )
+        return _upload_times[path]
 
-            # Get the original filename
-            original_filename = (
-                resp.headers['content-disposition']
-                .split('filename=')[-1]
-                .replace('"', '')
-                .replace(';', '')
-            )
-            logger.info('Downloaded from URL: %s\n\t Original filename: %s',
-                        resp.url, original_filename)
 
-            # Save file to disk
-            filepath = os.path.join(container, original_filename)
-            with open(filepath, 'wb') as output_file:
-                for chunk in resp.iter_content(1024):
-                    output_file.write(chunk)
-            downloaded = True
+def save_upload_time(path, day, second):
+    """
+    Add the upload timestamp of the file for day to the table at path. The
+    table is written to disk by flush_upload_times().
 
-        else:
-            downloaded = False
+    """
 
-    elif count_files == 1:
-        downloaded = True
-        logger.info('Found local file: %s', os.listdir(container)[0])
+    if path is None:
+        return
 
-    else:
-        downloaded = True
-        logger.info('There must not be more '
-                    'than one file in: %s. Please check ', container)
+    table = load_upload_times(path)
+    with _upload_times_lock:
+        table[day.date() if isinstance(day, datetime) else day] = (
+            second.to_pydatetime())
+        _unsaved_upload_times.add(path)
 
-    return downloaded, session
+    return
+
+
+def forget_upload_time(path, day):
+    """Remove the upload timestamp of the file for day from the table."""
+    if path is None:
+        return
+
+    table = load_upload_times(path)
+    with _upload_times_lock:
+        if table.pop(day.date() if isinstance(day, datetime) else day,
+                     None) is not None:
+            _unsaved_upload_times.add(path)
+
+    return
+
+
+def flush_upload_times():
+    """
+    Write the upload timestamp tables that have new entries to disk. Each
+    file is replaced at once, so an interrupted write leaves the old table.
+
+    """
+
+    with _upload_times_lock:
+        for path in _unsaved_upload_times:
+            with open(path + PARTIAL_SUFFIX, 'w') as f:
+                f.write('# Upload timestamps of PSE files, found by '
+                        'download.find_upload_second()\n')
+                f.write(yaml.dump(_upload_times[path],
+                                  default_flow_style=False))
+            os.replace(path + PARTIAL_SUFFIX, path)
+        _unsaved_upload_times.clear()
+
+    return
+
+
+_probe_session = None
+_probe_lock = threading.Lock()
+
+
+def find_upload_second(
+        start,
+        end,
+        url_template,
+        url_params_template,
+        workers=10,
+        scheduler=None):
+    """
+    Find the second at which the PSE file for start was uploaded by probing
+    all candidates concurrently over one pooled session. Probes that have not
+    been sent yet are cancelled at the first hit.
+
+    Parameters
+    ----------
+    start : datetime.date
+        start of data in the file
+    end : datetime.date
+        end of data in the file
+    url_template : str
+        URL of the PSE server
+    url_params_template : dict
+        URL parameters, including the ``{u_second}`` placeholder
+    workers : int, default 10
+        Number of probes to send in parallel
+    scheduler : scheduler.Scheduler, optional
+        Paces, limits and retries the requests to the server.
+
+    Returns
+    ----------
+    second : pandas.Timestamp or None
+        The upload timestamp, None if no file was found.
+
+    """
+
+    if scheduler is None:
+        scheduler = Scheduler()
+
+    global _probe_session
+    with _probe_lock:
+        if _probe_session is None:
+            _probe_session = requests.session()
+            adapter = requests.adapters.HTTPAdapter(pool_maxsize=workers)
+            _probe_session.mount('http://', adapter)
+            _probe_session.mount('https://', adapter)
+
+    found = threading.Event()
+
+    def probe(second):
+        if found.is_set():
+            return None
+        url_params = {key: value.format(u_start=start, u_end=end,
+                                        u_second=second)
+                      for key, value in url_params_template.items()}
+        logger.debug('attempt %s', second)
+        try:
+            resp = scheduler.get(_probe_session, url_template,
+                                 params=url_params, stream=True)
+            try:
+                head = next(resp.iter_content(64), b'')
+            finally:
+                resp.close()
+        except requests.exceptions.RequestException as e:
+            logger.debug('attempt %s failed: %s', second, e)
+            return None
+
+        if resp.ok and not head.startswith(PSE_NO_FILE):
+            found.set()
+            return second
+
+        return None
+
+    candidates = pd.date_range(
+        start=datetime.combine(start + timedelta(days=6), time(17, 0, 10)),
+        end=datetime.combine(start + timedelta(days=6), time(17, 2, 0)),
+        freq='S')
+
+    second = None
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(probe, s) for s in candidates]
+        for future in as_completed(futures):
+            if future.result() is not None:
+                second = future.result()
+                for f in futures:
+                    f.cancel()
+                break
+
+    return second
 
 
 def download_file(
@@ -372,7 +707,10 @@ def download_file(
         url_params_template=None,
         filename=None,
         session=None,
-        second=None):
+        second=None,
+        scheduler=None,
+        update=False,
+        chunk_size=CHUNK_SIZE):
     """
     Download a single file specified by ``param_dict``, ``start``, ``end``,
     and save it to a directory constructed by combining ``source_name``,
@@ -395,26 +733,58 @@ def download_file(
         end of data in the file
     session : requests.session, optional
         If not given, a new session is created.
+    scheduler : scheduler.Scheduler, optional
+        Paces, limits and retries the requests to the server. If not given,
+        a Scheduler with default settings is used.
+    update : bool, default False
+        If True, a file that was downloaded before the end of its period is
+        requested again. The request is conditional on the ETag or
+        Last-Modified date recorded for it, so an unchanged file is not
+        transferred again. A changed file replaces the old one, whose
+        container may be named after the shorter period known at the last
+        download (see Manifest.latest()).
+    chunk_size : int, default CHUNK_SIZE
+        Number of bytes to write to disk at a time.
 
     """
     if session is None:
         session = requests.session()
 
+    if scheduler is None:
+        scheduler = Scheduler()
+
     logger.info(
         'Downloading data:\n\t '
-        'Source:      {}\n\t '
-        'Variable:    {}\n\t '
-        'Data starts: {:%Y-%m-%d}\n\t '
-        'Data ends:   {:%Y-%m-%d}'
-        .format(source_name, variable_name, start, end)
+        'Source:      %s\n\t '
+        'Variable:    %s\n\t '
+        'Data starts: %s\n\t '
+        'Data ends:   %s',
+        source_name, variable_name, start, end
     )
 
     # Each file will be saved in a folder of its own, this allows us to preserve
     # the original filename when saving to disk.
-    container = os.path.join(out_path, source_name, variable_name,
-                             start.strftime('%Y-%m-%d') + '_' +
-                             end.strftime('%Y-%m-%d'))
-    os.makedirs(container, exist_ok=True)
+    period = start.strftime('%Y-%m-%d') + '_' + end.strftime('%Y-%m-%d')
+    container = os.path.join(out_path, source_name, variable_name, period)
+
+    # Skip the download if there is a file already. A period that had not
+    # ended yet at the last download (e.g. of a source with 'end: recent')
+    # is in the container of the period up to that day.
+    manifest = open_manifest(out_path)
+    entry = manifest.lookup(source_name, variable_name, period)
+    if entry is None:
+        entry = manifest.latest(source_name, variable_name,
+                                start.strftime('%Y-%m-%d'))
+    if entry is not None and not (update and is_stale(entry, end)):
+        logger.info('Found local file: %s', entry['filename'])
+        return True, session
+
+    headers = {}
+    if entry is not None:
+        if entry['etag']:
+            headers['If-None-Match'] = entry['etag']
+        if entry['last_modified']:
+            headers['If-Modified-Since'] = entry['last_modified']
 
     # Get number of months between now and start (required for TransnetBW).
     count = (datetime.now().month
@@ -454,55 +824,152 @@ def download_file(
             u_second=second
         )
 
-    # Attempt the download if there is no file yet.
-    count_files = len(os.listdir(container))
-    if count_files == 0:
-        resp = session.get(url, params=url_params)
+    # A partially downloaded file from an interrupted attempt is resumed
+    partial = os.path.join(container, PARTIAL_FILENAME)
+    validator_path = os.path.join(container, VALIDATOR_FILENAME)
+    resume_from = os.path.getsize(partial) if os.path.exists(partial) else 0
+
+    # Byte ranges only work on the file as it is stored on the server
+    headers['Accept-Encoding'] = 'identity'
+    if resume_from:
+        headers['Range'] = 'bytes={}-'.format(resume_from)
+        # Only resume if the file has not changed in the meantime
+        if os.path.exists(validator_path):
+            with open(validator_path, 'r') as f:
+                headers['If-Range'] = f.read()
+
+    # Measure the transfer, see profiling.Report
+    with report.measure('download', source=source_name,
+                        variable=variable_name, file=period) as record:
+        record['bytes'] = 0
+
+        # Attempt the download.
+        resp = scheduler.get(session, url, params=url_params, headers=headers,
+                             stream=True)
+
+        # The partial file does not fit the file on the server, start over
+        if resp.status_code == 416:
+            resp.close()
+            if not resume_from:
+                logger.warning('Server refused the request for %s with '
+                               'status 416', resp.url)
+                return False, session
+            os.remove(partial)
+            del headers['Range']
+            headers.pop('If-Range', None)
+            resp = scheduler.get(session, url, params=url_params,
+                                 headers=headers, stream=True)
+
+        # The response holds a connection to the server until it is closed
+        with resp:
+            if resp.status_code == 304:
+                logger.info('Local file is up to date: %s', entry['filename'])
+                manifest.touch(source_name, variable_name, entry['period'])
+                return True, session
+
+            # Scheduler.get hands back the last answer once retries run out
+            if resp.status_code not in (200, 206):
+                logger.warning('Download failed with status %s: %s',
+                               resp.status_code, resp.url)
+                return False, session
 
-        # Get the original filename
-        try:
-            original_filename = (
-                resp.headers['content-disposition']
-                .split('filename=')[-1]
-                .replace('"', '')
-                .replace(';', '')
-            )
-            logger.info('Downloaded from URL: %s\n\t Original filename: %s',
-                        resp.url, original_filename)
-
-        # For cases where the original filename can not be retrieved,
-        # I put the filename in the param_dict
-        except KeyError:
-            if filename:
-                original_filename = filename.format(u_start=start, u_end=end)
-            else:
-                logger.info(
-                    'original filename could neither be retrieved from server '
-                    'nor sources.yml'
+            # Get the original filename
+            try:
+                original_filename = (
+                    resp.headers['content-disposition']
+                    .split('filename=')[-1]
+                    .replace('"', '')
+                    .replace(';', '')
                 )
-                original_filename = 'unknown_filename'
+                logger.info('Downloaded from URL: %s\n\t '
+                            'Original filename: %s',
+                            resp.url, original_filename)
+
+            # For cases where the original filename can not be retrieved,
+            # I put the filename in the param_dict
+            except KeyError:
+                if filename:
+                    original_filename = filename.format(u_start=start,
+                                                        u_end=end)
+                else:
+                    logger.info(
+                        'original filename could neither be retrieved from '
+                        'server nor sources.yml'
+                    )
+                    original_filename = 'unknown_filename'
 
-            logger.info('Downloaded from URL: %s', resp.url)
+                logger.info('Downloaded from URL: %s', resp.url)
 
-        # Save file to disk
-        if not resp.text == 'Brak uprawnieñ':
-            filepath = os.path.join(container, original_filename)
-            with open(filepath, 'wb') as output_file:
-                for chunk in resp.iter_content(1024):
-                    output_file.write(chunk)
-            downloaded = True
+            # The server may ignore the range and send the whole file
+            resuming = (resp.status_code == 206 and
+                        resp.headers.get('content-range', '').startswith(
+                            'bytes {}-'.format(resume_from)))
 
-        else:
-            downloaded = False
+            chunks = resp.iter_content(chunk_size)
+            first_chunk = next(chunks, b'')
 
-    elif count_files == 1:
-        downloaded = True
-        logger.info('Found local file: %s', os.listdir(container)[0])
+            # PSE answers with an error message instead of a file
+            if not resuming and first_chunk.startswith(PSE_NO_FILE):
+                return False, session
 
-    else:
-        downloaded = True
-        logger.info('There must not be more '
-                    'than one file in: %s. Please check ', container)
+            # Save file to disk, first under a temporary name
+            os.makedirs(container, exist_ok=True)
+            if resuming:
+                logger.info('Resuming download after %s bytes', resume_from)
+            else:
+                validator = (resp.headers.get('etag') or
+                             resp.headers.get('last-modified'))
+                if validator:
+                    with open(validator_path, 'w') as f:
+                        f.write(validator)
+                elif os.path.exists(validator_path):
+                    os.remove(validator_path)
+
+            with open(partial, 'ab' if resuming else 'wb') as output_file:
+                output_file.write(first_chunk)
+                record['bytes'] += len(first_chunk)
+                for chunk in chunks:
+                    output_file.write(chunk)
+                    record['bytes'] += len(chunk)
+
+            # Check that the file is complete before giving it its real name
+            if resuming:
+                expected = resp.headers['content-range'].split('/')[-1]
+            else:
+                expected = resp.headers.get('content-length', '*')
+            if expected != '*' and int(expected) != os.path.getsize(partial):
+                logger.warning('Download incomplete, %s of %s bytes saved '
+                               'in %s. It will be resumed on the next '
+                               'attempt.',
+                               os.path.getsize(partial), expected, partial)
+                return False, session
+
+            filepath = os.path.join(container, original_filename)
+            os.replace(partial, filepath)
+            if os.path.exists(validator_path):
+                os.remove(validator_path)
+
+            manifest.add(source_name, variable_name, period, filepath,
+                         etag=resp.headers.get('etag'),
+                         last_modified=resp.headers.get('last-modified'))
+
+            # Remove the outdated file if it was saved under another name or
+            # in the container of a shorter period
+            if entry is not None:
+                old_container = os.path.join(out_path, source_name,
+                                             variable_name, entry['period'])
+                old_filepath = os.path.join(old_container, entry['filename'])
+                if (old_filepath != filepath and
+                        os.path.exists(old_filepath)):
+                    os.remove(old_filepath)
+                if entry['period'] != period:
+                    manifest.remove(source_name, variable_name,
+                                    entry['period'])
+                    try:
+                        os.rmdir(old_container)
+                    except OSError:
+                        logger.info('Could not remove %s', old_container)
+    downloaded = True
 
     return downloaded, session
 
@@ -515,4 +982,5 @@ if __name__ == '__main__':
     parser.add_argument('-s', '--subset', nargs='*', action='append')
     args = parser.parse_args()
 
-    download(args.sources_yaml_path, args.out_path, args.subset)
+    download(load_sources(args.sources_yaml_path), args.out_path,
+             args.subset)
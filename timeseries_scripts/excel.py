@@ -0,0 +1,211 @@
+"""
+Open Power System Data
+
+Timeseries Datapackage
+
+excel.py : stream the cells of one sheet of an Excel workbook
+
+"""
+
+from datetime import time
+import logging
+
+import openpyxl
+import pandas as pd
+import xlrd
+
+logger = logging.getLogger('log')
+
+XLSX_MAGIC = b'PK\x03\x04'  # xlsx files are zip archives
+XLS_MAGIC = b'\xd0\xcf\x11\xe0'  # xls files are OLE2 compound documents
+
+
+def read_sheet(filepath, sheet=0, skiprows=0, usecols=None, na_values=None):
+    """
+    Read the cell values of one sheet into a DataFrame, without loading
+    the other sheets: xlsx files are parsed row by row in openpyxl's
+    read-only mode, of xls files only the sheet is loaded (xlrd's
+    on_demand mode) and only the columns in usecols are taken from it.
+
+    Unlike pandas.read_excel(), no row is used as header and no values
+    are converted, except that dates in xls files become datetimes (times
+    if they lie on the first day of the epoch) and empty cells, error cells
+    and empty strings become None. Rows without any value are dropped.
+
+    Parameters
+    ----------
+    filepath : str or file-like object
+        The workbook, xls or xlsx. Other formats are passed on to
+        pandas.read_excel().
+    sheet : int, default 0
+        Position of the sheet, e.g. -1 for the last one
+    skiprows : int, default 0
+        Number of rows to skip at the top of the sheet
+    usecols : list of int, default None
+        Positions of the columns to read (0-indexed). None means all.
+    na_values : list, default None
+        Further values to convert to None, e.g. ['n.a.']
+
+    Returns
+    ----------
+    df : pandas.DataFrame
+        One column for each position in usecols, labeled by the position
+
+    """
+
+    magic = _magic(filepath)
+    if magic == XLSX_MAGIC:
+        rows = _xlsx_rows(filepath, sheet, skiprows, usecols)
+    elif magic == XLS_MAGIC:
+        rows = _xls_rows(filepath, sheet, skiprows, usecols)
+    else:
+        logger.debug('%s is no xls or xlsx file, using pandas', filepath)
+        return _read_other(filepath, sheet, skiprows, usecols, na_values)
+
+    na_values = set(na_values or []) | {''}
+    data = []
+    for row in rows:
+        row = [None if value in na_values else value for value in row]
+        if any(value is not None for value in row):
+            data.append(row)
+
+    if usecols is None:
+        width = max([len(row) for row in data] or [0])
+        usecols = list(range(width))
+        data = [row + [None] * (width - len(row)) for row in data]
+
+    return pd.DataFrame(data, columns=usecols)
+
+
+def read_header(filepath, row, sheet=0):
+    """
+    Return the cell values of one row of a sheet, e.g. the column names,
+    without reading the rows below it. See read_sheet() for the parameters.
+
+    """
+
+    magic = _magic(filepath)
+    if magic == XLSX_MAGIC:
+        workbook = openpyxl.load_workbook(filepath, read_only=True,
+                                          data_only=True)
+        try:
+            worksheet = workbook.worksheets[sheet]
+            for cells in worksheet.iter_rows(min_row=row + 1,
+                                             max_row=row + 1):
+                return [cell.value for cell in cells]
+        finally:
+            workbook.close()
+        return []
+
+    if magic == XLS_MAGIC:
+        if hasattr(filepath, 'read'):
+            position = filepath.tell()
+            book = xlrd.open_workbook(file_contents=filepath.read(),
+                                      on_demand=True)
+            filepath.seek(position)
+        else:
+            book = xlrd.open_workbook(filepath, on_demand=True)
+        try:
+            worksheet = book.sheet_by_index(sheet % book.nsheets)
+            return worksheet.row_values(row)
+        finally:
+            book.release_resources()
+
+    df = pd.read_excel(io=filepath, sheetname=sheet, header=None,
+                       skiprows=row)
+    if hasattr(filepath, 'seek'):
+        filepath.seek(0)
+    return df.iloc[0].tolist() if len(df) else []
+
+
+def _magic(filepath):
+    """Return the first 4 bytes of filepath."""
+    if hasattr(filepath, 'read'):
+        position = filepath.tell()
+        magic = filepath.read(4)
+        filepath.seek(position)
+        return magic
+
+    with open(filepath, 'rb') as f:
+        return f.read(4)
+
+
+def _xlsx_rows(filepath, sheet, skiprows, usecols):
+    """Yield the values in usecols of each row of an xlsx sheet."""
+    workbook = openpyxl.load_workbook(filepath, read_only=True,
+                                      data_only=True)
+    try:
+        worksheet = workbook.worksheets[sheet]
+        if usecols is None:
+            rows = worksheet.iter_rows(min_row=skiprows + 1)
+            for row in rows:
+                yield [cell.value for cell in row]
+        else:
+            # openpyxl counts columns from 1
+            first = min(usecols)
+            rows = worksheet.iter_rows(min_row=skiprows + 1,
+                                       min_col=first + 1,
+                                       max_col=max(usecols) + 1)
+            for row in rows:
+                values = [cell.value for cell in row]
+                yield [values[col - first] if col - first < len(values)
+                       else None for col in usecols]
+    finally:
+        workbook.close()
+
+
+def _xls_rows(filepath, sheet, skiprows, usecols):
+    """Yield the values in usecols of each row of an xls sheet."""
+    if hasattr(filepath, 'read'):
+        book = xlrd.open_workbook(file_contents=filepath.read(),
+                                  on_demand=True)
+    else:
+        book = xlrd.open_workbook(filepath, on_demand=True)
+    try:
+        worksheet = book.sheet_by_index(sheet % book.nsheets)
+        if usecols is None:
+            usecols = list(range(worksheet.ncols))
+
+        columns = []
+        for col in usecols:
+            if col >= worksheet.ncols:
+                columns.append([None] * max(worksheet.nrows - skiprows, 0))
+                continue
+            values = worksheet.col_values(col, start_rowx=skiprows)
+            types = worksheet.col_types(col, start_rowx=skiprows)
+            columns.append([_xls_value(value, cell_type, book.datemode)
+                            for value, cell_type in zip(values, types)])
+    finally:
+        book.release_resources()
+
+    for row in zip(*columns):
+        yield list(row)
+
+
+def _xls_value(value, cell_type, datemode):
+    """Convert the value of an xls cell as pandas.read_excel() does."""
+    if cell_type == xlrd.XL_CELL_DATE:
+        value = xlrd.xldate.xldate_as_datetime(value, datemode)
+        # Excel does not distinguish dates and times, so dates on the day
+        # the epoch starts are times only
+        if value.timetuple()[0:3] in [(1899, 12, 31), (1904, 1, 1)]:
+            value = time(value.hour, value.minute, value.second,
+                         value.microsecond)
+        return value
+    if cell_type in (xlrd.XL_CELL_EMPTY, xlrd.XL_CELL_BLANK,
+                     xlrd.XL_CELL_ERROR):
+        return None
+    if cell_type == xlrd.XL_CELL_BOOLEAN:
+        return bool(value)
+    return value
+
+
+def _read_other(filepath, sheet, skiprows, usecols, na_values):
+    """Fall back to pandas.read_excel(), with the columns labeled alike."""
+    df = pd.read_excel(io=filepath, sheetname=sheet, header=None,
+                       skiprows=skiprows, parse_cols=usecols,
+                       na_values=na_values)
+    if usecols is not None:
+        df.columns = usecols
+
+    return df
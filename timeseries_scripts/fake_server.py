@@ -0,0 +1,270 @@
+"""
+Open Power System Data
+
+Timeseries Datapackage
+
+fake_server.py : local stand-in for the source servers, for benchmarks and
+debugging of the download without network access
+
+"""
+
+import argparse
+import copy
+from datetime import datetime, time, timedelta
+import hashlib
+import http.server
+import logging
+import os
+import socketserver
+import sys
+import threading
+from urllib.parse import urlparse, parse_qs
+import zlib
+
+import yaml
+
+from .download import PSE_NO_FILE
+
+logger = logging.getLogger('log')
+
+
+class FakeServer(object):
+    """
+    Serve synthetic files for all URLs in sources.yml from localhost.
+
+    Each source server is stood in for by its own port, so that the limits
+    per server in download.py apply as they would to the real servers. The
+    requests are answered as the original server would answer, as far as
+    download.py cares:
+
+    - The body is a deterministic file of ``size`` bytes, with an ETag, and
+      byte ranges are supported.
+    - The filename is sent in a content-disposition header, except for URLs
+      that end with a file name (e.g. Svenska Kraftnaet).
+    - PSE only returns a file for the one upload second per day given by
+      pse_upload_second() and for the deviant URLs in sources.yml, and an
+      error message for all others.
+    - Elia only accepts beginDate/endDate parameters that are midnight in
+      Brussels, given in UTC.
+
+    Parameters
+    ----------
+    latency : float, default 0
+        Seconds to wait before answering each request.
+    size : int, default 100000
+        Size of the files served, in bytes.
+    host : str, default '127.0.0.1'
+        Address to listen on.
+
+    """
+
+    def __init__(self, latency=0, size=100000, host='127.0.0.1'):
+        self.latency = latency
+        self.size = size
+        self.host = host
+        self.requests = 0
+        self.deviant_urls = set()
+        self._servers = {}  # by the netloc of the original server
+        self._lock = threading.Lock()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def url(self, netloc):
+        """Return the base URL standing in for the server at netloc."""
+        with self._lock:
+            if netloc not in self._servers:
+                httpd = _ThreadingHTTPServer((self.host, 0), _Handler)
+                httpd.fake = self
+                httpd.origin = netloc
+                thread = threading.Thread(target=httpd.serve_forever)
+                thread.daemon = True
+                thread.start()
+                self._servers[netloc] = httpd
+                logger.info('Fake server for %s listening on port %s',
+                            netloc, httpd.server_address[1])
+
+            host, port = self._servers[netloc].server_address[:2]
+
+        return 'http://{}:{}'.format(host, port)
+
+    def stop(self):
+        """Stop serving on all ports."""
+        with self._lock:
+            for httpd in self._servers.values():
+                httpd.shutdown()
+                httpd.server_close()
+            self._servers = {}
+
+        return
+
+    def rewrite(self, sources):
+        """
+        Return a copy of sources with all URLs pointing to this server.
+
+        Known PSE upload seconds are not used, so that every run has to
+        find them, as a fresh download would.
+
+        """
+
+        sources = copy.deepcopy(sources)
+        for source_dict in sources.values():
+            for param_dict in source_dict.values():
+                if 'url_template' in param_dict:
+                    param_dict['url_template'] = self._rewrite_url(
+                        param_dict['url_template'])
+                for deviating in param_dict.get('deviant_urls', []):
+                    deviating['url'] = self._rewrite_url(deviating['url'])
+                    # Files behind deviant URLs always exist
+                    self.deviant_urls.add(urlparse(deviating['url']).query)
+                if 'upload_times' in param_dict:
+                    param_dict['upload_times'] = None
+
+        return sources
+
+    def _rewrite_url(self, url):
+        netloc = urlparse(url).netloc
+        return self.url(netloc) + url.split(netloc, 1)[1]
+
+    def body(self, key):
+        """Return the deterministic content of the file identified by key."""
+        seed = hashlib.sha1(key.encode('utf-8')).hexdigest()
+        line = ('{};' + ';'.join(['1234,5'] * 8) + '\r\n').format(seed)
+        repeats = self.size // len(line) + 1
+
+        return (line * repeats).encode('ascii')[:self.size]
+
+
+def pse_upload_second(day):
+    """
+    Return the second at which the fake PSE server pretends to have
+    uploaded the file for day (a datetime.date).
+
+    """
+
+    offset = zlib.crc32(day.strftime('%Y%m%d').encode('ascii')) % 111
+    return (datetime.combine(day + timedelta(days=6), time(17, 0, 10)) +
+            timedelta(seconds=offset))
+
+
+class _ThreadingHTTPServer(socketserver.ThreadingMixIn, http.server.HTTPServer):
+    daemon_threads = True
+
+    def handle_error(self, request, client_address):
+        # Clients hang up on purpose, e.g. after the first bytes of a probe
+        if not isinstance(sys.exc_info()[1], ConnectionError):
+            super().handle_error(request, client_address)
+
+
+class _Handler(http.server.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        logger.debug('fake server: ' + format, *args)
+
+    def do_GET(self):
+        fake = self.server.fake
+        with fake._lock:
+            fake.requests += 1
+        if fake.latency:
+            threading.Event().wait(fake.latency)
+
+        parsed = urlparse(self.path)
+        params = {k: v[0] for k, v in parse_qs(parsed.query).items()}
+        host = self.server.origin
+        path = parsed.path.strip('/')
+
+        if host.endswith('pse.pl'):
+            rap = params.get('rap', '')
+            parts = rap.split('_')
+            try:
+                day = datetime.strptime(parts[-2], '%Y%m%d').date()
+                valid = parts[-1] == '{:%Y%m%d%H%M%S}'.format(
+                    pse_upload_second(day))
+            except (IndexError, ValueError):
+                valid = False
+            if not valid and parsed.query not in fake.deviant_urls:
+                return self._send(200, PSE_NO_FILE + b'\xf1')
+
+        if host.endswith('elia.be'):
+            for key in ['beginDate', 'endDate', 'dateFrom', 'dateTo']:
+                if key in params and not self._is_brussels_midnight(
+                        params[key]):
+                    return self._send(400, b'Bad date: ' +
+                                      params[key].encode('utf-8'))
+
+        key = host + '/' + path + '?' + parsed.query
+        body = fake.body(key)
+        etag = '"{}"'.format(hashlib.sha1(body).hexdigest()[:16])
+        headers = {'ETag': etag}
+
+        # URLs ending in a filename need no content-disposition
+        if not os.path.splitext(path)[1]:
+            filename = '{}_{}.csv'.format(
+                os.path.basename(path) or 'data',
+                hashlib.sha1(key.encode('utf-8')).hexdigest()[:8])
+            headers['Content-Disposition'] = (
+                'attachment; filename="{}"'.format(filename))
+
+        if self.headers.get('If-None-Match') == etag:
+            return self._send(304, b'', headers)
+
+        byte_range = self.headers.get('Range', '')
+        if byte_range.startswith('bytes=') and (
+                self.headers.get('If-Range') in (None, etag)):
+            first = int(byte_range[6:].split('-')[0])
+            if first >= len(body):
+                return self._send(416, b'')
+            headers['Content-Range'] = 'bytes {}-{}/{}'.format(
+                first, len(body) - 1, len(body))
+            return self._send(206, body[first:], headers)
+
+        return self._send(200, body, headers)
+
+    def _send(self, status, body, headers=None):
+        self.send_response(status)
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+        return
+
+    @staticmethod
+    def _is_brussels_midnight(value):
+        # Midnight in Brussels is 22:00 (summer) or 23:00 (winter) in UTC
+        value = value.replace('.000Z', '')
+        try:
+            stamp = datetime.strptime(value, '%Y-%m-%dT%H:%M:%S')
+        except ValueError:
+            return False
+        return (stamp.hour, stamp.minute, stamp.second) in [(22, 0, 0),
+                                                            (23, 0, 0)]
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Serve synthetic source files on localhost')
+    parser.add_argument('sources_yaml_path', type=str)
+    parser.add_argument('out_yaml_path', type=str,
+                        help='where to write the sources pointing to the '
+                             'fake server')
+    parser.add_argument('--latency', type=float, default=0)
+    parser.add_argument('--size', type=int, default=100000)
+    args = parser.parse_args()
+
+    logging.basicConfig(level='INFO')
+    with open(args.sources_yaml_path, 'r') as f:
+        sources = yaml.safe_load(f.read())
+
+    server = FakeServer(latency=args.latency, size=args.size)
+    with open(args.out_yaml_path, 'w') as f:
+        yaml.safe_dump(server.rewrite(sources), f, default_flow_style=False)
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.stop()
@@ -3,7 +3,7 @@ Open Power System Data
 
 Timeseries Datapackage
 
-imputation.py : fill functions for imoutation of missing data (Not used yet)
+imputation.py : fill functions for imputation of missing data
 
 """
 
@@ -12,14 +12,24 @@ import pandas as pd
 import numpy as np
 import logging
 
+from .compact import column_id, column_key, marker_key, ID_NAME
+from .markers import Markers, marker_strings
+from .profiling import report
+
 logger = logging.getLogger('log')
-logger.setLevel('DEBUG')
 
 
-def find_nan(frame, headers, patch=False):
+# One region of missing values: position of the column in the frame, first
+# and last timestamp and number of missing values
+GAP_DTYPE = np.dtype([('column', np.int64), ('start_idx', 'datetime64[ns]'),
+                      ('till_idx', 'datetime64[ns]'), ('count', np.int64)])
+
+
+def find_nan(frame, headers, patch=False, catalog=None, bitmask=False):
     '''
     Search for missing values in a DataFrame and optionally apply further 
-    functions on each column.
+    functions on each column. The regions of missing values are found in
+    all columns at once, see find_gaps().
 
     Parameters
     ----------    
@@ -31,6 +41,13 @@ def find_nan(frame, headers, patch=False):
     patch : bool, default=False
         If False, return unaltered DataFrame,
         if True, return patched DataFrame
+    catalog : pandas.DataFrame, default None
+        If frame is compact (see compact.compact()), the catalog of its
+        column ids. The marker column is then labeled by its id as well.
+    bitmask : bool, default False
+        If True, the patched values are not marked in a marker column but
+        returned as markers.Markers, to be rendered as the marker column
+        at the export.
 
     Returns
     ----------    
@@ -38,80 +55,67 @@ def find_nan(frame, headers, patch=False):
         original frame or frame with gaps patched and marker column appended
     nan_table: pandas.DataFrame
         Contains detailed information about missing data
+    markers: markers.Markers
+        Only if bitmask is True: The patched values, with the columns of
+        frame
 
     '''
-    nan_table = pd.DataFrame()
-    patched = pd.DataFrame()
-    marker_col = pd.DataFrame('', index=frame.index, columns=['comment'])
-    tuples = [('comment', '', '', '', '')]
-    marker_col.columns = pd.MultiIndex.from_tuples(tuples, names=headers)
-
     # Get the frequency/length of one period offrame
     one_period = frame.index[1] - frame.index[0]
-    for col_name, col in frame.iteritems():
-        col = col.to_frame()
-
-        # tag all occurences of NaN in the data
-        # (but not before first or after last actual entry)
-
-        # skip this column if it has no entries at all
-        if col.empty:
-            continue
-
-        col['tag'] = (
-            (col.index >= col.first_valid_index()) &
-            (col.index <= col.last_valid_index()) &
-            col.isnull().transpose().as_matrix()
-        ).transpose()
-
-        # make another DF to hold info about each region
-        nan_regs = pd.DataFrame()
-
-        # first row of consecutive region is a True preceded by a False in tags
-        nan_regs['start_idx'] = col.index[
-            col['tag'] & ~
-            col['tag'].shift(1).fillna(False)]
-
-        # last row of consecutive region is a False preceded by a True
-        nan_regs['till_idx'] = col.index[
-            col['tag'] & ~
-            col['tag'].shift(-1).fillna(False)]
-
-        if not col['tag'].any():
-            logger.info('%s : nothing to patch in this column', col_name[0:3])
-            col.drop('tag', axis=1, inplace=True)
-            nan_idx = pd.MultiIndex.from_arrays([
-                [0, 0, 0, 0],
-                ['count', 'span', 'start_idx', 'till_idx']])
-            nan_list = pd.DataFrame(index=nan_idx, columns=col.columns)
-
-        else:
-            # how long is each region
-            nan_regs['span'] = (
-                nan_regs['till_idx'] - nan_regs['start_idx'] + one_period)
-            nan_regs['count'] = (nan_regs['span'] / one_period)
-            # sort the nan_regs DataFtame to put longest missing region on top
-            nan_regs = nan_regs.sort_values(
-                'count', ascending=False).reset_index(drop=True)
-
-            col.drop('tag', axis=1, inplace=True)
-            nan_list = nan_regs.stack().to_frame()
-            nan_list.columns = col.columns
-
-            if patch:
-                col, marker_col = choose_fill_method(
-                    col, col_name, nan_regs, frame, marker_col, one_period)
-
-        if patched.empty:
-            patched = col
-        else:
-            patched = patched.combine_first(col)
-
-        if nan_table.empty:
-            nan_table = nan_list
-        else:
-            nan_table = nan_table.combine_first(nan_list)
 
+    with report.measure('find_nan', step='gaps') as record:
+        gaps = find_gaps(frame)
+        nan_table = gap_table(gaps, frame.columns, one_period)
+        record['rows'] = len(frame)
+
+    if catalog is None:
+        keys = list(frame.columns)
+    else:
+        keys = [column_key(catalog, col_id) for col_id in frame.columns]
+    regions = np.bincount(gaps['column'], minlength=len(keys))
+    for col_name in [keys[c] for c in np.flatnonzero(regions == 0)]:
+        logger.info('%s : nothing to patch in this column', col_name[0:3])
+
+    patched = frame
+    was_filled = np.zeros(frame.shape, dtype=bool)
+    if patch:
+        with report.measure('find_nan', step='interpolate') as record:
+            patched, was_filled = interpolate_gaps(frame, gaps)
+            record['rows'] = len(frame)
+
+        short = gaps['count'] <= timedelta(hours=2) // one_period
+        interpolated = np.bincount(gaps['column'][short],
+                                   minlength=len(keys))
+        for c in np.flatnonzero(interpolated):
+            logger.info('%s : \n\t '
+                        'interpolated %s up-to-2-hour-spans of NaNs',
+                        keys[c][0:3], interpolated[c])
+
+        # Guess longer gaps in German wind and solar generation data based
+        # on other TSOs
+        with report.measure('find_nan', step='impute') as record:
+            patched, was_imputed = impute_gaps(patched, gaps, keys)
+            record['rows'] = len(frame)
+        was_filled |= was_imputed
+
+    # set the level names for the output
+    if catalog is None:
+        nan_table.columns.names = headers
+
+    if bitmask:
+        return (patched, nan_table,
+                Markers.from_mask(was_filled, frame.index, frame.columns))
+
+    # Create a marker column to mark where data has been interpolated
+    labels = ['_'.join(col_name[0:3]) + '; ' for col_name in keys]
+    marker_col = pd.DataFrame(marker_strings(was_filled, labels),
+                              index=frame.index, columns=['comment'])
+    tuples = [('comment', '', '', '', '')]
+    if catalog is None:
+        marker_col.columns = pd.MultiIndex.from_tuples(tuples, names=headers)
+    else:
+        marker_id = column_id(catalog, marker_key(catalog.columns))
+        marker_col.columns = pd.Index([marker_id], name=ID_NAME)
 
     # replace empty strings with NaN
     marker_col.replace(to_replace='', value=np.nan, inplace=True)
@@ -119,172 +123,315 @@ def find_nan(frame, headers, patch=False):
     # append the marker to the DataFrame
     patched = pd.concat([patched, marker_col], axis=1)  # .to_frame())
 
-    # set the level names for the output
-    nan_table.columns.names = headers
-    patched.columns.names = headers
+    if catalog is None:
+        patched.columns.names = headers
 
     return patched, nan_table
 
 
-def choose_fill_method(col, col_name, nan_regs, frame, marker_col, one_period):
+def find_gaps(frame):
     '''
-    Choose the appropriate function for filling a region of missing values
+    Find the regions of missing values in all columns of a DataFrame at
+    once, by run-length encoding its 2-D mask of missing values. Missing
+    values before the first or after the last entry of a column are no
+    region.
 
     Parameters
-    ----------  
-    col : pandas.DataFrame
-        A column from frame as a separate DataFrame 
-    col_name : str
-        Name of DataFrame to inspect
-    nan_regs : : pandas.DataFrame
-        DataFrame with each row representing a region of missing data in col
+    ----------
     frame : pandas.DataFrame
-        DataFrame to patch with n rows
-    marker_col: pandas.DataFrame
-        An n*1 DataFrame specifying for each row which of the previously treated 
-        columns have been patched
-    one_period : pandas.Timedelta
-        Time resolution of frame and col (15/60 minutes)
+        DataFrame to inspect
 
     Returns
-    ----------  
-    col : pandas.DataFrame
-        An n*1 DataFrame containing col with nan_regs filled
-        and another column for the marker
-    marker_col: pandas.DataFrame
-        Definition as under Parameters, but now appended with markers for col 
+    ----------
+    gaps : numpy.ndarray
+        One element of GAP_DTYPE per region, sorted by column and start
 
     '''
-    for i, nan_region in nan_regs.iterrows():
-        j = 0
-        # Interpolate missing value spans up to 2 hours
-        if nan_region['span'] <= timedelta(hours=2):
-            col, marker_col = my_interpolate(i, j, nan_region, col, col_name,
-                                             marker_col, nan_regs, one_period)
-        # Guess missing value spans longer than one hour based on other tsos
-        # (Only for German wind and solar generation data)
-        elif col_name[1][:2] == 'DE' and col_name[2] == 'generation':
-            j += 1
+    missing = frame.isnull().values
+    n, m = missing.shape
+    if n == 0:
+        return np.empty(0, dtype=GAP_DTYPE)
+
+    # Position of the first and the last entry of each column
+    present = ~missing
+    first = present.argmax(axis=0)
+    last = n - 1 - present[::-1].argmax(axis=0)
+    rows = np.arange(n)[:, np.newaxis]
+    tag = missing & (rows > first) & (rows < last) & present.any(axis=0)
+
+    # A region starts where the tag changes from False to True and ends
+    # where it changes back. Padding with False on both ends closes all
+    # regions. Transposing orders the changes by column.
+    padded = np.zeros((m, n + 2), dtype=np.int8)
+    padded[:, 1:-1] = tag.T
+    changes = np.diff(padded, axis=1)
+    starts = np.argwhere(changes == 1)
+    stops = np.argwhere(changes == -1)
+
+    gaps = np.empty(len(starts), dtype=GAP_DTYPE)
+    gaps['column'] = starts[:, 0]
+    gaps['count'] = stops[:, 1] - starts[:, 1]
+    times = frame.index.values
+    gaps['start_idx'] = times[starts[:, 1]]
+    gaps['till_idx'] = times[stops[:, 1] - 1]
+
+    return gaps
+
+
+def gap_frame(gaps, one_period):
+    '''
+    Return regions of missing values (of GAP_DTYPE) as a DataFrame with the
+    columns start_idx, till_idx, span and count, one row per region.
 
-            # NOT IMPLEMENTED
-            # col = impute(nan_region, col, col_name, nan_regs, frame, one_period)
+    '''
+    nan_regs = pd.DataFrame({
+        'start_idx': gaps['start_idx'],
+        'till_idx': gaps['till_idx'],
+        'span': gaps['count'] * one_period,
+        'count': gaps['count'].astype(float)},
+        columns=['start_idx', 'till_idx', 'span', 'count'])
 
-    return col, marker_col
+    return nan_regs
 
 
-def my_interpolate(i, j, nan_region, col, col_name, marker_col, nan_regs, one_period):
+def gap_table(gaps, columns, one_period):
     '''
-    Interpolate one missing value region in one column as described by 
-    nan_region. See choose_fill_method() for info on other parameters.
+    Return the nan_table of find_nan() for regions of missing values: For
+    each column, the start_idx, till_idx, span and count of each region,
+    the longest first.
 
     Parameters
     ----------
-    i : int
-        Counter for total number of regions of missing data
-    j : int
-        Counter for number regions of missing data not treated by by this
-        function
-    nan_region : pandas.Series
-        Contains information on one region of missing data in col
-        count: 
-        span:
-        start_idx:
-        till_idx:
+    gaps : numpy.ndarray
+        The regions, of GAP_DTYPE, e.g. as returned by find_gaps()
+    columns : pandas.Index
+        The columns of the frame the regions were found in
+    one_period : pandas.Timedelta
+        Time resolution of the frame (15/60 minutes)
 
     Returns
     ----------
-    col : pandas.DataFrame
-        The column with all nan_regs treated for periods shorter than 1:15.
+    nan_table : pandas.DataFrame
+        One column per column of the frame, indexed by the number of the
+        region in the column and the field
 
     '''
-    if i + 1 == len(nan_regs):
-        logger.info('%s : \n\t '
-                    'interpolated %s up-to-2-hour-spans of NaNs',
-                    col_name[0:3], i + 1 - j)
+    # Number the regions of each column, the longest first
+    gaps = gaps[np.lexsort((gaps['start_idx'], -gaps['count'],
+                            gaps['column']))]
+    first = np.searchsorted(gaps['column'], gaps['column'])
+    number = np.arange(len(gaps)) - first
+
+    # Columns without regions still get an empty first region
+    nan_idx = pd.MultiIndex.from_arrays([
+        [0, 0, 0, 0],
+        ['count', 'span', 'start_idx', 'till_idx']])
+    if len(gaps):
+        nan_regs = gap_frame(gaps, one_period)
+        nan_regs.index = pd.MultiIndex.from_arrays([gaps['column'], number])
+        nan_table = nan_regs.stack().unstack(0)
+        nan_idx = nan_table.index.union(nan_idx)
+    else:
+        nan_table = pd.DataFrame()
+    nan_table = nan_table.reindex(index=nan_idx, columns=range(len(columns)))
+    nan_table.columns = columns
 
-    to_fill = slice(nan_region['start_idx'] - one_period,
-                    nan_region['till_idx'] + one_period)
-    to_comment = slice(nan_region['start_idx'], nan_region['till_idx'])
+    return nan_table
 
-    col.iloc[:, 0].loc[to_fill] = col.iloc[:, 0].loc[to_fill].interpolate()
 
-    # Create a marker column to mark where data has been interpolated
-    marker_col.loc[to_comment] = marker_col + '_'.join(col_name[0:3]) + '; '
+def interpolate_gaps(frame, gaps, max_span=timedelta(hours=2)):
+    '''
+    Interpolate linearly all regions of missing values that are not longer
+    than max_span, in all columns at once.
 
-    return col, marker_col
+    Parameters
+    ----------
+    frame : pandas.DataFrame
+        DataFrame to patch, with a regular index
+    gaps : numpy.ndarray
+        The regions of missing values in frame, of GAP_DTYPE, as returned
+        by find_gaps()
+    max_span : datetime.timedelta, default 2 hours
+        Longest region to interpolate
 
+    Returns
+    ----------
+    filled : pandas.DataFrame
+        A copy of frame with the short regions filled
+    was_filled : numpy.ndarray
+        Boolean mask of the shape of frame, True where a value has been
+        interpolated
 
-# Not implemented: For the generation timeseries, larger gaps are guessed
-# by up-/down scaling the data from other balancing areas to fit the
-# expected magnitude of the missing data.
+    '''
+    one_period = frame.index[1] - frame.index[0]
+    short = gaps[gaps['count'] <= max_span // one_period]
+    short = short[np.argsort(short['column'], kind='mergesort')]
+    counts = short['count']
+
+    # One entry per value to fill: its region, its row and column and its
+    # step (1 to count) within the region
+    region = np.repeat(np.arange(len(short)), counts)
+    step = np.arange(counts.sum()) - np.repeat(counts.cumsum() - counts,
+                                                counts) + 1
+    first = frame.index.searchsorted(short['start_idx'])
+    rows = first[region] + step - 1
+    columns = short['column'][region]
+    weights = step / (counts[region] + 1.0)
+
+    was_filled = np.zeros(frame.shape, dtype=bool)
+    was_filled[rows, columns] = True
+
+    # Each region lies between two values, the one before its first row
+    # and the one after its last row
+    before = first[region] - 1
+    after = first[region] + counts[region]
+
+    filled = frame.copy()
+    bounds = np.searchsorted(columns, np.arange(len(frame.columns) + 1))
+    for c in np.flatnonzero(np.diff(bounds)):
+        part = slice(bounds[c], bounds[c + 1])
+        values = frame.iloc[:, c].values.copy()
+        start = values[before[part]]
+        values[rows[part]] = (
+            start + (values[after[part]] - start) * weights[part])
+        filled.iloc[:, c] = values
+
+    return filled, was_filled
+
+
+def impute_gaps(frame, gaps, keys, min_span=timedelta(hours=2)):
+    '''
+    Guess the values of the regions of missing values longer than min_span
+    in the German generation columns (region 'DE-...', attribute
+    'generation') based on the other German TSOs, for all regions at once.
 
+    For each region, the other TSOs are the columns of the same variable
+    from other regions without missing values from one day before the
+    region to its end. Their sum is scaled down by the ratio of their sum
+    to the sum of the column over the day before the region. Regions
+    without a complete day before or without other TSOs to guess from are
+    left as they are.
 
-def impute(nan_region, col, col_name, nan_regs, frame, one_period):
-    '''
-    Impute missing value spans longer than one hour based on other TSOs.
+    The sums over the day before are taken from prefix sums of the
+    columns, so the cost does not depend on the number or the length of
+    the regions.
 
     Parameters
     ----------
-    nan_region : pandas.Series
-        Contains information on one region of missing data in col
-    col : pandas.DataFrame
-        A column from frame as a separate DataFrame 
-    col_name : str
-        DataFrame to inspect
-    nan_regs : : pandas.DataFrame
-        DataFrame with each row representing a region of missing data in col
     frame : pandas.DataFrame
-        DataFrame to patch
-    one_period : pandas.Timedelta
-        Time resolution of frame and col (15/60 minutes)
+        DataFrame to patch, with a regular index, e.g. with the short
+        regions already interpolated
+    gaps : numpy.ndarray
+        The regions of missing values in frame, of GAP_DTYPE, as returned
+        by find_gaps()
+    keys : list of tuple
+        The column key of each column of frame, e.g.
+        ('wind', 'DE-tennet', 'generation', source, url)
+    min_span : datetime.timedelta, default 2 hours
+        Regions up to this length are left as they are, see
+        interpolate_gaps()
+
+    Returns
+    ----------
+    filled : pandas.DataFrame
+        A copy of frame with the regions guessed
+    was_filled : numpy.ndarray
+        Boolean mask of the shape of frame, True where a value has been
+        guessed
 
     '''
-    #logger.info('guessed %s entries after %s', row['count'], row['start_idx'])
-    day_before = pd.DatetimeIndex(
-        freq='15min',
-        start=nan_region['start_idx'] - timedelta(hours=24),
-        end=nan_region['start_idx'] - one_period)
-
-    to_fill = pd.DatetimeIndex(
-        freq='15min',
-        start=nan_region['start_idx'],
-        end=nan_region['till_idx'])
-
-    # other_tsos = [c[1] for c in compact.drop(col_name, axis=1).loc[:,(col_name[0],slice(None),col_name[2])].columns.tolist()]
-    other_tsos = [
-        tso for tso in ['DE-50Hertz', 'DE-Amprion', 'DE-TenneT', 'DE-TransnetBW']
-        if tso != col_name[1]]
-
-    # select columns with data for same technology (wind/solar) but from other
-    # TSOs
-    similar = frame.loc[:, (col_name[0], other_tsos, col_name[2])]
-    # calculate the sum using columns without NaNs the day
-    # before or during the period to be guessed
-    similar = similar.dropna(
-        axis=1,
-        how='any',
-        subset=day_before.append(to_fill)
-    ).sum(axis=1)
-    # calculate scaling factor for other TSO data
-    factor = similar.loc[day_before].sum(
-        axis=0) / col.loc[day_before, :].sum(axis=0)
-
-    guess = similar.loc[to_fill] / float(factor)
-    col.iloc[:, 0].loc[to_fill] = guess
-    a = float(col.iloc[:, 0].loc[nan_region['start_idx'] - one_period])
-    b = float(col.iloc[:, 0].loc[nan_region['start_idx']])
-    if a == 0:
-        deviation = '{} absolut'.format(a - b)
-    else:
-        deviation = '{:.2f} %'.format((a - b) / a * 100)
-    logger.info(
-        '%s : \n        '
-        'guessed %s entries after %s \n        '
-        'last non-missing: %s \n        '
-        'first guessed: %s \n        '
-        'deviation of first guess from last known value: %s',
-        col_name[0:3], nan_region['count'], nan_region[
-            'start_idx'], a, b, deviation
-    )
-
-    return col
+    one_period = frame.index[1] - frame.index[0]
+    day = timedelta(days=1) // one_period
+    filled = frame.copy()
+    was_filled = np.zeros(frame.shape, dtype=bool)
+
+    generation = [c for c, key in enumerate(keys)
+                  if key[1].startswith('DE-') and key[2] == 'generation']
+    is_generation = np.zeros(len(keys), dtype=bool)
+    is_generation[generation] = True
+    long = gaps[(gaps['count'] > min_span // one_period) &
+                is_generation[gaps['column']]]
+    if len(long) == 0:
+        return filled, was_filled
+
+    # Prefix sums over the rows of the generation columns: the number of
+    # missing values and the sum of the others up to each row
+    values = frame.iloc[:, generation].values.astype(float)
+    missing = np.isnan(values)
+    nan_sums = np.zeros((len(values) + 1, len(generation)), dtype=np.int64)
+    nan_sums[1:] = missing.cumsum(axis=0)
+    sums = np.zeros((len(values) + 1, len(generation)))
+    sums[1:] = np.where(missing, 0, values).cumsum(axis=0)
+
+    # Per region: its column among the generation columns, and the rows of
+    # the day before and of the region itself
+    position = {c: i for i, c in enumerate(generation)}
+    own = np.array([position[c] for c in long['column']])
+    first = frame.index.searchsorted(long['start_idx'])
+    counts = long['count']
+    stop = first + counts
+    before = np.maximum(first - day, 0)
+    regions = np.arange(len(long))
+
+    # The other TSOs of each region, one column per generation column
+    variables = np.array([keys[c][0] for c in generation], dtype=object)
+    tsos = np.array([keys[c][1] for c in generation], dtype=object)
+    usable = ((variables[own][:, np.newaxis] == variables) &
+              (tsos[own][:, np.newaxis] != tsos) &
+              (nan_sums[stop] - nan_sums[before] == 0))
+
+    # Scaling factor from the day before
+    day_sums = sums[first] - sums[before]
+    similar = np.where(usable, day_sums, 0).sum(axis=1)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        factor = similar / day_sums[regions, own]
+    ok = ((first - day >= 0) &
+          (nan_sums[first, own] - nan_sums[before, own] == 0) &
+          usable.any(axis=1) & np.isfinite(factor) & (factor > 0))
+
+    long, own, first, counts, usable, factor = (
+        long[ok], own[ok], first[ok], counts[ok], usable[ok], factor[ok])
+
+    # One entry per value to guess, ordered by column
+    order = np.argsort(long['column'], kind='mergesort')
+    long, own, first, counts, usable, factor = (
+        long[order], own[order], first[order], counts[order],
+        usable[order], factor[order])
+    region = np.repeat(np.arange(len(long)), counts)
+    rows = first[region] + np.arange(counts.sum()) - np.repeat(
+        counts.cumsum() - counts, counts)
+    columns = long['column'][region]
+    guess = (np.where(usable[region], values[rows], 0).sum(axis=1) /
+             factor[region])
+    was_filled[rows, columns] = True
+
+    bounds = np.searchsorted(columns, np.arange(len(frame.columns) + 1))
+    for c in np.flatnonzero(np.diff(bounds)):
+        part = slice(bounds[c], bounds[c + 1])
+        column = frame.iloc[:, c].values.copy()
+        column[rows[part]] = guess[part]
+        filled.iloc[:, c] = column
+        logger.info('%s : \n\t '
+                    'guessed %s entries in %s spans of NaNs based on other '
+                    'TSOs', keys[c][0:3], bounds[c + 1] - bounds[c],
+                    len(np.unique(region[part])))
+
+    if logger.isEnabledFor(logging.DEBUG):
+        last = values[first - 1, own]
+        first_guess = guess[np.searchsorted(region, np.arange(len(long)))]
+        for g in range(len(long)):
+            a, b = last[g], first_guess[g]
+            if a == 0:
+                deviation = '{} absolut'.format(a - b)
+            else:
+                deviation = '{:.2f} %'.format((a - b) / a * 100)
+            logger.debug(
+                '%s : \n        '
+                'guessed %s entries after %s \n        '
+                'last non-missing: %s \n        '
+                'first guessed: %s \n        '
+                'deviation of first guess from last known value: %s',
+                keys[long['column'][g]][0:3], counts[g],
+                pd.Timestamp(long['start_idx'][g]), a, b, deviation)
+
+    return filled, was_filled
@@ -0,0 +1,327 @@
+"""
+Open Power System Data
+
+Timeseries Datapackage
+
+manifest.py : index of the downloaded files
+
+"""
+
+from datetime import datetime
+import hashlib
+import logging
+import os
+import sqlite3
+import threading
+
+logger = logging.getLogger('log')
+
+FILENAME = 'manifest.sqlite'
+
+# Files still being downloaded end with this suffix and are not entered
+PARTIAL_SUFFIX = '.part'
+
+COLUMNS = ['period', 'filename', 'size', 'checksum', 'fetched', 'etag',
+           'last_modified']
+
+_manifests = {}  # open manifests, by out_path
+_manifests_lock = threading.Lock()
+
+
+def open_manifest(out_path):
+    """
+    Return the Manifest for out_path. Each manifest is opened only once per
+    process and shared between threads.
+
+    """
+
+    key = os.path.abspath(out_path)
+    with _manifests_lock:
+        if key not in _manifests:
+            _manifests[key] = Manifest(out_path)
+
+        return _manifests[key]
+
+
+def archive_files(archive, sources=None):
+    """
+    Return the files in a zipped copy of the original_data directory.
+
+    Parameters
+    ----------
+    archive : zipfile.ZipFile
+        The archive, e.g. original_data.zip from the OPSD server.
+    sources : dict, default None
+        Only include the files for these sources and their variables.
+
+    Returns
+    ----------
+    entries : list of dict
+        For each file, the name of the archive member and its source,
+        variable, period, filename and size as in the Manifest.
+
+    """
+
+    entries = []
+    for info in archive.infolist():
+        parts = info.filename.split('/')
+        # Files are stored as original_data/source/variable/period/filename
+        if len(parts) != 5 or not parts[4]:
+            continue
+        prefix, source_name, variable_name, period, filename = parts
+        if sources is not None and (
+                source_name not in sources or
+                variable_name not in sources[source_name]):
+            continue
+        entries.append({'member': info.filename,
+                        'source': source_name,
+                        'variable': variable_name,
+                        'period': period,
+                        'filename': filename,
+                        'size': info.file_size})
+
+    return entries
+
+
+def checksum(filepath):
+    """Return the SHA-256 hex digest of the file at filepath."""
+    sha = hashlib.sha256()
+    with open(filepath, 'rb') as f:
+        for block in iter(lambda: f.read(1024 * 1024), b''):
+            sha.update(block)
+
+    return sha.hexdigest()
+
+
+class Manifest(object):
+    """
+    Index of all files downloaded into out_path, stored in a SQLite database
+    under out_path. There is one entry per container, i.e. per source,
+    variable and period. A file is only entered once it has been written
+    completely. Entries whose file has been deleted or changed by hand since
+    are dropped when they are looked up, see lookup() and files().
+
+    If the database does not exist yet, it is created from the files already
+    present in out_path.
+
+    Parameters
+    ----------
+    out_path : str
+        Base download directory in which all downloaded files are saved.
+
+    """
+
+    def __init__(self, out_path):
+        self.out_path = out_path
+        os.makedirs(out_path, exist_ok=True)
+        db_path = os.path.join(out_path, FILENAME)
+        is_new = not os.path.exists(db_path)
+
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._conn.execute(
+            'CREATE TABLE IF NOT EXISTS files ('
+            'source TEXT, variable TEXT, period TEXT, filename TEXT, '
+            'size INTEGER, checksum TEXT, fetched TEXT, '
+            'etag TEXT, last_modified TEXT, '
+            'PRIMARY KEY (source, variable, period))')
+
+        # Manifests written before ETag and Last-Modified were recorded
+        columns = [row[1] for row in
+                   self._conn.execute('PRAGMA table_info(files)')]
+        for column in ['etag', 'last_modified']:
+            if column not in columns:
+                self._conn.execute(
+                    'ALTER TABLE files ADD COLUMN {} TEXT'.format(column))
+        self._conn.commit()
+
+        if is_new:
+            self.adopt()
+
+    def lookup(self, source_name, variable_name, period):
+        """
+        Return the entry for one container as a dict, None if there is no
+        file for it.
+
+        """
+
+        with self._lock:
+            row = self._conn.execute(
+                'SELECT {} FROM files '
+                'WHERE source = ? AND variable = ? AND period = ?'
+                .format(', '.join(COLUMNS)),
+                (source_name, variable_name, period)).fetchone()
+
+        if row is None:
+            return None
+
+        entry = dict(zip(COLUMNS, row))
+        if not self._on_disk(source_name, variable_name, entry):
+            logger.info('%s has been deleted or changed, dropping it from '
+                        'the manifest', self._filepath(source_name,
+                                                       variable_name, entry))
+            self.remove(source_name, variable_name, period)
+            return None
+
+        return entry
+
+    def latest(self, source_name, variable_name, start):
+        """
+        Return the entry for the container of the longest period beginning
+        on start (as 'YYYY-MM-DD'), None if there is none.
+
+        """
+
+        with self._lock:
+            rows = self._conn.execute(
+                'SELECT period FROM files '
+                'WHERE source = ? AND variable = ? '
+                'AND substr(period, 1, 11) = ? ORDER BY period DESC',
+                (source_name, variable_name, start + '_')).fetchall()
+
+        for (period,) in rows:
+            entry = self.lookup(source_name, variable_name, period)
+            if entry is not None:
+                return entry
+
+        return None
+
+    def files(self, source_name, variable_name):
+        """
+        Return the entries for all containers of a variable, sorted by
+        period. If there are none, the variable directory is searched for
+        files first (e.g. for manually downloaded data).
+
+        """
+
+        with self._lock:
+            rows = self._conn.execute(
+                'SELECT {} FROM files '
+                'WHERE source = ? AND variable = ? ORDER BY period'
+                .format(', '.join(COLUMNS)),
+                (source_name, variable_name)).fetchall()
+
+        if not rows:
+            if self.adopt(source_name, variable_name):
+                return self.files(source_name, variable_name)
+
+        entries = []
+        for entry in [dict(zip(COLUMNS, row)) for row in rows]:
+            filepath = self._filepath(source_name, variable_name, entry)
+            # A file written after its entry has been replaced by hand, and
+            # its checksum (the key of its parsed frame, see cache.py) is
+            # outdated even if the size is the same
+            if (self._on_disk(source_name, variable_name, entry) and
+                    datetime.fromtimestamp(os.path.getmtime(filepath))
+                    .isoformat() <= entry['fetched']):
+                entries.append(entry)
+                continue
+            if not os.path.exists(filepath):
+                logger.info('%s has been deleted, dropping it from the '
+                            'manifest', filepath)
+                self.remove(source_name, variable_name, entry['period'])
+                continue
+            # Replaced by hand: enter the new file
+            logger.info('%s has changed, entering it again', filepath)
+            self.add(source_name, variable_name, entry['period'], filepath)
+            entries.append(self.lookup(source_name, variable_name,
+                                       entry['period']))
+
+        return entries
+
+    def _filepath(self, source_name, variable_name, entry):
+        """Return the path of the file of an entry."""
+        return os.path.join(self.out_path, source_name, variable_name,
+                            entry['period'], entry['filename'])
+
+    def _on_disk(self, source_name, variable_name, entry):
+        """Return True if the file of an entry exists with its size."""
+        try:
+            size = os.path.getsize(self._filepath(source_name,
+                                                  variable_name, entry))
+        except OSError:
+            return False
+
+        return size == entry['size']
+
+    def add(self, source_name, variable_name, period, filepath,
+            etag=None, last_modified=None):
+        """
+        Enter the file at filepath as the content of the container for
+        source_name, variable_name and period. etag and last_modified are
+        the values of the respective HTTP headers sent with the file.
+
+        """
+
+        with self._lock:
+            self._conn.execute(
+                'INSERT OR REPLACE INTO files (source, variable, {}) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)'.format(', '.join(COLUMNS)),
+                (source_name, variable_name, period,
+                 os.path.basename(filepath),
+                 os.path.getsize(filepath),
+                 checksum(filepath),
+                 datetime.now().isoformat(),
+                 etag,
+                 last_modified))
+            self._conn.commit()
+
+        return
+
+    def touch(self, source_name, variable_name, period):
+        """
+        Set the fetch time of an entry to now, e.g. after the server
+        confirmed that the file has not changed.
+
+        """
+
+        with self._lock:
+            self._conn.execute(
+                'UPDATE files SET fetched = ? '
+                'WHERE source = ? AND variable = ? AND period = ?',
+                (datetime.now().isoformat(),
+                 source_name, variable_name, period))
+            self._conn.commit()
+
+        return
+
+    def remove(self, source_name, variable_name, period):
+        """Delete the entry for one container."""
+        with self._lock:
+            self._conn.execute(
+                'DELETE FROM files '
+                'WHERE source = ? AND variable = ? AND period = ?',
+                (source_name, variable_name, period))
+            self._conn.commit()
+
+        return
+
+    def adopt(self, source_name=None, variable_name=None):
+        """
+        Search out_path (or the directory of one variable) for containers
+        holding exactly one file and enter those files. Returns the number of
+        files entered.
+
+        """
+
+        top = os.path.join(self.out_path, *[name for name in
+                                             (source_name, variable_name)
+                                             if name])
+        count = 0
+        for root, dirs, files in os.walk(top):
+            files = [f for f in files if not f.endswith(PARTIAL_SUFFIX)]
+            rel = os.path.relpath(root, self.out_path).split(os.sep)
+            # Containers are at out_path/source/variable/period
+            if len(rel) != 3:
+                continue
+            if len(files) == 0:
+                continue
+            if len(files) > 1:
+                logger.info('There must not be more '
+                            'than one file in: %s. Please check ', root)
+                continue
+
+            self.add(rel[0], rel[1], rel[2], os.path.join(root, files[0]))
+            count += 1
+
+        return count
@@ -0,0 +1,170 @@
+"""
+Open Power System Data
+
+Timeseries Datapackage
+
+markers.py : keep track of the patched values as a bitmask and render the
+comment column from it
+
+"""
+
+import logging
+
+import numpy as np
+import pandas as pd
+
+from .compact import column_key
+
+logger = logging.getLogger('log')
+
+
+class Markers(object):
+    """
+    The values of a data set that have been patched, as one bit per row and
+    column, packed into bytes with numpy.packbits(). A row of the data set
+    takes ceil(columns / 8) bytes instead of a string naming the patched
+    columns, and the markers of several rows or data sets are combined by
+    a bitwise OR. The strings of the comment column are only rendered for
+    the export, see render().
+
+    Parameters
+    ----------
+    bits : numpy.ndarray
+        The packed bits, of dtype uint8, one row per row of index
+    index : pandas.DatetimeIndex
+        The rows of the data set
+    columns : list
+        Labels of the columns the bits stand for, in the order of the bits:
+        the column keys or, for a compact data set, the column ids
+
+    """
+
+    def __init__(self, bits, index, columns):
+        self.bits = bits
+        self.index = index
+        self.columns = list(columns)
+
+    @classmethod
+    def from_mask(cls, mask, index, columns):
+        """
+        Return the Markers of a boolean mask of the patched values, one row
+        per row of index and one column per column in columns.
+
+        """
+
+        return cls(np.packbits(mask, axis=1), index, columns)
+
+    def mask(self):
+        """Return the boolean mask of the patched values."""
+        return np.unpackbits(self.bits, axis=1)[
+            :, :len(self.columns)].astype(bool)
+
+    def any(self):
+        """Return a boolean array, True for each row with a patched value."""
+        return self.bits.any(axis=1)
+
+    def resample(self, freq='60min'):
+        """
+        Return the markers of each interval of length freq, labeled by its
+        start: the markers of its rows combined.
+
+        """
+
+        starts = self.index.floor(freq)
+        if len(starts) == 0:
+            return Markers(self.bits, starts, self.columns)
+        first = np.flatnonzero(np.r_[True, starts[1:] != starts[:-1]])
+
+        return Markers(np.bitwise_or.reduceat(self.bits, first, axis=0),
+                       starts[first], self.columns)
+
+    def combine(self, other):
+        """
+        Return the markers of self and other combined, for the union of
+        their rows and columns. The packed bits are ORed directly, without
+        unpacking them, where the bits of both stand for the same columns.
+
+        """
+
+        index = self.index.union(other.index)
+        columns = self.columns + [col for col in other.columns
+                                  if col not in set(self.columns)]
+
+        bits = np.zeros((len(index), -(-len(columns) // 8)), dtype=np.uint8)
+        for markers in [self, other]:
+            aligned = markers._align(columns, bits.shape[1])
+            if markers.index.equals(index):
+                bits |= aligned
+            else:
+                bits[index.get_indexer(markers.index)] |= aligned
+
+        return Markers(bits, index, columns)
+
+    def _align(self, columns, width):
+        """
+        Return the packed bits of self for columns, width bytes per row.
+        Only if the columns of self are not the first ones of columns in the
+        same order, the bits are unpacked to move them.
+
+        """
+
+        if self.columns == columns[:len(self.columns)]:
+            return np.pad(self.bits, ((0, 0), (0, width - self.bits.shape[1])),
+                          mode='constant')
+
+        positions = {col: i for i, col in enumerate(columns)}
+        mask = np.zeros((len(self.index), len(columns)), dtype=bool)
+        mask[:, [positions[col] for col in self.columns]] = self.mask()
+
+        return np.packbits(mask, axis=1)
+
+    def render(self, catalog=None):
+        """
+        Return the comment column: For each row, the names of the patched
+        columns, e.g. 'solar_DE-transnetbw_generation; ', NaN where no
+        value has been patched.
+
+        Parameters
+        ----------
+        catalog : pandas.DataFrame, default None
+            If the columns are column ids, the catalog of the ids
+
+        Returns
+        ----------
+        comment : pandas.Series
+
+        """
+
+        keys = self.columns
+        if catalog is not None:
+            keys = [column_key(catalog, col_id) for col_id in keys]
+        labels = ['_'.join(key[0:3]) + '; ' for key in keys]
+        comment = pd.Series(marker_strings(self.mask(), labels),
+                            index=self.index)
+
+        return comment.replace(to_replace='', value=np.nan)
+
+
+def marker_strings(mask, labels):
+    """
+    Return the marker of each row: the labels of the columns in which values
+    have been patched in that row, joined, or an empty string.
+
+    Parameters
+    ----------
+    mask : numpy.ndarray
+        Boolean mask of the patched values, one column per label
+    labels : list of str
+        Label of each column, e.g. 'solar_DE-transnetbw_generation; '
+
+    """
+
+    marker = np.full(len(mask), '', dtype=object)
+    rows, columns = np.nonzero(mask)
+    if len(rows):
+        # The first entry of each row
+        starts = np.flatnonzero(np.r_[True, rows[1:] != rows[:-1]])
+        marker[rows[starts]] = np.add.reduceat(
+            np.array(labels, dtype=object)[columns], starts)
+
+    return marker
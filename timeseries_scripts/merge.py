@@ -0,0 +1,93 @@
+"""
+Open Power System Data
+
+Timeseries Datapackage
+
+merge.py : combine the DataFrames read from many files into one
+
+"""
+
+import logging
+
+import numpy as np
+import pandas as pd
+
+logger = logging.getLogger('log')
+
+
+def merge(frames):
+    """
+    Combine DataFrames into one, as repeated calls of
+    ``data_set = data_set.combine_first(data_to_add)`` would, but in one
+    pass: The index and columns of the result are the sorted unions of those
+    of all frames, and where several frames have a value for the same row
+    and column, the value from the frame that comes first in frames is kept.
+
+    Combining n frames with combine_first copies the growing result n times,
+    here each value is copied only once.
+
+    Parameters
+    ----------
+    frames : iterable of pandas.DataFrame
+        The frames to combine, in order of precedence. Empty frames are
+        ignored.
+
+    Returns
+    ----------
+    data_set : pandas.DataFrame
+        The combined data. An empty DataFrame if all frames are empty.
+
+    """
+
+    frames = [frame for frame in frames if not frame.empty]
+    if not frames:
+        return pd.DataFrame()
+    if len(frames) == 1:
+        return frames[0]
+
+    # Union of the indexes, sorted as by combine_first
+    index = pd.Index(np.unique(np.concatenate(
+        [frame.index.values for frame in frames])),
+        name=frames[0].index.name)
+
+    columns = frames[0].columns
+    for frame in frames[1:]:
+        if not columns.equals(frame.columns):
+            columns = columns.union(frame.columns)
+
+    # Position of each frame's rows in the result
+    positions = [index.get_indexer(frame.index) for frame in frames]
+
+    data = {}
+    for i, column in enumerate(columns):
+        sources = [(frame[column].values, pos)
+                   for frame, pos in zip(frames, positions)
+                   if column in frame.columns]
+        dtypes = [values.dtype for values, pos in sources]
+        if all(dtype.kind == 'f' for dtype in dtypes):
+            # Keeps float32 columns, e.g. of compact frames, as they are
+            values_out = np.full(len(index), np.nan,
+                                 dtype=np.result_type(*dtypes))
+        elif all(dtype.kind in 'biuf' for dtype in dtypes):
+            values_out = np.full(len(index), np.nan,
+                                 dtype=np.result_type(np.float64, *dtypes))
+        else:
+            values_out = np.full(len(index), np.nan, dtype=object)
+
+        filled = np.zeros(len(index), dtype=bool)
+        for values, pos in sources:
+            # First frame wins: only take values for rows still empty
+            take = ~pd.isnull(values) & ~filled[pos]
+            values_out[pos[take]] = values[take]
+            filled[pos[take]] = True
+
+        # Like combine_first, keep the dtype if no values are missing
+        if filled.all() and len(set(dtypes)) == 1:
+            values_out = values_out.astype(dtypes[0])
+
+        data[i] = values_out
+
+    data_set = pd.DataFrame(data, index=index, columns=range(len(columns)))
+    data_set.columns = columns
+
+    return data_set
@@ -0,0 +1,98 @@
+"""
+Open Power System Data
+
+Timeseries Datapackage
+
+periods.py : find the containers whose period overlaps a time window
+
+"""
+
+from bisect import bisect_left, bisect_right
+from datetime import datetime
+from functools import lru_cache
+from itertools import accumulate
+import logging
+
+logger = logging.getLogger('log')
+
+
+def parse_period(period):
+    """
+    Return the first and the last day of a container period.
+
+    Parameters
+    ----------
+    period : str
+        Name of the container, e.g. '2016-01-01_2016-01-31'
+
+    Returns
+    ----------
+    start, end : datetime.date
+
+    """
+
+    start, end = period.split('_')
+
+    return (datetime.strptime(start, '%Y-%m-%d').date(),
+            datetime.strptime(end, '%Y-%m-%d').date())
+
+
+class PeriodIndex(object):
+    """
+    Sorted index of container periods, to find the ones overlapping a time
+    window by binary search instead of parsing and comparing each period.
+
+    The periods are sorted by their first day. Since periods may overlap
+    (e.g. a yearly file next to monthly ones), the index also holds the
+    running maximum of their last days, which is sorted as well: All
+    periods before the first position at which it reaches the start of the
+    window end before the window.
+
+    Names that are no period, e.g. of a directory placed manually, are
+    left out of the index and their positions listed in unparsed.
+
+    Parameters
+    ----------
+    periods : sequence of str
+        Names of the containers, e.g. '2016-01-01_2016-01-31'
+
+    """
+
+    def __init__(self, periods):
+        bounds = {}
+        self.unparsed = []
+        for i, period in enumerate(periods):
+            try:
+                bounds[i] = parse_period(period)
+            except ValueError:
+                self.unparsed.append(i)
+        self._order = sorted(bounds, key=lambda i: bounds[i])
+        self.starts = [bounds[i][0] for i in self._order]
+        self.ends = [bounds[i][1] for i in self._order]
+        self.max_ends = list(accumulate(self.ends, max))
+
+    def overlapping(self, start=None, end=None):
+        """
+        Return the positions in periods of the periods that overlap the
+        window from start to end (both included), ordered by their first
+        day. start or end None leave the window open on that side.
+
+        """
+
+        last = len(self.starts) if end is None else bisect_right(
+            self.starts, end)
+        first = 0 if start is None else bisect_left(self.max_ends, start)
+
+        return [self._order[i] for i in range(first, last)
+                if start is None or self.ends[i] >= start]
+
+
+@lru_cache(maxsize=256)
+def period_index(periods):
+    """
+    Return the PeriodIndex of periods, a tuple of container names. It is
+    built only once per process for the same containers.
+
+    """
+
+    return PeriodIndex(periods)
@@ -0,0 +1,167 @@
+"""
+Open Power System Data
+
+Timeseries Datapackage
+
+profiling.py : record wall time, CPU time, rows, bytes and peak memory of
+the stages of a run and write them to a report
+
+"""
+
+from contextlib import contextmanager
+from datetime import datetime
+import json
+import logging
+import os
+import sys
+import threading
+import time
+
+import pandas as pd
+
+try:
+    import resource
+except ImportError:  # not available on Windows
+    resource = None
+
+logger = logging.getLogger('log')
+
+# Columns of the report, in this order. Labels not listed here are appended.
+FIELDS = ['stage', 'source', 'variable', 'file', 'column', 'step', 'wall',
+          'cpu', 'rows', 'bytes', 'peak_memory', 'pid']
+
+
+def peak_memory():
+    """
+    Return the peak resident memory of this process so far in bytes, None
+    where it is not available.
+
+    """
+
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in kilobytes on Linux, but in bytes on macOS
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+@contextmanager
+def measure(stage, **labels):
+    """
+    Measure the code run in the with-block and yield its record, a dict of
+    stage, the labels and, once the block is left, the measurements:
+
+    wall : seconds passed
+    cpu : CPU seconds used by this process (all of its threads)
+    peak_memory : peak resident memory of this process in bytes after the
+        block. As this is the high-water mark of the process, the stage that
+        raises it stands out in the report.
+    pid : id of the process
+
+    The block may add rows and bytes or further labels to the record. The
+    record is not added to any report, so this can be used in worker
+    processes, which return it to the parent. See Report.measure() for the
+    usual case.
+
+    """
+
+    record = dict(labels, stage=stage)
+    wall = time.perf_counter()
+    cpu = time.process_time()
+    try:
+        yield record
+    finally:
+        record['wall'] = time.perf_counter() - wall
+        record['cpu'] = time.process_time() - cpu
+        record['peak_memory'] = peak_memory()
+        record['pid'] = os.getpid()
+
+
+class Report(object):
+    """
+    The measurements of one run, one record per reader call, download,
+    find_nan column or export step. Records may be added from several
+    threads.
+
+    """
+
+    def __init__(self):
+        self.started = datetime.utcnow()
+        self.records = []
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def measure(self, stage, **labels):
+        """
+        Measure the code run in the with-block and add its record to the
+        report. See measure().
+
+        """
+
+        record = None
+        try:
+            with measure(stage, **labels) as record:
+                yield record
+        finally:
+            # Stages that fail are recorded as well
+            if record is not None:
+                self.add(record)
+
+    def add(self, *records):
+        """Add records, e.g. measured in a worker process."""
+        with self._lock:
+            self.records.extend(records)
+
+    def clear(self):
+        """Remove all records and start a new run."""
+        with self._lock:
+            self.records = []
+            self.started = datetime.utcnow()
+
+    def to_frame(self):
+        """Return the records as a DataFrame, one row per record."""
+        with self._lock:
+            records = list(self.records)
+        columns = FIELDS + sorted(
+            {label for record in records for label in record} - set(FIELDS))
+
+        return pd.DataFrame(records, columns=columns)
+
+    def summary(self, by=('stage', 'source')):
+        """
+        Return the total wall time, CPU time, rows and bytes and the highest
+        peak memory of the records, grouped by the labels in by, the
+        slowest group first.
+
+        """
+
+        frame = self.to_frame()
+        by = list(by)
+        frame[by] = frame[by].fillna('')
+        summary = frame.groupby(by).agg({'wall': 'sum', 'cpu': 'sum',
+                                         'rows': 'sum', 'bytes': 'sum',
+                                         'peak_memory': 'max'})
+
+        return summary.sort_values('wall', ascending=False)
+
+    def write(self, path):
+        """
+        Write the records to path, as CSV if it ends with .csv and as JSON
+        otherwise.
+
+        """
+
+        if os.path.splitext(path)[1].lower() == '.csv':
+            self.to_frame().to_csv(path, index=False)
+        else:
+            with self._lock:
+                records = list(self.records)
+            with open(path, 'w') as f:
+                json.dump({'started': self.started.isoformat(),
+                           'records': records}, f, indent=1, default=str)
+
+        logger.info('profiling report written to %s', path)
+
+
+# The report of this run
+report = Report()
@@ -7,20 +7,87 @@ read.py : read time series files
 
 """
 import pytz
-import yaml
+import hashlib
+import io
 import os
-import sys
 import numpy as np
 import pandas as pd
 import logging
 import zipfile
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime, date, time, timedelta
 
+from .cache import FrameCache
+from .excel import read_header, read_sheet
+from .manifest import archive_files, checksum, open_manifest
+from .merge import merge
+from .periods import period_index
+from .profiling import measure, report
+from . import timestamps, timezones
+
 logger = logging.getLogger('log')
-logger.setLevel('DEBUG')
 
+# Increase whenever a read function changes its output, so that frames
+# cached with the old version are not used any more
+PARSER_VERSION = 4
+
+# dtype of the data columns of all files
+VALUE_DTYPE = 'float64'
+
+# A data column of a source file and its place in the column MultiIndex. key
+# is the name of the column in the file or, for files read by position, its
+# position (0-indexed).
+Column = namedtuple('Column', ['key', 'variable', 'region', 'attribute'])
+
+# A file to be read: its path (or that of the archive it is in), the archive
+# member (None if extracted), its checksum (None if not known) and the
+# period of its container.
+File = namedtuple('File', ['path', 'member', 'checksum', 'period'])
+
+
+def column_index(columns, source, url, headers):
+    """
+    Return the column MultiIndex for the data read from the given columns.
+
+    Parameters
+    ----------
+    columns : list of Column
+        The columns read, in the order of the data
+    source : str
+        Name of the source to be placed in the column-MultiIndex
+    url : str
+        URL of the Source to be placed in the column-MultiIndex
+    headers : list
+        List of strings indicating the level names of the pandas.MultiIndex
+        for the columns of the dataframe
+
+    """
+
+    tuples = [(column.variable, column.region, column.attribute, source, url)
+              for column in columns]
+
+    return pd.MultiIndex.from_tuples(tuples, names=headers)
+
+
+def to_values(df):
+    """
+    Convert the data columns read from an Excel sheet to VALUE_DTYPE. Cells
+    that are no numbers, e.g. text, become NaN as the na_values of the csv
+    readers do.
 
-def read_pse(filepath, variable_name, url, headers):
+    """
+
+    values = df.apply(pd.to_numeric, errors='coerce').astype(VALUE_DTYPE)
+    dropped = int(df.notnull().values.sum() - values.notnull().values.sum())
+    if dropped:
+        logger.warning('%s cells that are no numbers were left empty',
+                       dropped)
+
+    return values
+
+
+def read_pse(filepath, variable_name, url, headers, columns):
     """
     Read a .csv file from PSE into a DataFrame.
 
@@ -35,6 +102,8 @@ def read_pse(filepath, variable_name, url, headers):
     headers : list
         List of strings indicating the level names of the pandas.MultiIndex
         for the columns of the dataframe
+    columns : list of Column
+        The data columns to read, see READERS
 
     Returns
     ----------
@@ -55,359 +124,285 @@ def read_pse(filepath, variable_name, url, headers):
         dayfirst=False,
         decimal=',',
         thousands=None,
-        # hours are indicated by their ending time. During fall DST,
-        # UTC 23:00-00:00 = CEST 1:00-2:00 is indicated by '02',
-        # UTC 00:00-01:00 = CEST 2:00-3:00 is indicated by '02A',
-        # UTC 01:00-02:00 = CET  2:00-3:00 is indicated by '03'.
-        # regular hours require backshifting by 1 period
-        converters={'Godzina': lambda x: '2:00' if x ==
-                    '02A' else str(int(x) - 1) + ':00'},
-        usecols=None,
+        dtype={column.key: VALUE_DTYPE for column in columns},
+        converters=None,
+        usecols=['Data', 'Godzina'] + [column.key for column in columns],
     )
-    # Create a list of spring-daylight savings time (DST)-transitions
-    dst_transitions_spring = [
-        d.replace(hour=2)
-        for d in pytz.timezone('Europe/Copenhagen')._utc_transition_times
-        if d.year >= 2000 and d.month == 3]
+
+    # hours are indicated by their ending time. During fall DST,
+    # UTC 23:00-00:00 = CEST 1:00-2:00 is indicated by '02',
+    # UTC 00:00-01:00 = CEST 2:00-3:00 is indicated by '02A',
+    # UTC 01:00-02:00 = CET  2:00-3:00 is indicated by '03'.
+    # regular hours require backshifting by 1 period
+    hours = pd.to_numeric(df['Godzina'].replace('02A', '03')).values - 1
+    days = timestamps.parse_dates(df['Data'])
 
     # The hour from 01:00 - 02:00 is indexed by "03:00",
     # requiring backshifting by another period
+    dst_transitions_spring = timezones.dst_transitions(
+        'Europe/Copenhagen', month=3)
+    slicer = timestamps.combine(days, hours).isin(dst_transitions_spring)
+    hours[slicer] = 1
 
-    df['timestamp'] = pd.to_datetime(
-        df['Data'].astype(str) + ' ' +
-        df['Godzina'])
-
-    slicer = df['timestamp'].isin(dst_transitions_spring)
-    df.loc[slicer, 'Godzina'] = '1:00'
-
-    df['timestamp'] = pd.to_datetime(
-        df['Data'].astype(str) + ' ' +
-        df['Godzina'])
-    df.set_index('timestamp', inplace=True)
+    df.index = timestamps.combine(days, hours)
 
     # 'ambigous' refers to how the October dst-transition hour is handled.
     # ‘infer’ will attempt to infer dst-transition hours based on order.
-    df.index = df.index.tz_localize('Europe/Berlin', ambiguous='infer')
-    df.index = df.index.tz_convert(None)
-
-    # Translate columns
-    colmap = {'Sumaryczna generacja źródeł wiatrowych': (
-        'wind', 'PL', 'generation', 'PSE', url)}
+    df.index = timezones.to_utc(df.index, 'Europe/Berlin', ambiguous='infer')
 
-    # Drop any column not in colmap
-    df = df[list(colmap.keys())]
+    # Drop any column not declared
+    df = df[[column.key for column in columns]]
 
     # Create the MultiIndex.
-    tuples = [colmap[col] for col in df.columns]
-    df.columns = pd.MultiIndex.from_tuples(tuples, names=headers)
+    df.columns = column_index(columns, 'PSE', url, headers)
 
     return df
 
 
-def read_ceps(filepath, variable_name, url, headers):
+def read_ceps(filepath, variable_name, url, headers, columns):
     '''Read a file from CEPS into a DataFrame'''
-    df = pd.read_excel(
-        io=filepath,
-        header=2,
-        skiprows=None,
-        index_col=0,
-        parse_cols=[0, 1, 2]
-    )
+    # The column headers are in the 3rd row
+    df = read_sheet(filepath, skiprows=3,
+                    usecols=[0] + [column.key for column in columns])
+    df.set_index(0, inplace=True)
 
     df.index = pd.to_datetime(df.index.rename('timestamp'))
 
-    df.index = df.index.tz_localize('Europe/Brussels', ambiguous='infer')
-    df.index = df.index.tz_convert(None)
-
-    # Translate columns
-    colmap = {'WPP [MW]': ('wind-onshore', 'CZ', 'generation', 'CEPS', url),
-              'PVPP [MW]': ('solar', 'CZ', 'generation', 'CEPS', url), }
+    df.index = timezones.to_utc(df.index, 'Europe/Brussels', ambiguous='infer')
 
     # Create the MultiIndex.
-    tuples = [colmap[col] for col in df.columns]
-    df.columns = pd.MultiIndex.from_tuples(tuples, names=headers)
+    df = to_values(df)
+    df.columns = column_index(columns, 'CEPS', url, headers)
 
     return df
 
 
-def read_elia(filepath, variable_name, url, headers):
+def read_elia(filepath, variable_name, url, headers, columns):
     '''Read a file from Elia into a DataFrame'''
-    df = pd.read_excel(
-        io=filepath,
-        header=None,
-        skiprows=4,
-        index_col=0,
-        parse_cols=[0, 2, 4, 5]
-    )
-
-    df.columns = ['forecast', 'generation', 'capacity']
+    df = read_sheet(filepath, skiprows=4,
+                    usecols=[0] + [column.key for column in columns])
+    df.set_index(0, inplace=True)
 
     df.index = pd.to_datetime(df.index.rename('timestamp'))
 
-    df.index = df.index.tz_localize('Europe/Brussels', ambiguous='infer')
-    df.index = df.index.tz_convert(None)
+    df.index = timezones.to_utc(df.index, 'Europe/Brussels', ambiguous='infer')
 
     # Create the MultiIndex
-    tuples = [(variable_name, 'BE', attribute, 'Elia', url)
-              for attribute in df.columns]
-    df.columns = pd.MultiIndex.from_tuples(tuples, names=headers)
+    df = to_values(df)
+    df.columns = column_index(columns, 'Elia', url, headers)
 
     return df
 
 
-def read_energinet_dk(filepath, url, headers):
+def read_energinet_dk(filepath, variable_name, url, headers, columns):
     '''Read a file from energinet.dk into a DataFrame'''
-    df = pd.read_excel(
-        io=filepath,
-        header=2,  # the column headers are taken from 3rd row.
-        # 2nd row also contains header info like in a multiindex,
-        # i.e. wether the colums are price or generation data.
-        # However, we will make our own columnnames below.
-        # Row 3 is enough to unambigously identify the columns
-        skiprows=None,
-        index_col=None,
-        parse_cols=None,  # None means: parse all columns
-        thousands=','
-    )
+    # The column headers are taken from 3rd row. 2nd row also contains
+    # header info like in a multiindex, i.e. wether the colums are price or
+    # generation data. However, we will make our own columnnames below.
+    # Row 3 is enough to unambigously identify the columns
+    names = read_header(filepath, row=2)
+    positions = [names.index(column.key) for column in columns]
 
-    df.index.rename(['date', 'hour'], inplace=True)
-    df.reset_index(inplace=True)
-    df['timestamp'] = pd.to_datetime(
-        df['date'].astype(str) + ' ' +
-        (df['hour'] - 1).astype(str) + ':00')
-    df.set_index('timestamp', inplace=True)
+    # Date and hour are in the first two columns
+    df = read_sheet(filepath, skiprows=3, usecols=[0, 1] + positions)
 
-    # Create a list of spring-daylight savings time (DST)-transitions
-    dst_transitions_spring = [
-        d.replace(hour=2)
-        for d in pytz.timezone('Europe/Copenhagen')._utc_transition_times
-        if d.year >= 2000 and d.month == 3]
+    df.index = timestamps.combine(timestamps.parse_dates(df[0]),
+                                  df[1].astype('int64') - 1)
 
     # Drop 3rd hour for (spring) DST-transition from df.
-    df = df[~df.index.isin(dst_transitions_spring)]
-
-    dst_arr = np.ones(len(df.index), dtype=bool)
-    df.index = df.index.tz_localize('Europe/Copenhagen', ambiguous=dst_arr)
-    df.index = df.index.tz_convert(None)
-
-    source = 'Energinet.dk'
-    colmap = {
-        'DK-West':
-            ('price', 'DK-west', 'elspot', source, url),
-        'DK-East':
-            ('price', 'DK-east', 'elspot', source, url),
-        'Norway':
-            ('price', 'NO', 'elspot', source, url),
-        'Sweden (SE)':
-            ('price', 'SE', 'elspot', source, url),
-        'Sweden (SE3)':
-            ('price', 'SE-3', 'elspot', source, url),
-        'Sweden (SE4)':
-            ('price', 'SE-4', 'elspot', source, url),
-        'DE European Power Exchange':
-            ('price', 'DE', 'epex', source, url),
-        'DK-West: Wind power production':
-            ('wind', 'DK-west', 'generation', source, url),
-        'DK-West: Solar cell production (estimated)':
-            ('solar', 'DK-west', 'generation', source, url),
-        'DK-East: Wind power production':
-            ('wind', 'DK-east', 'generation', source, url),
-        'DK-East: Solar cell production (estimated)':
-            ('solar', 'DK-east', 'generation', source, url),
-        'DK: Wind power production (onshore)':
-            ('wind-onshore', 'DK', 'generation', source, url),
-        'DK: Wind power production (offshore)':
-            ('wind-offshore', 'DK', 'generation', source, url)
-    }
-
-    # Drop any column not in colmap
-    df = df[list(colmap.keys())]
+    df = df[~df.index.isin(
+        timezones.dst_transitions('Europe/Copenhagen', month=3))]
 
-    # Create the MultiIndex.
-    tuples = [colmap[col] for col in df.columns]
-    df.columns = pd.MultiIndex.from_tuples(tuples, names=headers)
+    # The hour from 2:00 to 2:59 at the fall DST-transition is summertime
+    df.index = timezones.to_utc(df.index, 'Europe/Copenhagen',
+                                ambiguous='summer')
 
-    # Drop any other columns that might have been included in download
-    df.drop(['drop_me'], axis=1, level=2, inplace=True)
+    # Values stored as text use a comma as thousands separator
+    df = to_values(df[positions].applymap(
+        lambda value: value.replace(',', '') if isinstance(value, str)
+        else value))
+
+    # Create the MultiIndex.
+    df.columns = column_index(columns, 'Energinet.dk', url, headers)
 
     return df
 
 
-def read_entso_e_portal(filepath, url, headers):
-    '''Read a file from ENTSO-E into a DataFrame'''
-    df = pd.read_excel(
-        io=filepath,
-        header=9,  # 0 indexed, so the column names are actually in the 10th row
-        skiprows=None,
-        # create MultiIndex from first 2 columns ['Country', 'Day']
-        index_col=[0, 1],
-        parse_cols=None,  # None means: parse all columns
-        na_values=['n.a.']
-    )
-
-    df.columns.names = ['raw_hour']
+# Country codes in the ENTSO-E files that are renamed in the column index
+ENTSO_E_REGIONS = {'DK_W': 'DK-west', 'UA_W': 'UA-west'}
 
-    # The original data has days and countries in the rows and hours in the
-    # columns.  This rearranges the table, mapping hours on the rows and
-    # countries on the columns.
-    df = df.stack(level='raw_hour').unstack(level='Country').reset_index()
 
-    # Format of the raw_hour-column is normally is 01:00:00, 02:00:00 etc.
+def read_entso_e_portal(filepath, variable_name, url, headers,
+                        columns=None):
+    '''Read a file from ENTSO-E into a DataFrame'''
+    # The column names are in the 10th row
+    df = read_sheet(filepath, skiprows=9, na_values=['n.a.'])
+    raw_hours = df.iloc[0, 2:]
+    raw_hours = raw_hours[raw_hours.notnull()]
+    df = df.iloc[1:]
+    df = df[df[0].notnull() & df[1].notnull()]
+
+    # The original data has one row per country and day and one column per
+    # hour. The values are placed in a cube of days x hours x countries,
+    # so that reshaping it maps hours on the rows and countries on the
+    # columns.
+    country_codes, countries = pd.factorize(df[0], sort=True)
+    day_codes, days = pd.factorize(timestamps.parse_dates(df[1]), sort=True)
+    cube = np.full((len(days), len(raw_hours), len(countries)), np.nan)
+    cube[day_codes, :, country_codes] = (
+        to_values(df[raw_hours.index]).values)
+
+    # Format of the raw hours is normally is 01:00:00, 02:00:00 etc.
     # during the year, but 3A:00:00, 3B:00:00 for the (possibely
-    # DST-transgressing) 3rd hour of every day in October, we truncate the
-    # hours column after 2 characters and replace letters which are there to
-    # indicate the order during fall DST-transition.
-    df['hour'] = df['raw_hour'].str[:2].str.replace(
-        'A', '').str.replace('B', '')
-    # Hours are indexed 1-24 by ENTSO-E, but pandas requires 0-23, so we deduct 1,
-    # i.e. the 3rd hour will be indicated by "2:00" rather than "3:00"
-    df['hour'] = (df['hour'].astype(int) - 1).astype(str)
-
-    df['timestamp'] = pd.to_datetime(df['Day'] + ' ' + df['hour'] + ':00')
-    df.set_index('timestamp', inplace=True)
-
-    # Create a list of daylight savings time (DST)-transitions
-    dst_transitions = [
-        d.replace(hour=2)
-        for d in pytz.timezone('Europe/Berlin')._utc_transition_times
-        if d.year >= 2000]
-
-    # Drop 2nd occurence of 3rd hour appearing in October file
-    # except for the day of the actual autumn DST-transition.
-    df = df[~((df['raw_hour'] == '3B:00:00') & ~
-              (df.index.isin(dst_transitions)))]
-
-    # Drop 3rd hour for (spring) DST-transition. October data
-    # is unaffected the format is 3A:00:00/3B:00:00.
-    df = df[~((df['raw_hour'] == '03:00:00') &
-              (df.index.isin(dst_transitions)))]
-
-    df.drop(['Day', 'hour', 'raw_hour'], axis=1, inplace=True)
-    df.index = df.index.tz_localize('Europe/Brussels', ambiguous='infer')
-    df.index = df.index.tz_convert(None)
-
-    df.rename(columns={'DK_W': 'DK-west', 'UA_W': 'UA-west'}, inplace=True)
-
-    # Create the MultiIndex.
-    tuples = [('load', country, 'load', 'ENTSO-E Data Portal', url)
-              for country in df.columns]
-    df.columns = pd.MultiIndex.from_tuples(tuples, names=headers)
+    # DST-transgressing) 3rd hour of every day in October. Hours are indexed
+    # 1-24 by ENTSO-E, but pandas requires 0-23, so we deduct 1, i.e. the
+    # 3rd hour will be indicated by "2:00" rather than "3:00"
+    raw_hours = np.array([str(raw_hour)[:2] for raw_hour in raw_hours])
+    is_3b = raw_hours == '3B'
+    is_03 = raw_hours == '03'
+    hours = np.array([int(raw_hour.rstrip('AB')) for raw_hour in raw_hours])
+    hours -= 1
+
+    # 3B:00:00 is only a real hour on the day of the autumn DST-transition,
+    # when the day has 25 hours. 03:00:00 is none on the day of the spring
+    # DST-transition (23 hours) and given as 3A/3B in autumn.
+    day_hours = timezones.hours_per_day(days, 'Europe/Brussels')
+    keep = (~(is_3b[np.newaxis, :] & (day_hours[:, np.newaxis] != 25)) &
+            ~(is_03[np.newaxis, :] & (day_hours[:, np.newaxis] != 24)))
+
+    # Order the hours of each day, 3A before 3B
+    order = np.lexsort((is_3b, hours))
+    cube = cube[:, order, :]
+    keep = keep[:, order]
+    index = (np.asarray(days, dtype='datetime64[ns]')[:, np.newaxis] +
+             hours[order][np.newaxis, :] * np.timedelta64(1, 'h'))
+
+    # Drop the hours without a value for any country
+    values = cube.reshape(-1, len(countries))
+    keep = keep.ravel() & ~np.isnan(values).all(axis=1)
+    df = pd.DataFrame(values[keep], columns=countries,
+                      index=pd.DatetimeIndex(index.ravel()[keep],
+                                             name='timestamp'))
+
+    df.index = timezones.to_utc(df.index, 'Europe/Brussels', ambiguous='infer')
+
+    df.rename(columns=ENTSO_E_REGIONS, inplace=True)
+
+    # Create the MultiIndex. The countries are found in the file.
+    df.columns = column_index(
+        [Column(country, 'load', country, 'load') for country in df.columns],
+        'ENTSO-E Data Portal', url, headers)
 
     return df
 
 
-def read_hertz(filepath, variable_name, url, headers):
+def entso_e_portal_columns(filepath, variable_name, url, headers):
+    '''Return the columns read_entso_e_portal() finds in a file'''
+    # Only the countries and days below the row of column names are needed
+    df = read_sheet(filepath, skiprows=10, usecols=[0, 1])
+    countries = sorted(df[0][df[0].notnull() & df[1].notnull()].unique())
+    countries = [ENTSO_E_REGIONS.get(country, country)
+                 for country in countries]
+
+    return column_index(
+        [Column(country, 'load', country, 'load') for country in countries],
+        'ENTSO-E Data Portal', url, headers)
+
+
+def read_hertz(filepath, variable_name, url, headers, columns):
     '''Read a file from 50Hertz into a DataFrame'''
     # Since 2016, wind data has an aditional column for offshore.
     # Baltic 1 has been producing since 2011-05-02 and Baltic2 since
     # early 2015 (source: Wikipedia) so it is probably not correct that 50Hertz-Wind
     # data pre-2016 is only onshore. Maybe we can ask at 50Hertz directly.
-    if variable_name.split('_')[0] == 'wind':
-        tech, attribute, phase = variable_name.split('_')
-        tuples = [('wind', 'DE-50hertz', attribute, '50Hertz', url)]
-        usecols = [0, 1, 3]
-
-        if phase == 'with-offshore':
-            tuples = [('wind', 'DE-50hertz', attribute, '50Hertz', url),
-                      ('wind-onshore', 'DE-50hertz', attribute, '50Hertz', url),
-                      ('wind-offshore', 'DE-50hertz', attribute, '50Hertz', url)]
-            usecols = [0, 1, 3, 4, 5]
-
-    elif variable_name.split('_')[0] == 'solar':
-        tech, attribute = variable_name.split('_')
-        cols = ['date', 'time', attribute]
-        tuples = [('solar', 'DE-50hertz', attribute, '50Hertz', url)]
-        usecols = [0, 1, 3]
-
     df = pd.read_csv(
         filepath,
         sep=';',
         header=3,
-        index_col='timestamp',
+        index_col=None,
         names=None,
-        parse_dates={'timestamp': ['Datum', 'Von']},
+        parse_dates=False,
         date_parser=None,
         dayfirst=True,
         decimal=',',
         thousands='.',
-        # truncate values in 'time' column after 5th character
-        converters={'Von': lambda x: x[:5]},
-        usecols=usecols,
+        dtype={'Datum': str, 'Von': str},
+        converters=None,
+        usecols=[0, 1] + [column.key for column in columns],
     )
 
+    # Only the first 5 characters of the 'Von' column give the time
+    df.index = timestamps.combine(
+        timestamps.parse_dates(df['Datum'], dayfirst=True),
+        minutes=timestamps.parse_times(df['Von']))
+    df.drop(['Datum', 'Von'], axis=1, inplace=True)
+
     # Until 2006, and in 2015 (except for wind_generation_pre-offshore),
     # during the fall dst-transistion, only the
     # wintertime hour (marked by a B in the data) is reported, the summertime
-    # hour, (marked by an A) is missing in the data.
-    # dst_arr is a boolean array consisting only of "False" entries, telling
-    # python to treat the hour from 2:00 to 2:59 as wintertime.
+    # hour, (marked by an A) is missing in the data, so the hour from 2:00 to
+    # 2:59 is treated as wintertime.
     if (2006 < pd.to_datetime(df.index.values[0]).year < 2015 or
             (variable_name == 'wind_generation_pre-offshore' and
              pd.to_datetime(df.index.values[0]).year == 2015)):
-        df.index = df.index.tz_localize('Europe/Berlin', ambiguous='infer')
+        ambiguous = 'infer'
     else:
-        dst_arr = np.zeros(len(df.index), dtype=bool)
-        df.index = df.index.tz_localize('Europe/Berlin', ambiguous=dst_arr)
+        ambiguous = 'winter'
 
-    df.index = df.index.tz_convert(None)
+    df.index = timezones.to_utc(df.index, 'Europe/Berlin', ambiguous=ambiguous)
 
     # Create the MultiIndex
-    df.columns = pd.MultiIndex.from_tuples(tuples, names=headers)
+    df = df.astype(VALUE_DTYPE)
+    df.columns = column_index(columns, '50Hertz', url, headers)
 
     return df
 
 
-def read_amprion(filepath, variable_name, url, headers):
+def read_amprion(filepath, variable_name, url, headers, columns):
     '''Read a file from Amprion into a DataFrame'''
+    attributes = [column.attribute for column in columns]
+    dtype = {attribute: VALUE_DTYPE for attribute in attributes}
+    dtype.update({'date': str, 'time': str})
     df = pd.read_csv(
         filepath,
         sep=';',
         header=0,
-        index_col='timestamp',
-        names=['date', 'time', 'forecast', 'generation'],
-        parse_dates={'timestamp': ['date', 'time']},
+        index_col=None,
+        names=['date', 'time'] + attributes,
+        parse_dates=False,
         date_parser=None,
         dayfirst=True,
         decimal=',',
         thousands=None,
-        # Truncate values in 'time' column after 5th character.
-        converters={'time': lambda x: x[:5]},
-        usecols=[0, 1, 2, 3],
+        dtype=dtype,
+        converters=None,
+        usecols=[0, 1] + [column.key for column in columns],
     )
 
-    index1 = df.index[df.index.year <= 2009]
-    index1 = index1.tz_localize('Europe/Berlin', ambiguous='infer')
+    # Only the first 5 characters of the 'time' column give the time
+    df.index = timestamps.combine(
+        timestamps.parse_dates(df['date'], dayfirst=True),
+        minutes=timestamps.parse_times(df['time']))
+    df.drop(['date', 'time'], axis=1, inplace=True)
+
+    index1 = timezones.to_utc(df.index[df.index.year <= 2009],
+                              'Europe/Berlin', ambiguous='infer')
 
     # In the years after 2009, during the fall dst-transistion, only the
-    # summertime hour is reported, the wintertime hour is missing in the data.
-    # dst_arr is a boolean array consisting only of "True" entries, telling
-    # python to treat the hour from 2:00 to 2:59 as summertime.
-    index2 = df.index[df.index.year > 2009]
-    dst_arr = np.ones(len(index2), dtype=bool)
-    index2 = index2.tz_localize('Europe/Berlin', ambiguous=dst_arr)
+    # summertime hour is reported, the wintertime hour is missing in the data,
+    # so the hour from 2:00 to 2:59 is treated as summertime.
+    index2 = timezones.to_utc(df.index[df.index.year > 2009],
+                              'Europe/Berlin', ambiguous='summer')
     df.index = index1.append(index2)
-    df.index = df.index.tz_convert(None)
 
     # Create the MultiIndex
-    tuples = [(variable_name, 'DE-amprion', attribute, 'Amprion', url)
-              for attribute in df.columns]
-    df.columns = pd.MultiIndex.from_tuples(tuples, names=headers)
+    df.columns = column_index(columns, 'Amprion', url, headers)
 
     return df
 
 
-def read_tennet(filepath, variable_name, url, headers):
+def read_tennet(filepath, variable_name, url, headers, columns):
     '''Read a file from TenneT into a DataFrame'''
-    if variable_name == 'solar':
-        cols = [0, 1, 2, 3]
-        colmap = {'Datum': 'date', 'Position': 'pos', 'prognostiziert [MW]': 'forecast',
-                  'tatsächlich [MW]': 'solar'}
-
-    if variable_name == 'wind':
-        cols = [0, 1, 2, 3, 4]
-        colmap = {'Datum': 'date', 'Position': 'pos', 'prognostiziert [MW]': 'forecast',
-                  'tatsächlich [MW]': 'wind', 'Anteil Offshore [MW]': 'wind-offshore'}
-
     df = pd.read_csv(
         filepath,
         sep=';',
@@ -420,80 +415,82 @@ def read_tennet(filepath, variable_name, url, headers):
         dayfirst=True,
         thousands=None,
         converters=None,
-        usecols=cols,
+        usecols=[0, 1] + [column.key for column in columns],
     )
 
-    df = df.rename(columns=colmap)
+    # 'Datum' and 'Position', followed by the data columns
+    df.columns = ['date', 'pos'] + [column.key for column in columns]
 
     df['date'].fillna(method='ffill', limit=100, inplace=True)
 
-    # Check the rows for irregularities
-    for i in range(len(df.index)):
-        # On the day in March when summertime begins, shift the data forward by
-        # 1 hour, beginning with the 9th quarter-hour, so the index runs again
-        # up to 96
-        if (df['pos'][i] == 92 and ((i == len(df.index) - 1) or (df['pos'][i + 1] == 1))):
-            slicer = df[(df['date'] == df['date'][i]) & (df['pos'] >= 9)].index
-            df.loc[slicer, 'pos'] = df['pos'] + 4
-
-        if df['pos'][i] > 96:  # True when summertime ends in October
-            logger.debug('%s th quarter-hour at %s, position %s',
-                         df['pos'][i], df.ix[i, 'date'], (i))
-
-            # Instead of having the quarter-hours' index run up to 100, we want
-            # to have it set back by 1 hour beginning from the 13th
-            # quarter-hour, ending at 96
-            if df['pos'][i] == 100 and not (df['pos'] == 101).any():
-                slicer = df[(df['date'] == df['date'][i])
-                            & (df['pos'] >= 13)].index
-                df.loc[slicer, 'pos'] = df['pos'] - 4
+    # Check the days for irregularities
+    # On the day in March when summertime begins, the last position is 92.
+    # Shift the data forward by 1 hour, beginning with the 9th quarter-hour,
+    # so the index runs again up to 96
+    is_last = np.arange(len(df.index)) == len(df.index) - 1
+    day_ends = (df['pos'].shift(-1) == 1).values | is_last
+    spring_days = df.loc[(df['pos'] == 92) & day_ends, 'date'].dropna()
+    slicer = df['date'].isin(spring_days.unique()) & (df['pos'] >= 9)
+    df.loc[slicer, 'pos'] += 4
+
+    # True when summertime ends in October
+    for i in df.index[df['pos'] > 96]:
+        logger.debug('%s th quarter-hour at %s, position %s',
+                     df.loc[i, 'pos'], df.loc[i, 'date'], (i))
+
+    # Instead of having the quarter-hours' index run up to 100, we want
+    # to have it set back by 1 hour beginning from the 13th
+    # quarter-hour, ending at 96
+    if not (df['pos'] == 101).any():
+        fall_days = df.loc[df['pos'] == 100, 'date'].dropna()
+        slicer = df['date'].isin(fall_days.unique()) & (df['pos'] >= 13)
+        df.loc[slicer, 'pos'] -= 4
 
     # Compute timestamp from position and generate datetime-index
-    df['hour'] = (np.trunc((df['pos'] - 1) / 4)).astype(int).astype(str)
-    df['minute'] = (((df['pos'] - 1) % 4) * 15).astype(int).astype(str)
-    df['timestamp'] = pd.to_datetime(df['date'] + ' ' + df['hour'] + ':' +
-                                     df['minute'], dayfirst=True)
-    df.set_index('timestamp', inplace=True)
+    df.index = timestamps.from_positions(
+        timestamps.parse_dates(df['date'], dayfirst=True), df['pos'])
 
-    df.drop(['pos', 'date', 'hour', 'minute'], axis=1, inplace=True)
+    df.drop(['pos', 'date'], axis=1, inplace=True)
 
-    df.index = df.index.tz_localize('Europe/Berlin', ambiguous='infer')
-    df.index = df.index.tz_convert(None)
+    df.index = timezones.to_utc(df.index, 'Europe/Berlin', ambiguous='infer')
 
     # Create the MultiIndex
-    if variable_name == 'solar':
-        tuples = [('solar', 'DE-tennet', 'forecast', 'TenneT', url),
-                  ('solar', 'DE-tennet', 'generation', 'TenneT', url)]
-    if variable_name == 'wind':  # offshore generation starts 2009-09-20
-        tuples = [('wind', 'DE-tennet', 'forecast', 'TenneT', url),
-                  ('wind', 'DE-tennet', 'generation', 'TenneT', url),
-                  ('wind-offshore', 'DE-tennet', 'generation', 'TenneT', url)]
-    df.columns = pd.MultiIndex.from_tuples(tuples, names=headers)
+    df = df.astype(VALUE_DTYPE)
+    df.columns = column_index(columns, 'TenneT', url, headers)
 
     return df
 
 
-def read_transnetbw(filepath, variable_name, url, headers):
+def read_transnetbw(filepath, variable_name, url, headers, columns):
     '''Read a file from TransnetBW into a DataFrame'''
+    attributes = [column.attribute for column in columns]
+    dtype = {attribute: VALUE_DTYPE for attribute in attributes}
+    dtype.update({'date': str, 'time': str})
     df = pd.read_csv(
         filepath,
         sep=';',
         header=0,
-        index_col='timestamp',
-        names=['date', 'time', 'forecast', 'generation'],
-        parse_dates={'timestamp': ['date', 'time']},
+        index_col=None,
+        names=['date', 'time'] + attributes,
+        parse_dates=False,
         date_parser=None,
         dayfirst=True,
         decimal=',',
         thousands=None,
+        dtype=dtype,
         converters=None,
-        usecols=[2, 3, 4, 5],  # 0-indexed, i.e. "2" refers to the 3rd column
+        # 0-indexed, i.e. "2" refers to the 3rd column
+        usecols=[2, 3] + [column.key for column in columns],
     )
 
+    df.index = timestamps.combine(
+        timestamps.parse_dates(df['date'], dayfirst=True),
+        minutes=timestamps.parse_times(df['time']))
+    df.drop(['date', 'time'], axis=1, inplace=True)
+
     # 'ambigous' refers to how the October dst-transition hour is handled.
     # ‘infer’ will attempt to infer dst-transition hours based on order.
-    df.index = df.index.tz_localize('Europe/Berlin', ambiguous='infer')
-    df.index = df.index.tz_convert(None)
+    df.index = timezones.to_utc(df.index, 'Europe/Berlin', ambiguous='infer')
 
     # The 2nd column represents the start and the 4th the end of the respective
     # period. The former has some errors, so we use the latter to construct the
@@ -501,14 +498,12 @@ def read_transnetbw(filepath, variable_name, url, headers):
     df = df.shift(periods=-1, freq='15min', axis='index')
 
     # Create the MultiIndex
-    tuples = [(variable_name, 'DE-transnetbw', attribute, 'TransnetBW', url)
-              for attribute in df.columns]
-    df.columns = pd.MultiIndex.from_tuples(tuples, names=headers)
+    df.columns = column_index(columns, 'TransnetBW', url, headers)
 
     return df
 
 
-def read_opsd(filepath, url, headers):
+def read_opsd(filepath, variable_name, url, headers, columns):
     '''Read a file from OPSD into a DataFrame'''
     df = pd.read_csv(
         filepath,
@@ -521,20 +516,13 @@ def read_opsd(filepath, url, headers):
         dayfirst=False,
         decimal='.',
         thousands=None,
+        dtype={column.key: VALUE_DTYPE for column in columns},
         converters=None,
-        usecols=None
+        usecols=['day'] + [column.key for column in columns]
     )
 
-    # Translate columns
-    cap_DE = 'BNetzA and Netztransparenz.de'
-    colmap = {
-        'Solar': ('solar', 'DE', 'capacity', cap_DE, url),
-        'Onshore': ('wind-onshore', 'DE', 'capacity', cap_DE, url),
-        'Offshore': ('wind-offshore', 'DE', 'capacity', cap_DE, url)
-    }
-
-    # Drop any column not in colmap
-    df = df[list(colmap.keys())]
+    # Drop any column not declared
+    df = df[[column.key for column in columns]]
 
     # The capacities data only has one entry per day, which pandas
     # interprets as 00:00h. We will broadcast the dayly data for
@@ -544,41 +532,35 @@ def read_opsd(filepath, url, headers):
     last = pd.to_datetime([df.index[-1].replace(hour=23, minute=59)])
     until_last = df.index.append(last).rename('timestamp')
     df = df.reindex(index=until_last, method='ffill')
-    df.index = df.index.tz_localize('Europe/Berlin')
-    df.index = df.index.tz_convert(None)
+    df.index = timezones.to_utc(df.index, 'Europe/Berlin', ambiguous='raise')
     df = df.resample('15min').ffill()
 
     # Create the MultiIndex
-    tuples = [colmap[col] for col in df.columns]
-    df.columns = pd.MultiIndex.from_tuples(tuples, names=headers)
+    df.columns = column_index(columns, 'BNetzA and Netztransparenz.de', url,
+                              headers)
 
     return df
 
 
-def read_svenska_kraftnaet(filePath, variable_name, url, headers):
+def read_svenska_kraftnaet(filePath, variable_name, url, headers, columns):
     '''Read a file from Svenska Kraftnät into a DataFrame'''
     if variable_name in ['wind_solar_1', 'wind_solar_2']:
         skip = 4
-        cols = [0, 1, 3]
-        colnames = ['date', 'hour', 'wind']
+        cols = [0, 1]
+        colnames = ['date', 'hour']
     else:
         if variable_name == 'wind_solar_4':
             skip = 5
         else:
             skip = 7
-        cols = [0, 2, 8]
-        colnames = ['timestamp', 'wind', 'solar']
-
-    df = pd.read_excel(
-        io=filePath,
-        # read the last sheet (in some years,
-        # there are hidden sheets that would cause errors)
-        sheetname=-1,
-        header=None,
-        skiprows=skip,
-        index_col=None,
-        parse_cols=cols
-    )
+        cols = [0]
+        colnames = ['timestamp']
+    cols += [column.key for column in columns]
+    colnames += [column.variable for column in columns]
+
+    # read the last sheet (in some years,
+    # there are hidden sheets that would cause errors)
+    df = read_sheet(filePath, sheet=-1, skiprows=skip, usecols=cols)
 
     df.columns = colnames
 
@@ -586,11 +568,10 @@ def read_svenska_kraftnaet(filePath, variable_name, url, headers):
         # in 2009 there is a row below the table for the sums that we don't
         # want to read in
         df = df[df['date'].notnull()]
-        df['timestamp'] = pd.to_datetime(
-            df['date'].astype(int).astype(str) + ' ' +
-            df['hour'].astype(int).astype(str).str.replace('00', '') + ':00',
-            dayfirst=False,
-            infer_datetime_format=True)
+        # The hour is given as e.g. 100 for 1:00
+        df.index = timestamps.combine(
+            timestamps.parse_dates(df['date'].astype(int), dayfirst=False),
+            df['hour'].astype(int) // 100)
         df.drop(['date', 'hour'], axis=1, inplace=True)
     else:
         # in 2011 there is a row below the table for the sums that we don't
@@ -598,42 +579,325 @@ def read_svenska_kraftnaet(filePath, variable_name, url, headers):
         df = df[((df['timestamp'].notnull()) &
                  (df['timestamp'].astype(str) != 'Tot summa GWh'))]
         df['timestamp'] = pd.to_datetime(df['timestamp'], dayfirst=True)
+        df.set_index('timestamp', inplace=True)
 
-    df.set_index('timestamp', inplace=True)
     # The timestamp ("Tid" in the original) gives the time without
     # daylight savings time adjustments (normaltid). To convert to UTC,
     # one hour has to be deducted
     df.index = df.index + pd.offsets.Hour(-1)
 
     # Create the MultiIndex
-    tuples = [(tech, 'SE', 'generation', 'Svenska Kraftnaet', url)
-              for tech in df.columns]
-    df.columns = pd.MultiIndex.from_tuples(tuples, names=headers)
+    df = to_values(df)
+    df.columns = column_index(columns, 'Svenska Kraftnaet', url, headers)
 
     return df
 
 
-def read(source_name, variable_name, url, res_key, headers,
-         out_path='original_data', start_from_user=None, end_from_user=None):
+# For each source, the read function, the file format and, for each variable
+# in sources.yml, the data columns of its files. Sources whose columns are
+# only known after reading the file (ENTSO-E: one column per country) list
+# the variables found in them instead, and a function finding the columns
+# without parsing the data.
+READERS = {
+    'OPSD': {
+        'function': read_opsd,
+        'format': 'csv',
+        'columns': {
+            'capacities': [
+                Column('Solar', 'solar', 'DE', 'capacity'),
+                Column('Onshore', 'wind-onshore', 'DE', 'capacity'),
+                Column('Offshore', 'wind-offshore', 'DE', 'capacity')]}},
+    'ENTSO-E Data Portal': {
+        'function': read_entso_e_portal,
+        'find_columns': entso_e_portal_columns,
+        'format': 'excel',
+        'variables': {'load': ['load']}},
+    '50Hertz': {
+        'function': read_hertz,
+        'format': 'csv',
+        'columns': {
+            'wind_generation_pre-offshore': [
+                Column(3, 'wind', 'DE-50hertz', 'generation')],
+            'wind_forecast_pre-offshore': [
+                Column(3, 'wind', 'DE-50hertz', 'forecast')],
+            'wind_generation_with-offshore': [
+                Column(3, 'wind', 'DE-50hertz', 'generation'),
+                Column(4, 'wind-onshore', 'DE-50hertz', 'generation'),
+                Column(5, 'wind-offshore', 'DE-50hertz', 'generation')],
+            'wind_forecast_with-offshore': [
+                Column(3, 'wind', 'DE-50hertz', 'forecast'),
+                Column(4, 'wind-onshore', 'DE-50hertz', 'forecast'),
+                Column(5, 'wind-offshore', 'DE-50hertz', 'forecast')],
+            'solar_generation': [
+                Column(3, 'solar', 'DE-50hertz', 'generation')],
+            'solar_forecast': [
+                Column(3, 'solar', 'DE-50hertz', 'forecast')]}},
+    'Amprion': {
+        'function': read_amprion,
+        'format': 'csv',
+        'columns': {
+            tech: [Column(2, tech, 'DE-amprion', 'forecast'),
+                   Column(3, tech, 'DE-amprion', 'generation')]
+            for tech in ['wind', 'solar']}},
+    'TenneT': {
+        'function': read_tennet,
+        'format': 'csv',
+        'columns': {
+            'wind': [
+                Column(2, 'wind', 'DE-tennet', 'forecast'),
+                Column(3, 'wind', 'DE-tennet', 'generation'),
+                # offshore generation starts 2009-09-20
+                Column(4, 'wind-offshore', 'DE-tennet', 'generation')],
+            'solar': [
+                Column(2, 'solar', 'DE-tennet', 'forecast'),
+                Column(3, 'solar', 'DE-tennet', 'generation')]}},
+    'TransnetBW': {
+        'function': read_transnetbw,
+        'format': 'csv',
+        'columns': {
+            tech: [Column(4, tech, 'DE-transnetbw', 'forecast'),
+                   Column(5, tech, 'DE-transnetbw', 'generation')]
+            for tech in ['wind', 'solar']}},
+    'Svenska Kraftnaet': {
+        'function': read_svenska_kraftnaet,
+        'format': 'excel',
+        'columns': dict(
+            [(name, [Column(3, 'wind', 'SE', 'generation')])
+             for name in ['wind_solar_1', 'wind_solar_2']] +
+            [(name, [Column(2, 'wind', 'SE', 'generation'),
+                     Column(8, 'solar', 'SE', 'generation')])
+             for name in ['wind_solar_3', 'wind_solar_4', 'wind_solar_5',
+                          'wind_solar_6', 'wind_solar_7']])},
+    'Elia': {
+        'function': read_elia,
+        'format': 'excel',
+        'columns': {
+            tech: [Column(2, tech, 'BE', 'forecast'),
+                   Column(4, tech, 'BE', 'generation'),
+                   Column(5, tech, 'BE', 'capacity')]
+            for tech in ['wind-onshore', 'wind-offshore', 'solar']}},
+    'Energinet.dk': {
+        'function': read_energinet_dk,
+        'format': 'excel',
+        'columns': {
+            'prices_wind_solar': [
+                Column('DK-West', 'price', 'DK-west', 'elspot'),
+                Column('DK-East', 'price', 'DK-east', 'elspot'),
+                Column('Norway', 'price', 'NO', 'elspot'),
+                Column('Sweden (SE)', 'price', 'SE', 'elspot'),
+                Column('Sweden (SE3)', 'price', 'SE-3', 'elspot'),
+                Column('Sweden (SE4)', 'price', 'SE-4', 'elspot'),
+                Column('DE European Power Exchange', 'price', 'DE', 'epex'),
+                Column('DK-West: Wind power production',
+                       'wind', 'DK-west', 'generation'),
+                Column('DK-West: Solar cell production (estimated)',
+                       'solar', 'DK-west', 'generation'),
+                Column('DK-East: Wind power production',
+                       'wind', 'DK-east', 'generation'),
+                Column('DK-East: Solar cell production (estimated)',
+                       'solar', 'DK-east', 'generation'),
+                Column('DK: Wind power production (onshore)',
+                       'wind-onshore', 'DK', 'generation'),
+                Column('DK: Wind power production (offshore)',
+                       'wind-offshore', 'DK', 'generation')]}},
+    'CEPS': {
+        'function': read_ceps,
+        'format': 'excel',
+        'columns': {
+            'wind_pv': [
+                Column(1, 'wind-onshore', 'CZ', 'generation'),  # 'WPP [MW]'
+                Column(2, 'solar', 'CZ', 'generation')]}},  # 'PVPP [MW]'
+    'PSE': {
+        'function': read_pse,
+        'format': 'csv',
+        'columns': {
+            'wind': [Column('Sumaryczna generacja źródeł wiatrowych',
+                            'wind', 'PL', 'generation')]}},
+}
+
+
+def select_columns(source_name, variable_name, variables=None):
     """
-    For the sources specified in the sources.yml file, pass each downloaded
-    file to the correct read function.
+    Return the data columns to read from the files of a variable in
+    sources.yml.
 
     Parameters
     ----------
     source_name : str
-        Name of source to read files from
+        Name of source, a key of READERS
+    variable_name : str
+        Indicator for subset of data available together in the same files
+    variables : list of str, default None
+        Only read the columns for these variables (the first level of the
+        column MultiIndex, e.g. 'wind' or 'solar'). None means all.
+
+    Returns
+    ----------
+    columns : list of Column or None
+        The columns to read, an empty list if there are none. None if the
+        read function finds its columns in the file and one of its variables
+        is wanted.
+
+    """
+
+    reader = READERS[source_name]
+    if 'columns' not in reader:
+        found = reader['variables'].get(variable_name, [])
+        if variables is not None and not set(found) & set(variables):
+            return []
+        return None
+
+    return [column for column in reader['columns'].get(variable_name, [])
+            if variables is None or column.variable in variables]
+
+
+def read_file(source_name, variable_name, url, headers, filepath,
+              member=None, file_checksum=None, cache=None, variables=None):
+    """
+    Pass one downloaded file to the correct read function. This is a module
+    level function so that it can be run in a worker process.
+
+    Parameters
+    ----------
+    source_name : str
+        Name of source the file comes from
     variable_name : str
         Indicator for subset of data available together in the same files
     url : str
         URL of the Source to be placed in the column-MultiIndex
-    res_key : str
-        Resolution of the source data. Must be one of ['15min', '60min']
     headers : list
         List of strings indicating the level names of the pandas.MultiIndex
         for the columns of the dataframe
+    filepath : str
+        Path of the file to be read, or of original_data.zip if member is
+        given
+    member : str, default None
+        Name of the file in the archive at filepath
+    file_checksum : str, default None
+        SHA-256 hex digest of the file, if known from the Manifest
+    cache : FrameCache, default None
+        Cache to take the frame from if the file has been parsed before,
+        and to store it in otherwise
+    variables : list of str, default None
+        Only read the columns for these variables, see select_columns()
+
+    Returns
+    ----------
+    data_to_add : pandas.DataFrame
+        The data from the file
+
+    """
+
+    if member is not None:
+        content = open_archive(filepath).read(member)
+        filepath = io.BytesIO(content)
+        if cache is not None and file_checksum is None:
+            file_checksum = hashlib.sha256(content).hexdigest()
+
+    if cache is not None:
+        if file_checksum is None:
+            file_checksum = checksum(filepath)
+        key = cache.key(file_checksum, source_name, PARSER_VERSION,
+                        variable_name, url, headers,
+                        sorted(variables) if variables else None)
+        data_to_add = cache.get(key)
+        if data_to_add is not None:
+            return data_to_add
+
+    reader = READERS[source_name]
+    columns = select_columns(source_name, variable_name, variables)
+    data_to_add = reader['function'](filepath, variable_name, url, headers,
+                                     columns)
+
+    if cache is not None:
+        cache.put(key, data_to_add)
+
+    return data_to_add
+
+
+def read_columns(source_name, variable_name, url, headers, filepath,
+                 member=None):
+    """
+    Return the columns of the data that read_file() would return for a file
+    of a source whose columns are found in the file, without parsing the
+    data. See read_file() for the parameters.
+
+    """
+
+    if member is not None:
+        filepath = io.BytesIO(open_archive(filepath).read(member))
+
+    return READERS[source_name]['find_columns'](filepath, variable_name, url,
+                                                headers)
+
+
+def measured_read_file(source_name, variable_name, url, headers, filepath,
+                       member=None, file_checksum=None, cache=None,
+                       variables=None):
+    """
+    Run read_file() and measure it, see profiling.measure(). Like
+    read_file(), this can be run in a worker process.
+
+    Returns
+    ----------
+    data_to_add : pandas.DataFrame
+        The data from the file
+    record : dict
+        The measurements, with the rows of data_to_add, the bytes of the
+        file and whether it was taken from the cache
+
+    """
+
+    if member is None:
+        name = os.path.basename(filepath)
+        size = os.path.getsize(filepath)
+    else:
+        name = member
+        size = open_archive(filepath).getinfo(member).file_size
+
+    with measure('read', source=source_name, variable=variable_name,
+                 file=name) as record:
+        hits = cache.hits if cache is not None else 0
+        data_to_add = read_file(source_name, variable_name, url, headers,
+                                filepath, member, file_checksum, cache,
+                                variables)
+        record['rows'] = len(data_to_add)
+        record['bytes'] = size
+        record['cached'] = cache is not None and cache.hits > hits
+
+    return data_to_add, record
+
+
+_archives = {}  # open archives of this process, by path
+
+
+def open_archive(path):
+    """
+    Return the zipfile.ZipFile at path, opening it only once per process.
+
+    """
+
+    if path not in _archives:
+        _archives[path] = zipfile.ZipFile(path)
+
+    return _archives[path]
+
+
+def find_files(source_name, variable_name, out_path='original_data',
+               start_from_user=None, end_from_user=None):
+    """
+    Return the downloaded files of a variable whose period overlaps the
+    period chosen by the user.
+
+    Parameters
+    ----------
+    source_name : str
+        Name of source to read files from
+    variable_name : str
+        Indicator for subset of data available together in the same files
     out_path : str, default: 'original_data'
-        Base download directory in which to save all downloaded files
+        Base download directory in which to save all downloaded files, or
+        the path of original_data.zip if it has not been extracted
     start_from_user : datetime.date, default None
         Start of period for which to read the data
     end_from_user : datetime.date, default None
@@ -641,167 +905,213 @@ def read(source_name, variable_name, url, res_key, headers,
 
     Returns
     ----------
-    data_set: pandas.DataFrame
-        A DataFrame containing the combined data for variable_name 
+    files : list of File or None
+        The files to read, sorted by period. None if there are no files for
+        variable_name at all.
 
     """
-    data_set = pd.DataFrame()
 
     variable_dir = os.path.join(out_path, source_name, variable_name)
 
-    logger.info('reading %s - %s', source_name, variable_name)
-
-    files_existing = sum([len(files) for r, d, files in os.walk(variable_dir)])
-    files_success = 0
+    # The files may still be in the archive downloaded from the OPSD server
+    if zipfile.is_zipfile(out_path):
+        entries = sorted(
+            archive_files(open_archive(out_path),
+                          {source_name: [variable_name]}),
+            key=lambda entry: entry['period'])
+    else:
+        entries = []
+        if os.path.exists(variable_dir):
+            entries = open_manifest(out_path).files(source_name, variable_name)
 
     # Check if there are folders for variable_name
-    if not os.path.exists(variable_dir):
+    if not entries:
         logger.warning('folder not found for %s, %s',
                        source_name, variable_name)
-        return data_set
-
-    # For each file downloaded for that variable
-    for container in os.listdir(variable_dir):
-        # Skip this file if period covered excluded by user
-        if start_from_user:
-            # Filecontent is too old
-            if start_from_user > yaml.load(container.split('_')[1]):
-                continue  # go to next container
-
-        if end_from_user:
-            # Filecontent is too recent
-            if end_from_user < yaml.load(container.split('_')[0]):
-                continue  # go to next container
-
-        files = os.listdir(os.path.join(variable_dir, container))
-
-        # Check if there is only one file per folder
-        if len(files) == 0:
-            logger.warning('found no file in %s %s %s',
-                           source_name, variable_name, container)
-            continue
-
-        elif len(files) > 1:
-            logger.warning('found more than one file in %s %s %s',
-                           source_name, variable_name, container)
-            continue
-
-        filepath = os.path.join(variable_dir, container, files[0])
+        return None
+
+    # Skip the files whose period lies outside the period chosen by the user
+    if start_from_user or end_from_user:
+        periods = tuple(entry['period'] for entry in entries)
+        index = period_index(periods)
+        for i in index.unparsed:
+            logger.warning('Cannot tell the period of %s, reading it anyway',
+                           os.path.join(variable_dir, periods[i]))
+        keep = set(index.overlapping(start_from_user or None,
+                                     end_from_user or None))
+        keep.update(index.unparsed)
+        entries = [entry for i, entry in enumerate(entries) if i in keep]
+
+    files = []
+    for entry in entries:
+        container = entry['period']
+        filepath = os.path.join(variable_dir, container, entry['filename'])
 
         # Check if file is not empty
-        if os.path.getsize(filepath) < 128:
+        if entry['size'] < 128:
             logger.warning('%s \n file is smaller than 128 Byte, which means it is probably empty',
                            filepath)
+            continue
+
+        logger.debug('reading data:\n\t '
+                     'Source:   %s\n\t '
+                     'Variable: %s\n\t '
+                     'Filename: %s',
+                     source_name, variable_name, entry['filename'])
+
+        if 'member' in entry:
+            files.append(File(out_path, entry['member'], None, container))
         else:
-            logger.debug('reading data:\n\t '
-                         'Source:   %s\n\t '
-                         'Variable: %s\n\t '
-                         'Filename: %s',
-                         source_name, variable_name, files[0])
-
-            update_progress(files_success, files_existing)
-
-            if source_name == 'OPSD':
-                data_to_add = read_opsd(filepath, url, headers)
-            elif source_name == 'CEPS':
-                data_to_add = read_ceps(filepath, variable_name, url, headers)
-            elif source_name == 'ENTSO-E Data Portal':
-                #save_stdout = sys.stdout
-                #sys.stdout = open('trash', 'w')
-                data_to_add = read_entso_e_portal(filepath, url, headers)
-                #sys.stdout = save_stdout
-            elif source_name == 'Energinet.dk':
-                data_to_add = read_energinet_dk(filepath, url, headers)
-            elif source_name == 'Elia':
-                data_to_add = read_elia(filepath, variable_name, url, headers)
-            elif source_name == 'PSE':
-                data_to_add = read_pse(filepath, variable_name, url, headers)
-            elif source_name == 'RTE':
-                data_to_add = read_rte(filepath, variable_name, url, headers)
-            elif source_name == 'Svenska Kraftnaet':
-                data_to_add = read_svenska_kraftnaet(
-                    filepath, variable_name, url, headers)
-            elif source_name == '50Hertz':
-                data_to_add = read_hertz(filepath, variable_name, url, headers)
-            elif source_name == 'Amprion':
-                data_to_add = read_amprion(
-                    filepath, variable_name, url, headers)
-            elif source_name == 'TenneT':
-                data_to_add = read_tennet(
-                    filepath, variable_name, url, headers)
-            elif source_name == 'TransnetBW':
-                data_to_add = read_transnetbw(
-                    filepath, variable_name, url, headers)
-
-            if data_set.empty:
-                data_set = data_to_add
-            else:
-                data_set = data_set.combine_first(data_to_add)
-
-            files_success += 1
-            update_progress(files_success, files_existing)
+            files.append(File(filepath, None, entry['checksum'], container))
 
-    if data_set.empty:
-        logger.warning('returned empty DataFrame for %s, %s',
-                       source_name, variable_name)
-        return data_set
+    return files
 
-    # Reindex with a new index that is sure to be continous in order to later
-    # expose gaps in the data.
-    no_gaps = pd.DatetimeIndex(start=data_set.index[0],
-                               end=data_set.index[-1],
-                               freq=res_key)
-    data_set = data_set.reindex(index=no_gaps)
 
-    # Cut off the data outside of [start_from_user:end_from_user]
-    # First, convert userinout to UTC time
+def user_bounds(res_key, start_from_user=None, end_from_user=None):
+    """
+    Return the first and the last timestamp (naive UTC) of the period chosen
+    by the user, i.e. from the start of start_from_user to the end of
+    end_from_user in Central European (Summer-)Time. None where the user
+    chose no limit.
+
+    """
+
+    # Convert userinput to UTC time
     if start_from_user:
         start_from_user = (
             pytz.timezone('Europe/Brussels')
             .localize(datetime.combine(start_from_user, time()))
-            .astimezone(pytz.timezone('UTC')))
+            .astimezone(pytz.timezone('UTC'))
+            .replace(tzinfo=None))
 
     if end_from_user:
         end_from_user = (
             pytz.timezone('Europe/Brussels')
             .localize(datetime.combine(end_from_user, time()))
-            .astimezone(pytz.timezone('UTC'))) - timedelta(minutes=int(res_key[:2]))
+            .astimezone(pytz.timezone('UTC'))
+            .replace(tzinfo=None)) - timedelta(minutes=int(res_key[:2]))
 
-    # Then cut off the data_set
-    data_set = data_set.loc[start_from_user:end_from_user, :]
-
-    return data_set
+    return start_from_user or None, end_from_user or None
 
 
-def update_progress(count, total):
-    '''
-    Display or updates a console progress bar.
+def read(source_name, variable_name, url, res_key, headers,
+         out_path='original_data', start_from_user=None, end_from_user=None,
+         workers=1, executor=None, cache_path=None, variables=None):
+    """
+    For the sources specified in the sources.yml file, pass each downloaded
+    file to the correct read function.
 
     Parameters
     ----------
-    count : int
-        number of files that have been read so far
-    total : int
-        total number aif files
+    source_name : str
+        Name of source to read files from
+    variable_name : str
+        Indicator for subset of data available together in the same files
+    url : str
+        URL of the Source to be placed in the column-MultiIndex
+    res_key : str
+        Resolution of the source data. Must be one of ['15min', '60min']
+    headers : list
+        List of strings indicating the level names of the pandas.MultiIndex
+        for the columns of the dataframe
+    out_path : str, default: 'original_data'
+        Base download directory in which to save all downloaded files, or
+        the path of original_data.zip if it has not been extracted
+    start_from_user : datetime.date, default None
+        Start of period for which to read the data
+    end_from_user : datetime.date, default None
+        End of period for which to read the data
+    workers : int, default 1
+        Number of processes to parse the files in. With 1, the files are
+        parsed one after another in this process.
+    executor : concurrent.futures.ProcessPoolExecutor, default None
+        Pool to parse the files in instead of starting one for this call,
+        e.g. to share it between all variables. Overrides workers.
+    cache_path : str, default None
+        Directory to keep the parsed frames in, so that only new or changed
+        files are parsed. See cache.FrameCache. None means no cache.
+    variables : list of str, default None
+        Only read the columns for these variables (the first level of the
+        column MultiIndex, e.g. ['wind', 'solar']). Files without any of
+        them are not read at all. None means all columns.
 
     Returns
     ----------
-    None
-
-    '''
-
-    barLength = 50  # Modify this to change the length of the progress bar
-    status = ""
-    progress = count / total
-    if isinstance(progress, int):
-        progress = float(progress)
-    if progress >= 1:
-        progress = 1
-        status = "Done...\r\n"
-    block = int(round(barLength * progress))
-    text = "\rProgress: [{0}] {1}/{2} files {3}".format(
-        "#" * block + "-" * (barLength - block), count, total, status)
-    sys.stdout.write(text)
-    sys.stdout.flush()
-
-    return
+    data_set: pandas.DataFrame
+        A DataFrame containing the combined data for variable_name 
+
+    """
+    data_set = pd.DataFrame()
+
+    logger.info('reading %s - %s', source_name, variable_name)
+
+    if source_name not in READERS:
+        logger.warning('no read function for %s', source_name)
+        return data_set
+
+    if select_columns(source_name, variable_name, variables) == []:
+        logger.info('no columns of %s to read for %s, %s',
+                    variables, source_name, variable_name)
+        return data_set
+
+    files = find_files(source_name, variable_name, out_path,
+                       start_from_user, end_from_user)
+    if files is None:
+        return data_set
+
+    files_existing = len(files)
+    cache = FrameCache(cache_path) if cache_path else None
+
+    own_executor = None
+    if executor is None and workers > 1 and files_existing > 1:
+        executor = own_executor = ProcessPoolExecutor(max_workers=workers)
+
+    args = [[source_name] * files_existing,
+            [variable_name] * files_existing,
+            [url] * files_existing,
+            [headers] * files_existing,
+            [file.path for file in files],
+            [file.member for file in files],
+            [file.checksum for file in files],
+            [cache] * files_existing,
+            [variables] * files_existing]
+    try:
+        if executor is None:
+            frames = map(measured_read_file, *args)
+        else:
+            # map() returns the frames in the order of the files, so the
+            # result does not depend on which process finishes first
+            frames = executor.map(measured_read_file, *args)
+
+        frames_read = []
+        for files_success, (data_to_add, record) in enumerate(frames, 1):
+            frames_read.append(data_to_add)
+            report.add(record)
+            logger.debug('read %s of %s files: %s',
+                         files_success, files_existing, record['file'])
+    finally:
+        if own_executor is not None:
+            own_executor.shutdown()
+        if cache is not None:
+            cache.evict()
+
+    # Where files overlap, the data from the earlier file is kept
+    data_set = merge(frames_read)
+
+    if data_set.empty:
+        logger.warning('returned empty DataFrame for %s, %s',
+                       source_name, variable_name)
+        return data_set
+
+    # Reindex with a new index that is sure to be continous in order to later
+    # expose gaps in the data.
+    no_gaps = pd.date_range(start=data_set.index[0],
+                            end=data_set.index[-1],
+                            freq=res_key)
+    data_set = data_set.reindex(index=no_gaps)
+
+    # Cut off the data outside of [start_from_user:end_from_user]
+    first, last = user_bounds(res_key, start_from_user, end_from_user)
+    data_set = data_set.loc[first:last, :]
+
+    return data_set
@@ -0,0 +1,234 @@
+"""
+Open Power System Data
+
+Timeseries Datapackage
+
+scheduler.py : pace, limit and retry the requests to the source servers
+
+"""
+
+from contextlib import contextmanager
+import logging
+import random
+import threading
+import time
+from urllib.parse import urlparse
+
+import requests
+
+logger = logging.getLogger('log')
+
+# Responses that are worth another attempt after a pause
+RETRY_STATUS = [429, 500, 502, 503, 504]
+
+
+class Scheduler(object):
+    """
+    Send the requests to each server no faster and with no more simultaneous
+    requests than the server allows. Failed requests are repeated after
+    exponentially growing, randomized pauses, so a failing server only
+    delays the downloads from itself.
+
+    Parameters
+    ----------
+    max_connections : int, default 2
+        Maximum number of simultaneous requests to a server not configured
+        otherwise.
+    rate : float, default None
+        Maximum number of requests per second to a server not configured
+        otherwise. None means no limit.
+    retries : int, default 3
+        Number of times a failed request is repeated.
+    backoff : float, default 1.0
+        Base of the pause in seconds before a repeated request. The pause
+        before the n-th repetition is drawn from [0, backoff * 2 ** n].
+    timeout : float or tuple, default (10, 120)
+        Seconds to wait for the server to connect and to send data, as
+        accepted by requests.
+
+    """
+
+    def __init__(self, max_connections=2, rate=None, retries=3, backoff=1.0,
+                 timeout=(10, 120)):
+        self.max_connections = max_connections
+        self.rate = rate
+        self.retries = retries
+        self.backoff = backoff
+        self.timeout = timeout
+        self._hosts = {}
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_sources(cls, sources, **kwargs):
+        """
+        Create a Scheduler with the limits declared in sources.yml. Each
+        variable may declare ``max_connections`` and ``requests_per_second``
+        for the server in its url_template. If variables on the same server
+        declare different limits, the strictest one applies.
+
+        Parameters
+        ----------
+        sources : dict
+            Dict of download parameters specific to each source.
+        **kwargs
+            Passed on to Scheduler() as defaults for all other servers.
+
+        """
+
+        scheduler = cls(**kwargs)
+        for source_dict in sources.values():
+            for param_dict in source_dict.values():
+                if not param_dict.get('url_template'):
+                    continue
+                scheduler.configure(
+                    param_dict['url_template'],
+                    max_connections=param_dict.get('max_connections'),
+                    rate=param_dict.get('requests_per_second'))
+
+        return scheduler
+
+    def configure(self, url, max_connections=None, rate=None):
+        """Set the limits for the server of url, keeping stricter ones."""
+        host = self._host(url)
+        if max_connections is not None:
+            host['max_connections'] = min(host['max_connections'],
+                                          max_connections)
+            host['semaphore'] = threading.BoundedSemaphore(
+                host['max_connections'])
+        if rate is not None:
+            host['rate'] = rate if host['rate'] is None else min(host['rate'],
+                                                                 rate)
+
+        return
+
+    def connections(self, url):
+        """Return the maximum number of simultaneous requests to url."""
+        return self._host(url)['max_connections']
+
+    def _host(self, url):
+        """Return the state kept for the server of url."""
+        netloc = urlparse(url).netloc
+        with self._lock:
+            if netloc not in self._hosts:
+                self._hosts[netloc] = {
+                    'max_connections': self.max_connections,
+                    'rate': self.rate,
+                    'semaphore': threading.BoundedSemaphore(
+                        self.max_connections),
+                    'next_request': 0,
+                    'lock': threading.Lock()}
+
+            return self._hosts[netloc]
+
+    @contextmanager
+    def slot(self, url):
+        """
+        Wait until a request may be sent to the server of url and keep
+        others from using the slot until the block is left.
+
+        """
+
+        host = self._acquire(url)
+        try:
+            yield
+        finally:
+            host['semaphore'].release()
+
+    def _acquire(self, url):
+        """
+        Wait until a request may be sent to the server of url and take a
+        slot. Returns the state of the server, whose semaphore must be
+        released when the request is done.
+
+        """
+
+        host = self._host(url)
+        host['semaphore'].acquire()
+        if host['rate']:
+            with host['lock']:
+                now = time.time()
+                wait = host['next_request'] - now
+                host['next_request'] = (max(now, host['next_request']) +
+                                        1 / host['rate'])
+            if wait > 0:
+                time.sleep(wait)
+
+        return host
+
+    @staticmethod
+    def _release_on_close(resp, host):
+        """Keep the slot of a streamed response until it is closed."""
+        close = resp.close
+        released = threading.Event()
+
+        def close_and_release():
+            try:
+                close()
+            finally:
+                if not released.is_set():
+                    released.set()
+                    host['semaphore'].release()
+
+        resp.close = close_and_release
+
+        return
+
+    def get(self, session, url, **kwargs):
+        """
+        Send a GET request for url with session, repeating it if it fails.
+
+        Parameters
+        ----------
+        session : requests.session
+            Session to send the request with.
+        url : str
+            URL to request.
+        **kwargs
+            Passed on to session.get(), e.g. params, headers or stream.
+
+        Returns
+        ----------
+        resp : requests.Response
+            The response of the last attempt. If stream is True, it keeps
+            its slot of the server's connections until it is closed, so it
+            must be closed once the body is read.
+
+        """
+
+        kwargs.setdefault('timeout', self.timeout)
+        attempt = 0
+        while True:
+            retry_after = 0
+            host = self._acquire(url)
+            try:
+                resp = session.get(url, **kwargs)
+            except (requests.exceptions.ConnectionError,
+                    requests.exceptions.Timeout) as e:
+                host['semaphore'].release()
+                if attempt >= self.retries:
+                    raise
+                logger.debug('Request to %s failed: %s', url, e)
+            except BaseException:
+                host['semaphore'].release()
+                raise
+            else:
+                if kwargs.get('stream'):
+                    self._release_on_close(resp, host)
+                else:
+                    host['semaphore'].release()
+                if (resp.status_code not in RETRY_STATUS or
+                        attempt >= self.retries):
+                    return resp
+                logger.debug('Request to %s returned %s', url,
+                             resp.status_code)
+                # The server may tell how long to wait (in seconds)
+                if resp.headers.get('retry-after', '').isdigit():
+                    retry_after = int(resp.headers['retry-after'])
+                resp.close()
+
+            pause = max(retry_after,
+                        random.uniform(0, self.backoff * 2 ** attempt))
+            attempt += 1
+            logger.info('Retrying %s in %.1f s (attempt %s of %s)',
+                        url, pause, attempt, self.retries)
+            time.sleep(pause)
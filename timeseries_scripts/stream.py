@@ -0,0 +1,435 @@
+"""
+Open Power System Data
+
+Timeseries Datapackage
+
+stream.py : read, merge, patch and export the data sets in chunks of one
+month, so that only a few months are held in memory at a time
+
+"""
+
+from datetime import timedelta
+import heapq
+import logging
+
+import numpy as np
+import pandas as pd
+from pandas.tseries.frequencies import to_offset
+
+from .cache import FrameCache
+from .imputation import GAP_DTYPE, gap_table
+from .markers import marker_strings
+from .merge import merge
+from .periods import parse_period
+from .profiling import report
+from .read import (READERS, find_files, measured_read_file, read_columns,
+                   select_columns, user_bounds)
+
+logger = logging.getLogger('log')
+
+
+class ChunkReader(object):
+    """
+    Read the files of one variable like read() does, but return the data
+    as a sequence of chunks, one per calendar month (UTC) by default.
+
+    A file is parsed when the first chunk that may contain its data is
+    due, and dropped from memory once its period has passed, so that only
+    the files overlapping the current month are held at a time. Joined
+    together, the chunks equal the DataFrame returned by read().
+
+    This bounds the memory only for files of regular periods (e.g. monthly
+    or yearly). A file holding all data of a variable (frequency
+    'complete' in sources.yml, e.g. Amprion and CEPS) is held in memory
+    from the first chunk to the last.
+
+    The columns of the chunks are known before the first one is read: For
+    read functions with declared columns, they are taken from the first
+    file, which is kept to become the first chunk. For read functions that
+    find the columns in the file (ENTSO-E), only the columns of each file
+    are looked up, see read.read_columns().
+
+    Parameters
+    ----------
+    source_name, variable_name, url, res_key, headers, out_path,
+    start_from_user, end_from_user, cache_path, variables
+        As for read()
+    freq : str, default 'MS'
+        Length of the chunks as a pandas frequency, e.g. 'MS' for calendar
+        months or 'AS' for years.
+
+    Attributes
+    ----------
+    columns : pandas.MultiIndex
+        The columns of all chunks. None if there is no data to read.
+
+    """
+
+    def __init__(self, source_name, variable_name, url, res_key, headers,
+                 out_path='original_data', start_from_user=None,
+                 end_from_user=None, cache_path=None, variables=None,
+                 freq='MS'):
+        self.source_name = source_name
+        self.variable_name = variable_name
+        self.url = url
+        self.res_key = res_key
+        self.headers = headers
+        self.freq = freq
+        self.variables = variables
+        self.cache = FrameCache(cache_path) if cache_path else None
+        self.bounds = user_bounds(res_key, start_from_user, end_from_user)
+
+        self.files = []
+        if source_name not in READERS:
+            logger.warning('no read function for %s', source_name)
+        elif select_columns(source_name, variable_name, variables) != []:
+            self.files = find_files(source_name, variable_name, out_path,
+                                    start_from_user, end_from_user) or []
+
+        self.columns = None
+        self._parsed = {}  # frames parsed for the columns, by position
+        for position, file in enumerate(self.files):
+            if 'columns' in READERS[source_name]:
+                frame = self._read(file)
+                self._parsed[position] = frame
+                if len(frame.columns):
+                    self.columns = frame.columns
+                    break
+                continue
+            columns = read_columns(source_name, variable_name, url, headers,
+                                   file.path, file.member)
+            if len(columns):
+                self.columns = (columns if self.columns is None
+                                else self.columns.union(columns))
+
+    def _read(self, file):
+        data_to_add, record = measured_read_file(
+            self.source_name, self.variable_name, self.url, self.headers,
+            file.path, file.member, file.checksum, self.cache, self.variables)
+        report.add(record)
+        return data_to_add
+
+    def __iter__(self):
+        """
+        Yield the chunks as (window, chunk), window being the first
+        timestamp of the month. Months without data are skipped.
+
+        """
+
+        if not self.files:
+            return
+
+        period = pd.Timedelta(self.res_key)
+        # The local days of the periods start and end up to a day off UTC
+        day = timedelta(days=1)
+        periods = [parse_period(file.period) for file in self.files]
+        first_day = pd.Timestamp(min(start for start, end in periods) - day)
+        last_day = pd.Timestamp(max(end for start, end in periods) + 2 * day)
+        offset = to_offset(self.freq)
+        windows = pd.date_range(offset.rollback(first_day),
+                                last_day + offset, freq=offset)
+
+        frames = []  # files read, with the last day of their period
+        position = 0  # of the next file to read
+        started = False  # whether there was data in a previous month
+        for start, end in zip(windows[:-1], windows[1:]):
+            while (position < len(self.files) and
+                   pd.Timestamp(periods[position][0] - day) < end):
+                frame = self._parsed.pop(position, None)
+                if frame is None:
+                    frame = self._read(self.files[position])
+                frames.append((periods[position][1], frame))
+                position += 1
+
+            # Where files overlap, the data from the earlier file is kept
+            chunk = merge([frame[(frame.index >= start) & (frame.index < end)]
+                           for period_end, frame in frames])
+
+            frames = [(period_end, frame) for period_end, frame in frames
+                      if pd.Timestamp(period_end + 2 * day) > end]
+            more = position < len(self.files) or any(
+                len(frame) and frame.index[-1] >= end
+                for period_end, frame in frames)
+
+            if chunk.empty and not (started and more):
+                continue
+
+            # Continuous index, to later expose gaps in the data: From the
+            # first row of the data to the last, as in read()
+            index = pd.date_range(
+                start if started else chunk.index[0],
+                end - period if more or chunk.empty else chunk.index[-1],
+                freq=self.res_key)
+            chunk = chunk.reindex(index=index, columns=self.columns)
+            started = True
+
+            # Cut off the data outside of [start_from_user:end_from_user]
+            chunk = chunk.loc[self.bounds[0]:self.bounds[1], :]
+            if len(chunk):
+                yield start, chunk
+
+        if self.cache is not None:
+            self.cache.evict()
+
+
+def merge_chunks(readers):
+    """
+    Combine the chunks of several variables of the same resolution month by
+    month, as merge() combines the frames returned by read().
+
+    Parameters
+    ----------
+    readers : list of ChunkReader
+        The variables to combine, in order of precedence
+
+    Yields
+    ----------
+    chunk : pandas.DataFrame
+        The data of all variables for one month, with the columns of all
+        variables
+
+    """
+
+    columns = None
+    for reader in readers:
+        if reader.columns is not None:
+            columns = (reader.columns if columns is None
+                       else columns.union(reader.columns))
+
+    # Each reader yields its months in order, so the chunks of the same
+    # month come together. The number of the reader is the tie breaker.
+    chunks = heapq.merge(*[_numbered(reader, i)
+                           for i, reader in enumerate(readers)],
+                         key=lambda item: item[:2])
+
+    window = None
+    parts = []
+    for chunk_window, i, chunk in chunks:
+        if chunk_window != window and parts:
+            yield merge(parts).reindex(columns=columns)
+            parts = []
+        window = chunk_window
+        parts.append(chunk)
+    if parts:
+        yield merge(parts).reindex(columns=columns)
+
+
+def _numbered(reader, i):
+    for window, chunk in reader:
+        yield window, i, chunk
+
+
+class GapPatcher(object):
+    """
+    Find the regions of missing values in a sequence of chunks and
+    interpolate the short ones, with the same results as find_nan() on the
+    joined chunks, except that long regions in German generation data are
+    not guessed based on other TSOs (see imputation.impute_gaps()).
+
+    A region is only complete once the next value is known, so the rows
+    from the start of a region that may still be interpolated (one not
+    longer than max_span so far) are held back until it is complete. All
+    rows before are returned right away.
+
+    Parameters
+    ----------
+    headers : list
+        List of strings indicating the level names of the pandas.MultiIndex
+        for the columns of the chunks
+    res_key : str
+        Resolution of the chunks, e.g. '15min'
+    patch : bool, default True
+        If True, interpolate the regions up to max_span and mark them in the
+        marker column appended to the rows returned. If False, the rows
+        are returned unaltered, with an empty marker column.
+    max_span : datetime.timedelta, default 2 hours
+        Longest region to interpolate
+
+    """
+
+    def __init__(self, headers, res_key, patch=True,
+                 max_span=timedelta(hours=2)):
+        self.headers = headers
+        self.one_period = pd.Timedelta(res_key)
+        self.patch = patch
+        self.max_span = max_span
+        self.columns = None
+        self.regions = []  # (column position, start, till, count, span)
+        self._index = None  # of the rows held back
+
+    def _start(self, chunk):
+        self.columns = chunk.columns
+        n = len(self.columns)
+        self._seen = np.zeros(n, dtype=bool)  # any value so far
+        self._last_value = np.full(n, np.nan)  # the last value so far
+        self._open = [None] * n  # start of the region not yet complete
+        # The rows held back, and which values in them are interpolated
+        self._index = chunk.index[:0]
+        self._values = np.empty((0, n))
+        self._marks = np.zeros((0, n), dtype=bool)
+        self._labels = ['_'.join(col[0:3]) + '; ' for col in self.columns]
+
+    def add(self, chunk):
+        """
+        Add the next chunk. Returns the rows that are complete now, patched
+        and with the marker column appended.
+
+        """
+
+        if chunk.empty:
+            return self._emit(0)
+        if self.columns is None:
+            self._start(chunk)
+
+        values = chunk.values.astype(float)
+        times = chunk.index
+        self._index = self._index.append(times)
+        self._values = np.vstack([self._values, values])
+        self._marks = np.vstack([self._marks,
+                                 np.zeros(chunk.shape, dtype=bool)])
+
+        for c in range(len(self.columns)):
+            valid = np.flatnonzero(~np.isnan(values[:, c]))
+            if len(valid) == 0:
+                if self._seen[c] and self._open[c] is None:
+                    self._open[c] = times[0]
+                continue
+
+            # Regions as (start, value before, till, value after)
+            regions = []
+            if self._open[c] is not None:
+                regions.append((self._open[c], self._last_value[c],
+                                times[valid[0] - 1] if valid[0] > 0
+                                else times[0] - self.one_period,
+                                values[valid[0], c]))
+            elif self._seen[c] and valid[0] > 0:
+                regions.append((times[0], self._last_value[c],
+                                times[valid[0] - 1], values[valid[0], c]))
+            for g in np.flatnonzero(np.diff(valid) > 1):
+                regions.append((times[valid[g] + 1], values[valid[g], c],
+                                times[valid[g + 1] - 1],
+                                values[valid[g + 1], c]))
+
+            for start, before, till, after in regions:
+                self._fill(c, start, before, till, after)
+
+            self._seen[c] = True
+            self._last_value[c] = values[valid[-1], c]
+            self._open[c] = (times[valid[-1] + 1]
+                             if valid[-1] < len(times) - 1 else None)
+
+        # Hold back the rows from the start of the first region that may
+        # still be interpolated
+        hold = len(self._index)
+        for start in self._open:
+            if start is None:
+                continue
+            if self.patch and times[-1] - start < self.max_span:
+                hold = min(hold, self._index.searchsorted(start))
+
+        return self._emit(hold)
+
+    def _fill(self, c, start, before, till, after):
+        """Record one region of column c and interpolate it if short."""
+        count = (till - start) // self.one_period + 1
+        span = count * self.one_period
+        self.regions.append((c, start, till, count, span))
+        if not self.patch or span > self.max_span:
+            return
+
+        first = self._index.searchsorted(start)
+        steps = np.arange(1, count + 1) / (count + 1)
+        self._values[first:first + count, c] = (
+            before + (after - before) * steps)
+        self._marks[first:first + count, c] = True
+
+    def _emit(self, stop):
+        """Return the first stop rows held back."""
+        if self._index is None:
+            return pd.DataFrame()
+
+        rows = pd.DataFrame(self._values[:stop], index=self._index[:stop],
+                            columns=self.columns)
+        marks = self._marks[:stop]
+        self._index = self._index[stop:]
+        self._values = self._values[stop:]
+        self._marks = self._marks[stop:]
+
+        markers = marker_strings(marks, self._labels)
+        markers[markers == ''] = np.nan
+        rows[('comment',) + ('',) * (len(self.headers) - 1)] = markers
+
+        return rows
+
+    def finish(self):
+        """
+        Return the rows still held back. Missing values after the last value
+        of a column are no region, as in find_nan().
+
+        """
+
+        return self._emit(len(self._index) if self._index is not None
+                          else 0)
+
+    def nan_table(self):
+        """
+        Return the regions found so far in the form of the nan_table
+        returned by find_nan(): For each column, the start_idx, till_idx,
+        span and count of each region, the longest first.
+
+        """
+
+        if self.columns is None:
+            return pd.DataFrame()
+
+        gaps = np.array([region[:4] for region in self.regions],
+                        dtype=GAP_DTYPE)
+
+        return gap_table(gaps, self.columns, self.one_period)
+
+
+def patch_chunks(chunks, patcher):
+    """
+    Pass each chunk through patcher (a GapPatcher) and yield the rows
+    returned, including those still held back after the last chunk.
+
+    """
+
+    for chunk in chunks:
+        rows = patcher.add(chunk)
+        if len(rows):
+            yield rows
+    rows = patcher.finish()
+    if len(rows):
+        yield rows
+
+
+def write_csv(chunks, path, **kwargs):
+    """
+    Write a sequence of chunks to one CSV file, the column headers only
+    once. Returns the number of rows written.
+
+    Parameters
+    ----------
+    chunks : iterable of pandas.DataFrame
+        The chunks, all with the same columns
+    path : str
+        Path of the CSV file
+    **kwargs
+        Passed on to pandas.DataFrame.to_csv(), e.g. float_format
+
+    """
+
+    rows = 0
+    with open(path, 'w') as f:
+        for chunk in chunks:
+            # Only the writing is measured, the chunks are read and patched
+            # on the way and measured there
+            with report.measure('export', step='csv', file=path) as record:
+                written = f.tell()
+                chunk.to_csv(f, header=rows == 0, **kwargs)
+                record['rows'] = len(chunk)
+                record['bytes'] = f.tell() - written
+            rows += len(chunk)
+
+    return rows
@@ -0,0 +1,113 @@
+"""
+Open Power System Data
+
+Timeseries Datapackage
+
+timestamps.py : build the datetime index of the files read from date, hour,
+time-of-day and position columns
+
+"""
+
+import logging
+
+import numpy as np
+import pandas as pd
+
+logger = logging.getLogger('log')
+
+MINUTE = np.timedelta64(60 * 10 ** 9, 'ns')
+
+
+def parse_dates(dates, **kwargs):
+    """
+    Parse a column of dates, each distinct value only once. Files have up to
+    96 rows per date, so this is much faster than parsing every row.
+
+    Parameters
+    ----------
+    dates : array-like
+        Dates as str, int (e.g. 20160101) or datetime. Missing values
+        result in NaT.
+    **kwargs
+        Passed on to pandas.to_datetime(), e.g. dayfirst or format.
+
+    Returns
+    ----------
+    days : numpy.ndarray of datetime64[ns]
+        The parsed date of each row.
+
+    """
+
+    codes, uniques = pd.factorize(np.asarray(dates))
+    if len(uniques) and uniques.dtype.kind in 'iu':
+        uniques = uniques.astype(str)
+    days = pd.DatetimeIndex(pd.to_datetime(uniques, **kwargs)).values
+    # Missing dates have code -1 and get the NaT appended last
+    days = np.append(days.astype('datetime64[ns]'), np.datetime64('NaT', 'ns'))
+
+    return days[codes]
+
+
+def parse_times(times):
+    """
+    Return the minutes since midnight of each time of day in times, given
+    as 'HH:MM', 'H:MM', 'HH:MM:SS' or starting like that (e.g.
+    '00:00 - 00:15'). Each distinct value is parsed only once.
+
+    """
+
+    codes, uniques = pd.factorize(np.asarray(times))
+    minutes = np.empty(len(uniques) + 1, dtype='int64')
+    for i, time in enumerate(uniques):
+        hour, minute = str(time).strip()[:5].split(':')[:2]
+        minutes[i] = int(hour) * 60 + int(minute)
+    minutes[-1] = 0  # missing times, their date is NaT anyway
+
+    return minutes[codes]
+
+
+def combine(days, hours=0, minutes=0):
+    """
+    Add hours and minutes to each day.
+
+    Parameters
+    ----------
+    days : array-like of datetime64
+        Dates of the rows, e.g. from parse_dates()
+    hours : int or array-like of int, default 0
+        Hours since midnight
+    minutes : int or array-like of int, default 0
+        Minutes since the hour (or since midnight if hours is 0)
+
+    Returns
+    ----------
+    index : pandas.DatetimeIndex
+        The timestamps, named 'timestamp'
+
+    """
+
+    offset = (np.asarray(hours, dtype='int64') * 60 +
+              np.asarray(minutes, dtype='int64'))
+    values = np.asarray(days, dtype='datetime64[ns]') + offset * MINUTE
+
+    return pd.DatetimeIndex(values, name='timestamp')
+
+
+def from_positions(days, positions, minutes=15):
+    """
+    Return the timestamps of periods numbered from 1 at midnight, e.g. the
+    quarter-hours 1 to 96 of each day.
+
+    Parameters
+    ----------
+    days : array-like of datetime64
+        Dates of the rows, e.g. from parse_dates()
+    positions : array-like of int
+        Number of the period within its day, starting with 1
+    minutes : int, default 15
+        Length of a period in minutes
+
+    """
+
+    return combine(days, minutes=(np.asarray(positions, dtype='int64') - 1) *
+                   minutes)
@@ -0,0 +1,206 @@
+"""
+Open Power System Data
+
+Timeseries Datapackage
+
+timezones.py : convert the local time indexes of the files read to UTC
+
+"""
+
+from functools import lru_cache
+import logging
+
+import numpy as np
+import pandas as pd
+import pytz
+
+logger = logging.getLogger('log')
+
+NAT = np.iinfo(np.int64).min  # integer value of NaT
+
+
+@lru_cache(maxsize=None)
+def offset_table(tz_name):
+    """
+    Return the UTC offsets of tz_name, computed once per process.
+
+    Returns
+    ----------
+    transitions : numpy.ndarray of int64
+        UTC times in ns at which the offset changes
+    offsets : numpy.ndarray of int64
+        Offset in ns before the first transition, and after each of them
+
+    """
+
+    tz = pytz.timezone(tz_name)
+    if not hasattr(tz, '_utc_transition_times'):
+        offset = int(tz.utcoffset(None).total_seconds()) * 10 ** 9
+        return np.array([], dtype='int64'), np.array([offset], dtype='int64')
+
+    # The first transition is datetime(1, 1, 1), out of range for numpy
+    transitions = np.array([np.datetime64(d, 'ns')
+                            for d in tz._utc_transition_times[1:]])
+    offsets = np.array([int(info[0].total_seconds()) * 10 ** 9
+                        for info in tz._transition_info], dtype='int64')
+
+    return transitions.view('int64'), offsets
+
+
+@lru_cache(maxsize=None)
+def dst_transitions(tz_name, month=None):
+    """
+    Return the days since 2000 on which the offset of tz_name changes, as
+    naive datetimes at 2:00, e.g. to find the skipped hour in spring.
+
+    Parameters
+    ----------
+    tz_name : str
+        Name of the timezone, e.g. 'Europe/Berlin'
+    month : int, default None
+        Only return the transitions in this month, e.g. 3 for spring.
+
+    """
+
+    return [d.replace(hour=2)
+            for d in pytz.timezone(tz_name)._utc_transition_times
+            if d.year >= 2000 and (month is None or d.month == month)]
+
+
+def hours_per_day(days, tz_name):
+    """
+    Return the number of hours of each day in tz_name: 23 on the day
+    summertime starts, 25 on the day it ends and 24 otherwise.
+
+    Parameters
+    ----------
+    days : array-like of datetime64
+        Dates, at midnight
+    tz_name : str
+        Name of the timezone, e.g. 'Europe/Berlin'
+
+    Returns
+    ----------
+    hours : numpy.ndarray of int64
+
+    """
+
+    days = pd.DatetimeIndex(np.asarray(days, dtype='datetime64[ns]'))
+    start = to_utc(days, tz_name).values
+    end = to_utc(days + pd.Timedelta(days=1), tz_name).values
+
+    return (end - start) // np.timedelta64(1, 'h')
+
+
+def to_utc(index, tz_name, ambiguous='infer', nonexistent='raise'):
+    """
+    Convert a naive index of local times to naive UTC, like
+    ``index.tz_localize(tz_name, ambiguous=ambiguous).tz_convert(None)``.
+    The offsets are looked up in the cached table of tz_name.
+
+    Parameters
+    ----------
+    index : pandas.DatetimeIndex
+        Naive local times
+    tz_name : str
+        Name of the timezone of index, e.g. 'Europe/Berlin'
+    ambiguous : str or array-like of bool, default 'infer'
+        How to convert the times of the hour repeated when summertime ends:
+
+        - 'infer': as summertime up to where the times start over, as
+          wintertime from there (as pandas does). Raises
+          pytz.AmbiguousTimeError if the times do not repeat.
+        - 'summer' or 'winter': all as summertime or wintertime, for files
+          that only contain one of the two hours.
+        - 'drop': convert to NaT.
+        - 'raise': raise pytz.AmbiguousTimeError.
+        - array of bool: as summertime where True, like pandas' dst array.
+    nonexistent : str, default 'raise'
+        How to convert times in the hour skipped when summertime starts:
+        'raise' raises pytz.NonExistentTimeError, 'drop' converts to NaT.
+
+    Returns
+    ----------
+    utc : pandas.DatetimeIndex
+        Naive UTC times, with the name of index
+
+    """
+
+    local = np.asarray(index.values, dtype='datetime64[ns]').view('int64')
+    isnat = local == NAT
+    transitions, offsets = offset_table(tz_name)
+
+    # A local time belongs to every offset for which it maps to a UTC time
+    # with that same offset. That is one offset for regular times, two in
+    # the repeated and none in the skipped hour.
+    candidates = np.unique(offsets)
+    valid = np.empty((len(candidates), len(local)), dtype=bool)
+    for k, offset in enumerate(candidates):
+        pos = np.searchsorted(transitions, local - offset, side='right')
+        valid[k] = offsets[pos] == offset
+    valid[:, isnat] = False
+    count = valid.sum(axis=0)
+
+    # The largest valid offset is summertime, the smallest wintertime
+    summer = candidates[len(candidates) - 1 - np.argmax(valid[::-1], axis=0)]
+    winter = candidates[np.argmax(valid, axis=0)]
+    use_summer = np.ones(len(local), dtype=bool)
+
+    is_ambiguous = count > 1
+    if is_ambiguous.any():
+        if isinstance(ambiguous, str):
+            if ambiguous == 'infer':
+                use_summer = _infer_dst(local, is_ambiguous, index)
+            elif ambiguous == 'winter':
+                use_summer[:] = False
+            elif ambiguous == 'drop':
+                count[is_ambiguous] = 0
+            elif ambiguous == 'raise':
+                raise pytz.AmbiguousTimeError(
+                    'Cannot infer dst time from {}, try using the '
+                    "'ambiguous' argument".format(
+                        index[is_ambiguous.argmax()]))
+            elif ambiguous != 'summer':
+                raise ValueError('Unknown ambiguous policy: {}'
+                                 .format(ambiguous))
+        else:
+            use_summer = np.asarray(ambiguous, dtype=bool)
+            if len(use_summer) != len(local):
+                raise ValueError('Length of ambiguous bool-array must be '
+                                 'the same size as the index')
+
+    is_nonexistent = (count == 0) & ~is_ambiguous & ~isnat
+    if is_nonexistent.any() and nonexistent == 'raise':
+        raise pytz.NonExistentTimeError(
+            str(index[is_nonexistent.argmax()]))
+
+    utc = local - np.where(use_summer, summer, winter)
+    utc[(count == 0) | isnat] = NAT
+
+    return pd.DatetimeIndex(utc.view('datetime64[ns]'), name=index.name)
+
+
+def _infer_dst(local, is_ambiguous, index):
+    """
+    Decide for each run of consecutive ambiguous times, where the times
+    start over, which ones are summertime (True) and which wintertime.
+
+    """
+
+    use_summer = np.ones(len(local), dtype=bool)
+    positions = np.flatnonzero(is_ambiguous)
+    runs = np.split(positions, np.flatnonzero(np.diff(positions) != 1) + 1)
+    for run in runs:
+        deltas = np.diff(local[run])
+        switches = np.flatnonzero(deltas <= 0)
+        if len(switches) == 0:
+            raise pytz.AmbiguousTimeError(
+                'Cannot infer dst time from {} as there are no repeated '
+                'times'.format(index[run[0]]))
+        if len(switches) > 1:
+            raise pytz.AmbiguousTimeError(
+                'There are {} dst switches when there should only be 1.'
+                .format(len(switches)))
+        use_summer[run[switches[0] + 1:]] = False
+
+    return use_summer